@@ -0,0 +1,109 @@
+"""Нагрузочный прогон клиента ржд против фейкового сервера из tests/fake_rzd.py.
+
+Считает поиски в секунду и перцентили задержки поиска. По умолчанию поднимает
+фейк в этом же процессе, --url позволяет направить клиент на внешний.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_load --searches 500 --concurrency 50 --distinct 100
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from src.core.cache import TTLCache
+from src.core.ratelimit import RateLimiter
+from src.core.rzd import RzdClient, _percentile
+from tests.fake_rzd import FakeRzd
+
+
+async def run_load(client: RzdClient, searches: int, concurrency: int, distinct: int):
+    """searches поисков по distinct разным датам, не больше concurrency одновременно"""
+    queue = asyncio.Queue()
+    start_date = datetime.now() + timedelta(days=1)
+    for i in range(searches):
+        queue.put_nowait(start_date + timedelta(days=i % distinct))
+
+    latencies = []
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        while not queue.empty():
+            date = queue.get_nowait()
+            started = time.perf_counter()
+            result = await client.get_train_routes(2000000, 2004000, date, "Купе")
+            latencies.append(time.perf_counter() - started)
+            if result is None:
+                failed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - started, sorted(latencies), failed
+
+
+async def main(args):
+    fake = None
+    url = args.url
+    if url is None:
+        fake = await FakeRzd(
+            rid_delay=args.rid_delay,
+            error_rate=args.error_rate,
+            trains=args.trains,
+        ).start()
+        url = fake.url
+
+    client = RzdClient(
+        base_url=url,
+        pool_size=args.pool_size,
+        cache=TTLCache(maxsize=0 if args.no_cache else 10000, ttl=300),
+        limiter=RateLimiter(
+            rate=args.rate_limit, burst=args.rate_limit, max_in_flight=args.pool_size
+        ),
+    )
+    try:
+        elapsed, latencies, failed = await run_load(
+            client, args.searches, args.concurrency, args.distinct
+        )
+        pool_stats = client.pool_stats()
+    finally:
+        await client.close()
+        if fake is not None:
+            await fake.stop()
+
+    print(
+        f"поисков: {args.searches}, одновременно: {args.concurrency},"
+        f" разных: {args.distinct}, ошибок: {failed}"
+    )
+    print(f"поисков в секунду: {args.searches / elapsed:.1f} (за {elapsed:.2f} с)")
+    for q in (0.5, 0.9, 0.99):
+        print(f"p{int(q * 100)}: {_percentile(latencies, q) * 1000:.1f} мс")
+    print(f"max: {latencies[-1] * 1000:.1f} мс")
+    print("пул:", pool_stats)
+    print("RID:", client.rid_stats())
+    print("кэш:", client.cache.stats())
+    print("склейка:", client.inflight.stats())
+    print("лимит:", client.limiter.stats())
+    if fake is not None:
+        print("фейк:", fake.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", help="внешний фейк, например http://127.0.0.1:8085/timetable/public/ru"
+    )
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--distinct", type=int, default=100)
+    parser.add_argument("--rid-delay", type=float, default=0.8)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--trains", type=int, default=0)
+    parser.add_argument("--pool-size", type=int, default=20)
+    parser.add_argument("--rate-limit", type=float, default=1000)
+    parser.add_argument("--no-cache", action="store_true")
+    # ошибки ржд считаем сами, в логе они только мешают
+    logging.disable(logging.ERROR)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,130 @@
+"""Сравнение разбора ответа ржд: старый get_parsed_data (dict на поезд, strptime)
+и новый parse_trains + select_class (NamedTuple записи, разбор даты без strptime).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_parser --trains 500 --cars 20
+"""
+
+import argparse
+import timeit
+import tracemalloc
+from datetime import datetime
+
+from src.core.rzd import _parse_datetime, parse_trains, select_class
+from tests.fake_rzd import CLASSES, make_response
+
+
+def legacy_get_parsed_data(result_data, place_type):
+    """get_parsed_data в том виде, в каком он был до компактных записей"""
+    routes = []
+    tp = result_data.get("tp", [])
+    if tp and isinstance(tp, list) and ("list" in tp[0]):
+        for train in tp[0]["list"]:
+            cars = train.get("cars")
+            freeseats = None
+            best_price = None
+            if cars:
+                prices = [
+                    c.get("tariff")
+                    for c in cars
+                    if (c.get("tariff") is not None)
+                    and (c.get("typeLoc") == place_type)
+                    and (c.get("disabledPerson", None) is None)
+                ]
+                if prices:
+                    best_price = min(prices)
+                    freeseats = cars[prices.index(best_price)].get("freeSeats")
+            if best_price is None:
+                continue
+
+            format = "%d.%m.%Y %H:%M"
+            date_time0 = datetime.strptime(
+                f'{train.get("date0")} {train.get("time0")}', format
+            )
+            date_time1 = datetime.strptime(
+                f'{train.get("date1")} {train.get("time1")}', format
+            )
+            routes.append(
+                {
+                    "route_id": train.get("number"),
+                    "station_from": train.get("station0"),
+                    "station_to": train.get("station1"),
+                    "station_code_from": train.get("code0"),
+                    "station_code_to": train.get("code1"),
+                    "route_global": f'{train.get("route0")}-{train.get("route1")}',
+                    "datetime0": date_time0,
+                    "datetime1": date_time1,
+                    "best_price": best_price,
+                    "class": place_type,
+                    "from": tp[0].get("from"),
+                    "fromCode": tp[0].get("fromCode"),
+                    "where": tp[0].get("where"),
+                    "whereCode": tp[0].get("whereCode"),
+                    "frseats": freeseats,
+                }
+            )
+    return routes
+
+
+def legacy_all_classes(data):
+    """старый способ получить все классы: отдельный разбор на каждый класс"""
+    return [legacy_get_parsed_data(data, place_type) for place_type in CLASSES]
+
+
+def new_all_classes(data):
+    trains = parse_trains(data)
+    return [select_class(trains, place_type) for place_type in CLASSES]
+
+
+def peak_memory(func, data) -> tuple:
+    """пиковая память во время разбора и сколько занимает результат"""
+    tracemalloc.start()
+    result = func(data)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, retained, result
+
+
+def bench(name: str, func, data, repeat: int):
+    _parse_datetime.cache_clear()
+    seconds = min(timeit.repeat(lambda: func(data), number=1, repeat=repeat))
+    _parse_datetime.cache_clear()
+    peak, retained, _ = peak_memory(func, data)
+    print(
+        f"{name:<34} {seconds * 1000:9.2f} мс"
+        f" {peak / 1024:10.1f} КиБ пик {retained / 1024:10.1f} КиБ результат"
+    )
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trains", type=int, default=500)
+    parser.add_argument("--cars", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = make_response(args.trains, args.cars)
+    print(f"поездов: {args.trains}, вагонов в поезде: {args.cars}")
+
+    old = bench(
+        "старый, один класс",
+        lambda d: legacy_get_parsed_data(d, "Купе"),
+        data,
+        args.repeat,
+    )
+    new = bench(
+        "новый, один класс",
+        lambda d: select_class(parse_trains(d), "Купе"),
+        data,
+        args.repeat,
+    )
+    print(f"ускорение на одном классе: x{old / new:.1f}")
+
+    old = bench("старый, все классы", legacy_all_classes, data, args.repeat)
+    new = bench("новый, все классы", new_all_classes, data, args.repeat)
+    print(f"ускорение на всех классах: x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
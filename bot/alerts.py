@@ -4,31 +4,41 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (CallbackQuery, InlineKeyboardButton,
                            InlineKeyboardMarkup)
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards.main_menu import main_menu_keyboard
-from src.db.database import session
-from src.db.models import User, UserStatus
-from src.db.queries import (check_user_is_banned, delete_subscription,
-                            get_city, get_user_subscrtions,
-                            get_users_subscribed_to_route)
+from src.db.async_queries import (check_user_is_banned, delete_subscription,
+                                  get_user_subscriptions_page)
 
 logger = logging.getLogger(__name__)
 router = Router()
 
+# сколько подписок показываем в одном сообщении
+ALERTS_PAGE_SIZE = 10
+
 
 @router.callback_query(F.data == "my_alerts")
-async def cb_get_alerts(callback_query: CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.startswith("my_alerts_"))
+async def cb_get_alerts(
+    callback_query: CallbackQuery, state: FSMContext, session: AsyncSession
+):
     """
-    Обработчик нажатия кнопки Получить оповещения
+    Обработчик нажатия кнопки Получить оповещения и кнопки Показать еще
     """
     user_id = callback_query.from_user.id
 
-    is_banned = check_user_is_banned(user_id)
-    if check_user_is_banned(user_id):
+    if await check_user_is_banned(session, user_id):
         await callback_query.answer("Вы заблокированы и не можете использовать бота.")
         return
 
-    subscriptions_info = get_user_subscrtions(user_id)
+    # my_alerts_<айди маршрута> - следующая страница после этого маршрута
+    after_route_id = 0
+    if callback_query.data.startswith("my_alerts_"):
+        after_route_id = int(callback_query.data.removeprefix("my_alerts_"))
+
+    subscriptions_info, next_after = await get_user_subscriptions_page(
+        session, user_id, after_route_id=after_route_id, limit=ALERTS_PAGE_SIZE
+    )
     if not subscriptions_info:
         await callback_query.message.answer(
             "У вас пока нет оповещений (подписок).", reply_markup=main_menu_keyboard()
@@ -43,8 +53,8 @@ async def cb_get_alerts(callback_query: CallbackQuery, state: FSMContext):
         route_id = route_info["route_id"]
         text_route = (
             f"Маршрут #{route_info['route_id']}:\n"
-            f"Станция отправления: {get_city(route_info['from_station']).city_name}\n"
-            f"Станция прибытия: {get_city(route_info['to_station']).city_name}\n"
+            f"Станция отправления: {route_info['from_city_name']}\n"
+            f"Станция прибытия: {route_info['to_city_name']}\n"
             f"Последняя цена:{route_info['best_price']} руб."
             f"Поезд: {route_info['train_no']} \n"
             f"Время отправления: {route_info['from_date']}\n"
@@ -60,6 +70,15 @@ async def cb_get_alerts(callback_query: CallbackQuery, state: FSMContext):
             ]
         )
 
+    if next_after is not None:
+        inline_kb.append(
+            [
+                InlineKeyboardButton(
+                    text="Показать еще", callback_data=f"my_alerts_{next_after}"
+                )
+            ]
+        )
+
     text_all = "\n\n".join(lines)
     keyboard = InlineKeyboardMarkup(inline_keyboard=inline_kb)
 
@@ -68,14 +87,14 @@ async def cb_get_alerts(callback_query: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data.startswith("del_sub_"))
 async def cb_delete_subscription_handler(
-    callback_query: CallbackQuery, state: FSMContext
+    callback_query: CallbackQuery, state: FSMContext, session: AsyncSession
 ):
     """
     Удаляем подписку пользователя на этот маршрут (если она у него есть).
     """
     user_id = callback_query.from_user.id
 
-    if check_user_is_banned(user_id):
+    if await check_user_is_banned(session, user_id):
         await callback_query.answer("Вы заблокированы.")
         return
 
@@ -87,7 +106,7 @@ async def cb_delete_subscription_handler(
         await callback_query.answer("Некорректный ID маршрута.")
         return
 
-    delete_subscription(user_id, route_id)
+    await delete_subscription(session, user_id, route_id)
 
     await callback_query.message.answer(
         f"Подписка на маршрут #{route_id} удалена (если она у вас была).",
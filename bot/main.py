@@ -1,17 +1,23 @@
 import asyncio
 import logging
 import os
+import time
 
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
 from bot.alerts import router as alerts_router
+from bot.middlewares.db import DbSessionMiddleware
 from bot.routers.start import router as start_router
 from bot.routers.tickets import router as tickets_router
-from src.core.update_db import update as update_db
-from src.db.database import session
-from src.db.queries import load_cities_from_json
+from src.core.config import refresh_settings
+from src.core.rzd import close_client
+from src.core.scheduler import RefreshScheduler
+from src.core.ticket_retention import retention as ticket_retention
+from src.core.update_db import update_due
+from src.db.async_queries import load_cities_from_json
+from src.db.database import async_engine, async_session
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,14 +36,31 @@ dp = Dispatcher(storage=MemoryStorage())
 
 
 async def scheduled_clean():
+    # маршруты обновляем по сроку из планировщика (или это делают воркеры
+    # src/core/refresh_worker.py), историю цен чистим раз в сутки
+    scheduler = RefreshScheduler()
+    retention_at = time.monotonic()
     while True:
-        update_db()
-        logger.info("Периодическое обновление базы данных выполнено.")
-        await asyncio.sleep(86400)
+        try:
+            if refresh_settings.IN_BOT:
+                await update_due(bot, scheduler)
+            if time.monotonic() >= retention_at:
+                await ticket_retention()
+                retention_at = time.monotonic() + 86400
+                logger.info("Периодическая очистка истории цен выполнена.")
+        except Exception:
+            logger.exception("Ошибка периодического обновления базы данных")
+        await asyncio.sleep(refresh_settings.TICK)
 
 
 async def main():
-    load_cities_from_json("./resources/city_codes.json")
+    # при неизменном city_codes.json загрузка пропускается
+    async with async_session() as session:
+        added = await load_cities_from_json(session, "./resources/city_codes.json")
+    if added is not None:
+        logger.info(f"Загружены коды городов, новых: {added}")
+
+    dp.update.middleware(DbSessionMiddleware(async_session))
 
     dp.include_router(start_router)
     dp.include_router(alerts_router)
@@ -46,7 +69,11 @@ async def main():
     asyncio.create_task(scheduled_clean())
 
     logger.info("Запуск бота...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await close_client()
+        await async_engine.dispose()
 
 
 if __name__ == "__main__":
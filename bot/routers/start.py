@@ -3,23 +3,22 @@ import logging
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards.main_menu import main_menu_keyboard
-from src.db.database import session
-from src.db.models import User, UserStatus
-from src.db.queries import add_user
+from src.db.async_queries import add_user, get_user
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
 @router.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, session: AsyncSession):
     user_id = message.from_user.id
-    user = session.query(User).filter_by(user_id=user_id).first()
+    user = await get_user(session, user_id)
 
     if not user:
-        add_user(user_id)
+        await add_user(session, user_id)
         welcome_text = (
             f"Добро пожаловать, {message.from_user.first_name}! "
             "Вы успешно зарегистрированы.\nВыберите действие ниже:"
@@ -6,16 +6,14 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from bot.keyboards.main_menu import main_menu_keyboard
 from bot.keyboards.subscribe_button import subscribe_button
 from bot.keyboards.ticket_options import ticket_options_keyboard
-from src.core.rzd import get_train_routes_with_session
-from src.db.database import session
-from src.db.models import User, UserStatus
-from src.db.queries import (add_route, add_station, add_subscription,
-                            add_ticket, check_user_is_banned, get_city_code,
-                            get_user_subscrtions)
+from src.core.rzd import get_train_routes
+from src.core.stations import get_station_index
+from src.db.async_queries import check_user_is_banned, subscribe_to_route
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -41,13 +39,33 @@ def check_date_correctness(date_str: str):
     return date_obj, None
 
 
+def check_city(city_name: str):
+    """
+    Ищет код города в индексе станций, при опечатке предлагает похожие названия
+    """
+    index = get_station_index()
+    code = index.lookup(city_name)
+    if code is not None:
+        return code, None
+    suggestions = index.suggest(city_name)
+    if suggestions:
+        return None, (
+            "Город не найден. Возможно, вы имели в виду: "
+            + ", ".join(suggestions)
+            + ". Введите заново."
+        )
+    return None, "Город не найден. Введите заново."
+
+
 @router.callback_query(F.data == "get_tickets")
-async def cb_get_tickets(callback_query: CallbackQuery, state: FSMContext):
+async def cb_get_tickets(
+    callback_query: CallbackQuery, state: FSMContext, session: AsyncSession
+):
     """
     Нажали кнопку получить билеты
     """
     user_id = callback_query.from_user.id
-    if check_user_is_banned(user_id):
+    if await check_user_is_banned(session, user_id):
         await callback_query.answer("Вы заблокированы.")
         return
 
@@ -59,6 +77,11 @@ async def cb_get_tickets(callback_query: CallbackQuery, state: FSMContext):
 @router.message(TicketSearchForm.origin)
 async def process_ticket_origin(message: Message, state: FSMContext):
     text = message.text.strip()
+    _, error = check_city(text)
+    if error:
+        await message.answer(error)
+        return
+
     await state.update_data(origin=text)
     await state.set_state(TicketSearchForm.destination)
     await message.answer("Введите город назначения:")
@@ -67,6 +90,11 @@ async def process_ticket_origin(message: Message, state: FSMContext):
 @router.message(TicketSearchForm.destination)
 async def process_ticket_destination(message: Message, state: FSMContext):
     text = message.text.strip()
+    _, error = check_city(text)
+    if error:
+        await message.answer(error)
+        return
+
     await state.update_data(destination=text)
     await state.set_state(TicketSearchForm.date)
     await message.answer("Введите дату поездки (ДД.ММ.ГГГГ):")
@@ -91,9 +119,11 @@ async def process_ticket_date(message: Message, state: FSMContext):
     TicketSearchForm.class_type,
     F.data.in_(["ticket_econom", "ticket_business", "ticket_first", "ticket_seated"]),
 )
-async def process_ticket_class(callback_query: CallbackQuery, state: FSMContext):
+async def process_ticket_class(
+    callback_query: CallbackQuery, state: FSMContext, session: AsyncSession
+):
     user_id = callback_query.from_user.id
-    if check_user_is_banned(user_id):
+    if await check_user_is_banned(session, user_id):
         await callback_query.answer("Вы заблокированы.")
         return
 
@@ -120,17 +150,16 @@ async def process_ticket_class(callback_query: CallbackQuery, state: FSMContext)
         await state.set_state(TicketSearchForm.date)
         return
 
-    try:
-        code_from = get_city_code(origin)
-        code_to = get_city_code(destination)
-    except ValueError:
+    code_from, _ = check_city(origin)
+    code_to, _ = check_city(destination)
+    if code_from is None or code_to is None:
         await callback_query.message.answer(
             "Не удалось найти коды станций, попробуйте другие города."
         )
         await state.clear()
         return
 
-    result_data = get_train_routes_with_session(
+    result_data = await get_train_routes(
         code_from, code_to, date_obj, place_type=class_type_str
     )
 
@@ -149,13 +178,13 @@ async def process_ticket_class(callback_query: CallbackQuery, state: FSMContext)
     for index, route in enumerate(result_data):
         resp = (
             f"Маршрут №{index + 1}\n"
-            f"ID: {route['route_id']}\n"
-            f"{route['station_from']} -> {route['station_to']}\n"
-            f"Отправление: {route['datetime0']}\n"
-            f"Прибытие: {route['datetime1']}\n"
-            f"Класс: {route['class']}\n"
-            f"Свободные места: {route['frseats']}\n"
-            f"Цена: {route['best_price']} руб.\n"
+            f"ID: {route.route_id}\n"
+            f"{route.station_from} -> {route.station_to}\n"
+            f"Отправление: {route.datetime0}\n"
+            f"Прибытие: {route.datetime1}\n"
+            f"Класс: {route.class_name}\n"
+            f"Свободные места: {route.frseats}\n"
+            f"Цена: {route.best_price} руб.\n"
         )
         await callback_query.message.answer(resp, reply_markup=subscribe_button(index))
 
@@ -166,12 +195,14 @@ async def process_ticket_class(callback_query: CallbackQuery, state: FSMContext)
 
 
 @router.callback_query(F.data.startswith("subscribe_"))
-async def cb_subscribe_route(callback_query: CallbackQuery, state: FSMContext):
+async def cb_subscribe_route(
+    callback_query: CallbackQuery, state: FSMContext, session: AsyncSession
+):
     """
     Когда пользователь нажимает «Подписаться» на конкретный маршрут
     """
     user_id = callback_query.from_user.id
-    if check_user_is_banned(user_id):
+    if await check_user_is_banned(session, user_id):
         await callback_query.answer("Вы заблокированы.")
         return
     data_parts = callback_query.data.split("_")
@@ -180,31 +211,37 @@ async def cb_subscribe_route(callback_query: CallbackQuery, state: FSMContext):
     routes = stored_data.get("searched_routes")
     route_info = routes[int(data_parts[1])]
 
-    from_station_name = route_info["station_from"]
-    to_station_name = route_info["station_to"]
-    from_date = route_info["datetime0"]
-    to_date = route_info["datetime1"]
-    train_no = route_info["route_id"]
-    class_name = route_info["class"]
-    city_from = route_info["from"]
-    city_from_code = route_info["fromCode"]
-    station_code_from = route_info["station_code_from"]
-    station_code_to = route_info["station_code_to"]
-    city_where_code = route_info["whereCode"]
-
-    add_station(city_from_code, station_code_from, from_station_name)
-    add_station(city_where_code, station_code_to, to_station_name)
-
-    route_id_db = add_route(
-        from_station_id=station_code_from,
-        to_station_id=station_code_to,
-        from_date=from_date,
-        to_date=to_date,
-        train_no=train_no,
-        class_name=class_name.lower(),
+    from_station_name = route_info.station_from
+    to_station_name = route_info.station_to
+    from_date = route_info.datetime0
+    to_date = route_info.datetime1
+    train_no = route_info.route_id
+    class_name = route_info.class_name
+    city_from = route_info.city_from
+    city_from_code = route_info.city_from_code
+    station_code_from = route_info.station_code_from
+    station_code_to = route_info.station_code_to
+    city_where_code = route_info.city_where_code
+
+    # станции, маршрут, подписка и первая цена - одним запросом в одной транзакции
+    await subscribe_to_route(
+        session,
+        user_id,
+        {
+            "from_city_id": city_from_code,
+            "from_station_id": station_code_from,
+            "from_station_name": from_station_name,
+            "to_city_id": city_where_code,
+            "to_station_id": station_code_to,
+            "to_station_name": to_station_name,
+            "from_date": from_date,
+            "to_date": to_date,
+            "train_no": train_no,
+            "class_name": class_name.lower(),
+            "best_price": route_info.best_price,
+            "free_seats": route_info.frseats,
+        },
     )
-    add_subscription(user_id, route_id_db)
-    add_ticket(route_id_db, route_info["best_price"])
 
     await callback_query.message.answer(
         f"Вы подписались на маршрут \n" f"({from_station_name} -> {to_station_name})."
@@ -1,21 +1,21 @@
 import logging
 
 from aiogram import Bot
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.db.database import session
-from src.db.models import Route
-from src.db.queries import (get_route_with_tickets_by_id,
-                            get_users_subscribed_to_route)
+from src.db.async_queries import get_route, get_users_subscribed_to_route
 
 logger = logging.getLogger(__name__)
 
 
-async def notify_price_change(bot: Bot, route_id: int, old_price: int, new_price: int):
+async def notify_price_change(
+    session: AsyncSession, bot: Bot, route_id: int, old_price: int, new_price: int
+):
     """
     Оповещает всех пользователей
     что цена изменилась
     """
-    route = session.query(Route).filter_by(route_id=route_id).first()
+    route = await get_route(session, route_id)
     if not route:
         logger.warning(f"Не найден route_id={route_id} для оповещения о цене")
         return
@@ -42,7 +42,7 @@ async def notify_price_change(bot: Bot, route_id: int, old_price: int, new_price
         f"Новая цена: {new_price} руб."
     )
 
-    user_ids = get_users_subscribed_to_route(route_id)
+    user_ids = await get_users_subscribed_to_route(session, route_id)
     if not user_ids:
         logger.info(
             f"Нет подписчиков у route_id={route_id}, сообщение никому не отправляем."
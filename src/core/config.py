@@ -0,0 +1,92 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class RzdSettings(BaseSettings):
+    """настройки клиента апи ржд, у всего есть дефолты, так что .env не обязателен"""
+
+    # адрес апи расписания, для тестов и нагрузки можно направить на tests/fake_rzd.py
+    BASE_URL: str = "https://pass.rzd.ru/timetable/public/ru"
+    # размер пула keep-alive соединений к pass.rzd.ru
+    POOL_SIZE: int = 10
+    # сколько секунд держим простаивающее соединение открытым
+    KEEPALIVE_TIMEOUT: float = 30
+    # общий таймаут одного запроса в секундах
+    REQUEST_TIMEOUT: float = 30
+    HEADERS_PATH: str = "resources/headers.json"
+
+    # опрос RID: первая пауза, множитель роста паузы, потолок паузы
+    # и сколько всего секунд ждем готовности, прежде чем сдаться
+    RID_FIRST_DELAY: float = 0.25
+    RID_BACKOFF: float = 1.5
+    RID_MAX_DELAY: float = 2.0
+    RID_TIMEOUT: float = 20
+
+    # кэш поисков (откуда, куда, дата, с местами): сколько секунд живет ответ
+    # и сколько разных поисков держим в памяти
+    CACHE_TTL: float = 300
+    CACHE_SIZE: int = 1000
+
+    # общий лимит запросов к pass.rzd.ru: запросов в секунду, размер пачки
+    # и сколько запросов одновременно в полете (0 - по размеру пула)
+    RATE_LIMIT: float = 5
+    RATE_BURST: int = 10
+    MAX_IN_FLIGHT: int = 0
+
+    model_config = SettingsConfigDict(
+        env_file=".env", env_prefix="RZD_", extra="ignore"
+    )
+
+
+rzd_settings = RzdSettings()
+
+
+class TicketHistorySettings(BaseSettings):
+    """хранение истории цен: сколько держим сырые билеты и почасовые агрегаты"""
+
+    # сырые билеты храним столько полных месяцев, потом секция сворачивается
+    # в почасовые агрегаты и удаляется целиком
+    RAW_RETENTION_MONTHS: int = 3
+    # почасовые агрегаты старше этого сворачиваются в подневные
+    HOURLY_RETENTION_DAYS: int = 90
+    # на сколько месяцев вперед заранее создаем секции t_ticket
+    PARTITIONS_AHEAD: int = 2
+
+    model_config = SettingsConfigDict(
+        env_file=".env", env_prefix="TICKET_", extra="ignore"
+    )
+
+
+ticket_history_settings = TicketHistorySettings()
+
+
+class RefreshSettings(BaseSettings):
+    """обновление цен по подпискам"""
+
+    # сколько поисков в ржд цикл обновления держит одновременно
+    CONCURRENCY: int = 5
+
+    # планировщик: как часто смотрим, чей срок подошел, и сколько поисков
+    # в ржд делаем за один такой заход
+    TICK: float = 60
+    MAX_FETCHES_PER_TICK: int = 50
+    # границы интервала между проверками одного маршрута в секундах
+    MIN_INTERVAL: float = 300
+    MAX_INTERVAL: float = 86400
+    # за сколько последних дней считаем изменения цены
+    VOLATILITY_DAYS: int = 7
+
+    # воркеры очереди t_refresh_job (python -m src.core.refresh_worker):
+    # сколько процессов, на сколько секунд воркер берет задачу и сколько
+    # задач за раз (их поиски идут параллельно)
+    WORKERS: int = 2
+    LEASE_SECONDS: float = 300
+    CLAIM_BATCH: int = 5
+    # false, если цены обновляют воркеры, а не сам бот или regular script.py
+    IN_BOT: bool = True
+
+    model_config = SettingsConfigDict(
+        env_file=".env", env_prefix="REFRESH_", extra="ignore"
+    )
+
+
+refresh_settings = RefreshSettings()
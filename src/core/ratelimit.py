@@ -0,0 +1,141 @@
+import asyncio
+import enum
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+
+class Priority(enum.IntEnum):
+    """чем меньше значение, тем раньше обслуживаем"""
+
+    interactive = 0
+    background = 1
+
+
+class RateLimiter:
+    """общий лимит исходящих запросов: token bucket + ограничение одновременных запросов
+
+    Токены копятся со скоростью rate в секунду, но не больше burst.
+    Ждущие обслуживаются по приоритету, внутри приоритета - по очереди.
+    """
+
+    def __init__(
+        self, rate: float, burst: int, max_in_flight: int, clock=time.monotonic
+    ):
+        if rate <= 0:
+            raise ValueError(f"скорость лимита должна быть больше нуля, а не {rate}")
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self._clock = clock
+
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._in_flight = 0
+        # куча из (приоритет, номер в очереди, future)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._timer = None
+        # event loop, в котором ждут сейчас: синхронная обертка ржд на каждый
+        # вызов запускает свой asyncio.run, а лимитер общий на процесс
+        self._loop = None
+
+        # время в очереди по приоритетам
+        self.wait_stats = {
+            priority: {"count": 0, "total": 0.0, "max": 0.0} for priority in Priority
+        }
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _dispatch(self):
+        """раздаем свободные слоты и токены ждущим в порядке приоритета"""
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                # ждущего отменили
+                heapq.heappop(self._waiters)
+                continue
+            if self._in_flight >= self.max_in_flight:
+                return
+
+            self._refill()
+            if self._tokens < 1:
+                # проснемся, когда накопится следующий токен
+                if self._timer is None:
+                    delay = (1 - self._tokens) / self.rate
+                    self._timer = asyncio.get_running_loop().call_later(
+                        delay, self._on_timer
+                    )
+                return
+
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._in_flight += 1
+            future.set_result(None)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _bind_loop(self, loop):
+        """таймер и ждущие прошлого event loop уже никогда не сработают, забываем их"""
+        if loop is not self._loop:
+            self._loop = loop
+            self._timer = None
+            self._waiters = []
+
+    async def acquire(self, priority: Priority = Priority.background):
+        started = self._clock()
+        loop = asyncio.get_running_loop()
+        self._bind_loop(loop)
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # слот уже выдали, но нас успели отменить - отдаем его обратно
+                self.release()
+            raise
+
+        waited = self._clock() - started
+        stats = self.wait_stats[priority]
+        stats["count"] += 1
+        stats["total"] += waited
+        stats["max"] = max(stats["max"], waited)
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def limit(self, priority: Priority = Priority.background):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        queued = {priority.name: 0 for priority in Priority}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued[Priority(priority).name] += 1
+
+        wait = {}
+        for priority, stats in self.wait_stats.items():
+            wait[priority.name] = {
+                "count": stats["count"],
+                "avg": stats["total"] / stats["count"] if stats["count"] else 0.0,
+                "max": stats["max"],
+            }
+        return {"in_flight": self._in_flight, "queued": queued, "wait": wait}
@@ -0,0 +1,207 @@
+"""Воркеры обновления цен по очереди задач t_refresh_job.
+
+Каждый процесс забирает задачи (ключ поиска ржд) через FOR UPDATE SKIP LOCKED,
+обновляет маршруты задачи и ставит ей следующий срок по формуле планировщика
+из src/core/scheduler.py. Процессов может быть сколько угодно, в том числе
+на разных машинах, лишь бы база была общая. Задачи упавшего воркера другие
+забирают, когда истечет аренда (REFRESH_LEASE_SECONDS).
+
+Ограничитель запросов к ржд у каждого процесса свой, поэтому main делит
+RZD_RATE_LIMIT, RZD_RATE_BURST и RZD_MAX_IN_FLIGHT поровну между воркерами
+и передает доли дочерним процессам через переменные окружения: все воркеры
+одного запуска вместе не выходят за общий лимит. Воркеры на других машинах
+и обновление в процессе бота (REFRESH_IN_BOT) в эту долю не входят, лимиты
+для них нужно разделить самим.
+
+Запуск из корня репозитория:
+    python -m src.core.refresh_worker --workers 4
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from datetime import datetime
+
+from aiogram import Bot
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.config import settings
+from src.core.config import refresh_settings, rzd_settings
+from src.core.ratelimit import Priority
+from src.core.rzd import close_client, get_trains
+from src.core.scheduler import route_interval
+from src.core.update_db import (match_routes, purge_departed, report_missing,
+                                write_route)
+from src.db.async_queries import (claim_refresh_jobs, finish_refresh_job,
+                                  get_routes_for_job, sync_refresh_jobs)
+from src.db.database import async_engine, async_session
+
+logger = logging.getLogger(__name__)
+
+# сколько секунд ждем, если свободных задач нет
+IDLE_SLEEP = 5
+
+
+def retry_delay(attempts: int) -> float:
+    """отсрочка после неудачи, удваивается с каждой попыткой подряд"""
+    return min(
+        refresh_settings.MIN_INTERVAL * 2 ** max(attempts - 1, 0),
+        refresh_settings.MAX_INTERVAL,
+    )
+
+
+async def plan(session: AsyncSession) -> dict | None:
+    """раскладка задач и чистка ушедших маршрутов, делает один воркер за раз"""
+    stats = await sync_refresh_jobs(session)
+    if stats is not None:
+        await purge_departed(session)
+        logger.info(
+            f"Задачи обновления: новых {stats['added']}, удалено {stats['removed']}"
+        )
+    return stats
+
+
+async def work_once(
+    session: AsyncSession, bot: Bot, worker: str, limit: int = None
+) -> int:
+    """забираем пачку задач, обновляем их маршруты и отпускаем задачи
+
+    Поиски пачки идут параллельно, пишем в базу по очереди через одну сессию.
+    Возвращает, сколько задач забрали.
+    """
+    jobs = await claim_refresh_jobs(
+        session,
+        worker,
+        limit or refresh_settings.CLAIM_BATCH,
+        refresh_settings.LEASE_SECONDS,
+    )
+    if not jobs:
+        return 0
+    groups = [
+        await get_routes_for_job(session, job, refresh_settings.VOLATILITY_DAYS)
+        for job in jobs
+    ]
+
+    async def fetch(group: list):
+        if not group:
+            return None
+        first = group[0]
+        return await get_trains(
+            first["from_station_city"],
+            first["to_station_city"],
+            first["from_date"],
+            priority=Priority.background,
+        )
+
+    results = await asyncio.gather(
+        *(fetch(group) for group in groups), return_exceptions=True
+    )
+    for job, group, trains in zip(jobs, groups, results):
+        # ржд не ответили - повторим позже с отсрочкой
+        if isinstance(trains, Exception) or (group and trains is None):
+            logger.warning(f"Поиск по задаче обновления {job['job_id']} не удался")
+            await finish_refresh_job(
+                session, job["job_id"], worker, retry_delay(job["attempts"]), ok=False
+            )
+            continue
+        try:
+            matched, missing = match_routes(
+                group, [] if trains == "NO TICKETS" else trains or []
+            )
+            report_missing(missing)
+            for obj, route in matched:
+                await write_route(session, bot, obj, route)
+        except Exception:
+            logger.exception(f"Задача обновления {job['job_id']} не выполнена")
+            await session.rollback()
+            await finish_refresh_job(
+                session, job["job_id"], worker, retry_delay(job["attempts"]), ok=False
+            )
+            continue
+
+        now = datetime.now()
+        delay = min(
+            (route_interval(route, now) for route in group),
+            default=refresh_settings.MAX_INTERVAL,
+        )
+        if not await finish_refresh_job(session, job["job_id"], worker, delay):
+            logger.warning(
+                f"Аренда задачи {job['job_id']} истекла, ее уже забрал другой воркер"
+            )
+    return len(jobs)
+
+
+async def run_worker(worker: str):
+    bot = Bot(token=settings.BOT_TOKEN)
+    planned_at = None
+    try:
+        while True:
+            try:
+                async with async_session() as session:
+                    if (
+                        planned_at is None
+                        or time.monotonic() - planned_at >= refresh_settings.TICK
+                    ):
+                        planned_at = time.monotonic()
+                        await plan(session)
+                    done = await work_once(session, bot, worker)
+            except Exception:
+                logger.exception(f"Ошибка воркера обновления {worker}")
+                done = 0
+            if not done:
+                await asyncio.sleep(IDLE_SLEEP)
+    finally:
+        await bot.session.close()
+        await close_client()
+        await async_engine.dispose()
+
+
+def worker_process():
+    logging.basicConfig(level=logging.INFO)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Запуск воркера обновления {worker}")
+    try:
+        asyncio.run(run_worker(worker))
+    except KeyboardInterrupt:
+        logger.info(f"Воркер обновления {worker} остановлен")
+
+
+def worker_limits(workers: int) -> dict:
+    """доля лимитов ржд на один процесс, не меньше одного запроса"""
+    in_flight = rzd_settings.MAX_IN_FLIGHT or rzd_settings.POOL_SIZE
+    return {
+        "RZD_RATE_LIMIT": str(rzd_settings.RATE_LIMIT / workers),
+        "RZD_RATE_BURST": str(max(rzd_settings.RATE_BURST // workers, 1)),
+        "RZD_MAX_IN_FLIGHT": str(max(in_flight // workers, 1)),
+    }
+
+
+def main(workers: int):
+    # дочерние процессы читают настройки заново, так что доли лимитов
+    # доходят до них через окружение
+    os.environ.update(worker_limits(workers))
+    # свежий интерпретатор на процесс: движок базы и клиент ржд не делим через fork
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=worker_process, name=f"refresh-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # ctrl+c получают и дочерние процессы, ждем, пока они закроются
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=refresh_settings.WORKERS)
+    main(parser.parse_args().workers)
@@ -1,16 +1,55 @@
+import asyncio
 import time
 
 import schedule
+from aiogram import Bot
 
-from .update_db import update
+from bot.config import settings
+from src.db.database import async_engine
+
+from .config import refresh_settings
+from .rzd import close_client
+from .scheduler import RefreshScheduler
+from .ticket_retention import retention
+from .update_db import update_due
+
+# сроки маршрутов живут между запусками в памяти процесса
+scheduler = RefreshScheduler()
+
+
+async def run_update():
+    bot = Bot(token=settings.BOT_TOKEN)
+    try:
+        await update_due(bot, scheduler)
+    finally:
+        await bot.session.close()
+        # пул соединений и клиент ржд привязаны к event loop,
+        # а каждый запуск - свой asyncio.run
+        await close_client()
+        await async_engine.dispose()
 
 
 def job():
-    """Задача, которая будет выполняться каждые 5 минут"""
-    update()
+    """Заход планировщика: обновляем маршруты, чей срок подошел"""
+    asyncio.run(run_update())
+
+
+async def run_retention():
+    try:
+        await retention()
+    finally:
+        await async_engine.dispose()
+
+
+def retention_job():
+    """Раз в сутки сворачиваем и удаляем старую историю цен"""
+    asyncio.run(run_retention())
 
 
-schedule.every(5).minutes.do(job)
+# при REFRESH_IN_BOT=false цены обновляют воркеры src/core/refresh_worker.py
+if refresh_settings.IN_BOT:
+    schedule.every(refresh_settings.TICK).seconds.do(job)
+schedule.every().day.do(retention_job)
 
 while True:
     schedule.run_pending()
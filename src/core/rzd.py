@@ -1,10 +1,384 @@
+import asyncio
 import http
 import json
 import logging
 import time
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
 
-import requests
+import aiohttp
+
+from src.core.cache import TTLCache
+from src.core.config import rzd_settings
+from src.core.ratelimit import Priority, RateLimiter
+from src.core.singleflight import SingleFlight
+from src.core.stations import get_station_index
+from src.db.models import RouteType
+
+
+def _setting(value, default):
+    """явно переданное значение, даже 0, иначе значение из настроек"""
+    return default if value is None else value
+
+
+class RzdClient:
+    """долгоживущий клиент апи ржд
+
+    Держит общий пул keep-alive соединений и заголовки, прочитанные один раз.
+    На каждый поиск заводится легкая сессия поверх общего пула, чтобы куки
+    RID-рукопожатия разных поисков не перемешивались.
+    """
+
+    def __init__(
+        self,
+        base_url: str = None,
+        pool_size: int = None,
+        keepalive_timeout: float = None,
+        request_timeout: float = None,
+        headers_path: str = None,
+        rid_first_delay: float = None,
+        rid_backoff: float = None,
+        rid_max_delay: float = None,
+        rid_timeout: float = None,
+        cache: TTLCache = None,
+        limiter: RateLimiter = None,
+    ):
+        self.base_url = _setting(base_url, rzd_settings.BASE_URL)
+        self.pool_size = _setting(pool_size, rzd_settings.POOL_SIZE)
+        self.keepalive_timeout = _setting(
+            keepalive_timeout, rzd_settings.KEEPALIVE_TIMEOUT
+        )
+        self.timeout = aiohttp.ClientTimeout(
+            total=_setting(request_timeout, rzd_settings.REQUEST_TIMEOUT)
+        )
+        with open(_setting(headers_path, rzd_settings.HEADERS_PATH)) as file:
+            self.headers = json.load(file)
+
+        self._connector = None
+        self._trace_config = aiohttp.TraceConfig()
+        self._trace_config.on_connection_create_end.append(self._on_connection_opened)
+        self._trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+        self.rid_first_delay = _setting(rid_first_delay, rzd_settings.RID_FIRST_DELAY)
+        self.rid_backoff = _setting(rid_backoff, rzd_settings.RID_BACKOFF)
+        self.rid_max_delay = _setting(rid_max_delay, rzd_settings.RID_MAX_DELAY)
+        self.rid_timeout = _setting(rid_timeout, rzd_settings.RID_TIMEOUT)
+        # сколько секунд RID реально становился готовым, последние замеры
+        self.rid_ready_times = deque(maxlen=1000)
+        self.rid_attempts = deque(maxlen=1000)
+        self.rid_timeouts = 0
+
+        if cache is None:
+            cache = TTLCache(rzd_settings.CACHE_SIZE, rzd_settings.CACHE_TTL)
+        self.cache = cache
+        self.inflight = SingleFlight()
+        if limiter is None:
+            limiter = RateLimiter(
+                rzd_settings.RATE_LIMIT,
+                rzd_settings.RATE_BURST,
+                rzd_settings.MAX_IN_FLIGHT or self.pool_size,
+            )
+        self.limiter = limiter
+
+    async def _on_connection_opened(self, session, ctx, params):
+        self.connections_opened += 1
+
+    async def _on_connection_reused(self, session, ctx, params):
+        self.connections_reused += 1
+
+    @property
+    def connector(self) -> aiohttp.TCPConnector:
+        # коннектор создаем лениво, ему нужен запущенный event loop
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+        return self._connector
+
+    def pool_stats(self) -> dict:
+        """статистика пула: сколько соединений открыто, переиспользовано и простаивает"""
+        idle = 0
+        if self._connector is not None and not self._connector.closed:
+            # у aiohttp нет публичного api для простаивающих соединений
+            idle = sum(len(conns) for conns in self._connector._conns.values())
+        return {
+            "opened": self.connections_opened,
+            "reused": self.connections_reused,
+            "idle": idle,
+            "limit": self.pool_size,
+        }
+
+    def rid_stats(self) -> dict:
+        """время готовности RID по последним поискам, чтобы подбирать расписание опроса"""
+        times = sorted(self.rid_ready_times)
+        if not times:
+            return {"count": 0, "timeouts": self.rid_timeouts}
+        return {
+            "count": len(times),
+            "timeouts": self.rid_timeouts,
+            "avg": sum(times) / len(times),
+            "p50": _percentile(times, 0.5),
+            "p95": _percentile(times, 0.95),
+            "max": times[-1],
+            "avg_attempts": sum(self.rid_attempts) / len(self.rid_attempts),
+        }
+
+    def session(self) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            headers=self.headers,
+            timeout=self.timeout,
+            trace_configs=[self._trace_config],
+        )
+
+    async def close(self):
+        if self._connector is not None:
+            await self._connector.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _get_json(
+        self, session: aiohttp.ClientSession, params: dict, priority: Priority
+    ):
+        """один GET к апи ржд через общий лимит запросов, возвращает json или None"""
+        async with self.limiter.limit(priority), session.get(
+            self.base_url, params=params
+        ) as response:
+            if response.status != http.HTTPStatus.OK:
+                logging.error(
+                    f"Что-то пошло не так при запросе к РЖД, статус ошибки: {response.status}, причина: {response.reason}"
+                )
+                return None
+            try:
+                return await response.json(content_type=None)
+            except (json.JSONDecodeError, aiohttp.ContentTypeError) as e:
+                logging.error(f"Ошибка преобразования ответа в JSON: {e}")
+                logging.debug(await response.text())
+                return None
+
+    async def _poll_rid(
+        self, session: aiohttp.ClientSession, params: dict, rid, priority: Priority
+    ):
+        """опрашивает RID по нарастающему расписанию, пока ответ не будет готов
+
+        Повторный result == "RID" значит, что ржд еще не собрал ответ.
+        """
+        started = time.monotonic()
+        delay = self.rid_first_delay
+        attempts = 0
+        while True:
+            await asyncio.sleep(delay)
+            attempts += 1
+            data = await self._get_json(session, {**params, "rid": rid}, priority)
+            if data is None:
+                return None
+            if data.get("result") != "RID":
+                elapsed = time.monotonic() - started
+                self.rid_ready_times.append(elapsed)
+                self.rid_attempts.append(attempts)
+                logging.info(
+                    f"RID {rid} готов через {elapsed:.2f} с, попыток: {attempts}"
+                )
+                return data
+
+            if time.monotonic() - started + delay > self.rid_timeout:
+                self.rid_timeouts += 1
+                logging.error(f"RID {rid} не готов за {self.rid_timeout} с, сдаемся")
+                return None
+            rid = data.get("RID", rid)
+            delay = min(delay * self.rid_backoff, self.rid_max_delay)
+
+    async def fetch_trains(
+        self,
+        code_from: int,
+        code_to: int,
+        date: datetime,
+        with_seats: bool = True,
+        priority: Priority = Priority.interactive,
+    ):
+        """Асинхронное получение всех поездов от города с кодом code_from в город с code_to.
+
+        Апи ржд отвечает в два шага: сначала отдает RID, и уже по нему
+        через какое-то время можно забрать сами поезда. RID опрашиваем по короткому
+        нарастающему расписанию, не блокируя event loop.
+
+        Возвращает ответ ржд без фильтрации по классу, "NO TICKETS" или None при ошибке.
+        Все запросы идут через общий лимит, priority - место в его очереди.
+        """
+
+        params = {
+            "layer_id": 5827,
+            "dir": 0,
+            "tfl": 1,
+            "checkSeats": 1 if with_seats else 0,
+            "code0": code_from,
+            "code1": code_to,
+            "dt0": date.strftime("%d.%m.%Y"),
+        }
+
+        try:
+            async with self.session() as session:
+                data = await self._get_json(session, params, priority)
+                if data is None:
+                    return None
+
+                result = data.get("result")
+                if result == "OK":
+                    logging.info("Нет доступных билетов.")
+                    return "NO TICKETS"
+                if result != "RID":
+                    return None
+
+                rid = data.get("RID")
+                logging.info(f"Первый запрос выполнен успешно, JSON: {data}")
+
+                data = await self._poll_rid(session, params, rid, priority)
+                if data is None:
+                    return None
+                logging.info(f"Второй запрос выполнен успешно, JSON: {data}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Не удалось выполнить запрос к РЖД: {e}")
+            return None
+
+        return data
+
+    async def get_trains(
+        self,
+        code_from: int,
+        code_to: int,
+        date: datetime,
+        with_seats: bool = True,
+        priority: Priority = Priority.interactive,
+    ):
+        """все поезда поиска, разобранные по всем классам (см. parse_trains)
+
+        Сначала смотрим в кэш поисков и присоединяемся к такому же поиску,
+        если он уже идет. Возвращает список поездов, "NO TICKETS" или None.
+        """
+        key = cache_key(code_from, code_to, date, with_seats)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        # одинаковые одновременные поиски ждут один запрос к ржд
+        return await self.inflight.do(
+            key,
+            self._fetch_and_cache,
+            key,
+            code_from,
+            code_to,
+            date,
+            with_seats,
+            priority,
+        )
+
+    async def _fetch_and_cache(
+        self, key, code_from, code_to, date, with_seats, priority
+    ):
+        data = await self.fetch_trains(code_from, code_to, date, with_seats, priority)
+        if isinstance(data, dict):
+            data = parse_trains(data)
+        # ошибки не кэшируем, следующий поиск пусть идет в ржд заново
+        if data is not None:
+            self.cache.set(key, data)
+        return data
+
+    async def get_train_routes(
+        self,
+        code_from: int,
+        code_to: int,
+        date: datetime,
+        place_type: str = None,
+        with_seats: bool = True,
+        priority: Priority = Priority.interactive,
+    ):
+        """маршруты от города с кодом code_from в город с code_to, отфильтрованные по классу"""
+        trains = await self.get_trains(code_from, code_to, date, with_seats, priority)
+        if trains is None or trains == "NO TICKETS":
+            return trains
+        return select_class(trains, place_type)
+
+
+def cache_key(code_from: int, code_to: int, date: datetime, with_seats: bool) -> tuple:
+    """ключ поиска: коды бывают и строками, и числами, а от даты важен только день"""
+    return (str(code_from), str(code_to), date.strftime("%d.%m.%Y"), with_seats)
+
+
+def _percentile(values: list, q: float):
+    """перцентиль по уже отсортированному списку"""
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+_client = None
+# кэш и лимит общие на процесс: их делят общий клиент и синхронная обертка,
+# которой на каждый вызов нужен свой клиент (пул соединений живет в своем loop)
+_cache = None
+_limiter = None
+
+
+def _shared_cache_and_limiter() -> tuple[TTLCache, RateLimiter]:
+    global _cache, _limiter
+    if _cache is None:
+        _cache = TTLCache(rzd_settings.CACHE_SIZE, rzd_settings.CACHE_TTL)
+    if _limiter is None:
+        _limiter = RateLimiter(
+            rzd_settings.RATE_LIMIT,
+            rzd_settings.RATE_BURST,
+            rzd_settings.MAX_IN_FLIGHT or rzd_settings.POOL_SIZE,
+        )
+    return _cache, _limiter
+
+
+def get_client() -> RzdClient:
+    """общий на весь процесс клиент ржд"""
+    global _client
+    if _client is None:
+        cache, limiter = _shared_cache_and_limiter()
+        _client = RzdClient(cache=cache, limiter=limiter)
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def get_trains(
+    code_from: int,
+    code_to: int,
+    date: datetime,
+    with_seats: bool = True,
+    priority: Priority = Priority.interactive,
+):
+    """Все поезда поиска по всем классам через общий клиент, см. RzdClient.get_trains"""
+    return await get_client().get_trains(code_from, code_to, date, with_seats, priority)
+
+
+async def get_train_routes(
+    code_from: int,
+    code_to: int,
+    date: datetime,
+    place_type: str = None,
+    with_seats: bool = True,
+    priority: Priority = Priority.interactive,
+):
+    """Получение маршрутов через общий клиент, см. RzdClient.get_train_routes"""
+    return await get_client().get_train_routes(
+        code_from, code_to, date, place_type, with_seats, priority
+    )
 
 
 def get_train_routes_with_session(
@@ -14,177 +388,189 @@ def get_train_routes_with_session(
     place_type: str = None,
     with_seats: bool = True,
 ):
-    """Получение маршрутов от города с кодом code_from в город с code_to."""
-
-    base_url = "https://pass.rzd.ru/timetable/public/ru"
-    session = requests.Session()
-
-    file = open("resources/headers.json")
-    headers = json.load(file)
-
-    params = {
-        "layer_id": 5827,
-        "dir": 0,
-        "tfl": 1,
-        "checkSeats": 1 if with_seats else 0,
-        "code0": code_from,
-        "code1": code_to,
-        "dt0": date.strftime("%d.%m.%Y"),
-    }
-
-    response = session.get(base_url, params=params, headers=headers)
-    if response.status_code == http.HTTPStatus.OK:
-        try:
-            result = response.json().get("result")
-            if result == "RID":
+    """Получение маршрутов от города с кодом code_from в город с code_to.
 
-                data = response.json()
-                rid = data.get("RID")
+    Синхронная обертка для кода вне event loop. Пул общего клиента привязан
+    к своему event loop, поэтому здесь заводим отдельный клиент на вызов,
+    но кэш и лимит запросов у него общие на процесс.
+    """
+    cache, limiter = _shared_cache_and_limiter()
 
-                logging.info(f"Первый запрос выполнен успешно, JSON: {data}")
+    async def run():
+        async with RzdClient(cache=cache, limiter=limiter) as client:
+            return await client.get_train_routes(
+                code_from, code_to, date, place_type, with_seats
+            )
 
-                time.sleep(3)
+    return asyncio.run(run())
 
-                second_url = f"{base_url}?layer_id=5827&rid={rid}"
-                second_response = session.get(
-                    second_url, headers=headers, params=params
-                )
 
-                if response.status_code == http.HTTPStatus.OK:
-                    data = second_response.json()
-                    logging.info(f"Второй запрос выполнен успешно, JSON: {data}")
-                    try:
-                        return get_parsed_data(data, place_type)
-                    except Exception as e:
-                        logging.error(
-                            f"Ошибка преобразования ответа второго запроса в JSON, статус ошибки: {second_response.status_code}, причина: {second_response.reason}, ошибка: {e}"
-                        )
-                        logging.debug(second_response.text)
-                        return None
-                else:
-                    logging.error(
-                        f"Что-то пошло не так при втором запросе, статус ошибки: {second_response.status_code}, причина: {second_response.reason}"
-                    )
-                    return None
-            elif result == "OK":
-                logging.info("Нет доступных билетов.")
-                return "NO TICKETS"
-            else:
-                return None
-        except Exception as e:
-            logging.error(
-                f"Ошибка преобразования ответа первого запроса в JSON,  \
-                          статус ошибки: {second_response.status_code}, причина: {second_response.reason}, ошибка: {e}"
-            )
-            logging.debug(response.text)
-            return None
-    else:
-        logging.error(
-            f"Что-то пошло не так при первом запросе, статус ошибки: {response.status_code}, причина: {response.reason}"
-        )
-        return None
+class Offer(NamedTuple):
+    """лучший тариф в одном классе поезда"""
 
+    best_price: int
+    frseats: int
 
-def get_parsed_data(result_data, place_type):
+
+class Train(NamedTuple):
+    """поезд из ответа ржд со всеми классами сразу"""
+
+    route_id: str
+    station_from: str
+    station_to: str
+    station_code_from: int
+    station_code_to: int
+    route_global: str
+    datetime0: datetime
+    datetime1: datetime
+    city_from: str
+    city_from_code: int
+    city_where: str
+    city_where_code: int
+    # typeLoc -> Offer
+    classes: dict
+
+
+class TrainRoute(NamedTuple):
+    """маршрут поезда в выбранном классе, то, что показываем пользователю и храним в FSM"""
+
+    route_id: str
+    station_from: str
+    station_to: str
+    station_code_from: int
+    station_code_to: int
+    route_global: str
+    datetime0: datetime
+    datetime1: datetime
+    city_from: str
+    city_from_code: int
+    city_where: str
+    city_where_code: int
+    best_price: int
+    class_name: str
+    frseats: int
+
+
+@lru_cache(maxsize=4096)
+def _parse_datetime(date: str, time: str) -> datetime:
+    """разбор "%d.%m.%Y %H:%M" без strptime, у ржд формат всегда фиксированный
+
+    Даты и времена в ответе сильно повторяются, поэтому результат запоминаем.
+    """
+    return datetime(
+        int(date[6:10]), int(date[3:5]), int(date[0:2]), int(time[0:2]), int(time[3:5])
+    )
+
+
+def parse_trains(result_data):
+    """разбирает ответ ржд за один проход сразу по всем классам
+
+    Для каждого поезда в classes лежит лучший тариф и свободные места
+    по каждому typeLoc вагонов, так что класс можно выбрать потом без нового запроса.
+    """
     try:
-        routes = []
+        trains = []
         tp = result_data.get("tp", [])
         if tp and isinstance(tp, list) and ("list" in tp[0]):
-            trains = tp[0]["list"]
-
-            for train in trains:
-
-                cars = train.get("cars")
-                freeseats = None
-                if place_type is not None:
-                    best_price = None
-                    if cars:
-                        prices = [
-                            c.get("tariff")
-                            for c in cars
-                            if (c.get("tariff") is not None)
-                            and (c.get("typeLoc") == place_type)
-                            and (c.get("disabledPerson", None) is None)
-                        ]
-                        if prices:
-                            best_price = min(prices)
-                            freeseats = cars[prices.index(best_price)].get("freeSeats")
-                    if best_price is None:
-                        best_price = "нет данных"
-                        continue
+            tp = tp[0]
+            city_from = tp.get("from")
+            city_from_code = tp.get("fromCode")
+            city_where = tp.get("where")
+            city_where_code = tp.get("whereCode")
+
+            for train in tp["list"]:
 
-                else:
-                    best_price = None
-                    if cars:
-                        for c in cars:
-                            price = c.get("tariff")
-                            if (price is not None) and (
-                                c.get("disabledPerson", None) is None
-                            ):
-
-                                if (best_price is None) or (best_price > price):
-                                    best_price = price
-                                    place_type = c.get("type")
-                                    freeseats = c.get("freeSeats")
-
-                    if best_price is None:
-                        best_price = "нет данных"
+                classes = {}
+                for c in train.get("cars") or ():
+                    price = c.get("tariff")
+                    if (price is None) or (c.get("disabledPerson") is not None):
                         continue
+                    place_type = c.get("typeLoc")
+                    best = classes.get(place_type)
+                    if (best is None) or (best[0] > price):
+                        classes[place_type] = Offer(price, c.get("freeSeats"))
 
-                route_id = train.get("number")
-
-                station_from = train.get("station0")
-                station_to = train.get("station1")
-                city_from = tp[0].get("from")
-                city_from_code = tp[0].get("fromCode")
-                city_where = tp[0].get("where")
-                city_where_code = tp[0].get("whereCode")
-
-                route_from = train.get("route0")
-                route_to = train.get("route1")
-                station_code_from = train.get("code0")
-                station_code_to = train.get("code1")
-
-                format = "%d.%m.%Y %H:%M"
-
-                date_time0 = f'{train.get("date0")} {train.get("time0")}'
-                date_time0 = datetime.strptime(date_time0, format)
-
-                date_time1 = f'{train.get("date1")} {train.get("time1")}'
-                date_time1 = datetime.strptime(date_time1, format)
-
-                routes.append(
-                    {
-                        "route_id": route_id,
-                        "station_from": station_from,
-                        "station_to": station_to,
-                        "station_code_from": station_code_from,
-                        "station_code_to": station_code_to,
-                        "route_global": f"{route_from}-{route_to}",
-                        "datetime0": date_time0,
-                        "datetime1": date_time1,
-                        "best_price": best_price,
-                        "class": place_type,
-                        "from": city_from,
-                        "fromCode": city_from_code,
-                        "where": city_where,
-                        "whereCode": city_where_code,
-                        "frseats": freeseats,
-                    }
+                if not classes:
+                    continue
+
+                trains.append(
+                    Train(
+                        train.get("number"),
+                        train.get("station0"),
+                        train.get("station1"),
+                        train.get("code0"),
+                        train.get("code1"),
+                        f'{train.get("route0")}-{train.get("route1")}',
+                        _parse_datetime(train.get("date0"), train.get("time0")),
+                        _parse_datetime(train.get("date1"), train.get("time1")),
+                        city_from,
+                        city_from_code,
+                        city_where,
+                        city_where_code,
+                        classes,
+                    )
                 )
-        return routes
+        return trains
     except Exception as e:
         logging.error(f"Ошибка при обработке данных маршрута: {e}")
         return None
 
 
+# класс так, как он хранится в базе (RouteType), -> typeLoc в ответе ржд
+TYPE_LOCS = {
+    RouteType.plackart: "плацкартный",
+    RouteType.cupe: "купе",
+    RouteType.seated: "сидячий",
+    RouteType.sv: "св",
+}
+_TYPE_LOCS_BY_NAME = {route_type.value: loc for route_type, loc in TYPE_LOCS.items()}
+
+
+def _find_class(classes: dict, place_type: str):
+    """ищем класс точным сравнением без учета регистра
+
+    place_type - класс из базы ("плацкарт") или typeLoc ржд ("Плацкартный").
+    """
+    place_type = place_type.lower()
+    type_loc = _TYPE_LOCS_BY_NAME.get(place_type, place_type)
+    for name, offer in classes.items():
+        if name and name.lower() == type_loc:
+            return offer
+    return None
+
+
+def select_class(trains: list, place_type: str = None) -> list:
+    """выбирает из разобранных поездов маршруты нужного класса (или самый дешевый класс)"""
+    routes = []
+    for train in trains:
+        classes = train.classes
+        if place_type is not None:
+            route_class = place_type
+            offer = _find_class(classes, place_type)
+            if offer is None:
+                continue
+        else:
+            route_class = min(classes, key=lambda c: classes[c].best_price)
+            offer = classes[route_class]
+
+        routes.append(
+            TrainRoute(*train[:-1], offer.best_price, route_class, offer.frseats)
+        )
+    return routes
+
+
+def get_parsed_data(result_data, place_type):
+    trains = parse_trains(result_data)
+    if trains is None:
+        return None
+    return select_class(trains, place_type)
+
+
 def get_station_code(station_name):
     """
     Получает код города/станции по названию.
     """
-    with open("resources/city_codes.json", "r") as file:
-        file = json.load(file)
-        ans = file.get(station_name)
-        if ans:
-            return ans
-        raise ValueError("Город/станция не найдены")
+    ans = get_station_index().get(station_name)
+    if ans:
+        return ans
+    raise ValueError("Город/станция не найдены")
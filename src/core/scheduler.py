@@ -0,0 +1,124 @@
+import heapq
+import itertools
+import math
+from datetime import datetime, timedelta
+
+from src.core.config import refresh_settings
+from src.core.rzd import cache_key
+
+
+def refresh_interval(
+    days_to_departure: float,
+    subscribers: int,
+    changes: int,
+    min_interval: float = None,
+    max_interval: float = None,
+) -> float:
+    """через сколько секунд снова обновлять маршрут
+
+    Базовый интервал растет с удаленностью отправления (сутки - 15 минут,
+    месяц - 7.5 часов) и делится на множитель от частоты изменения цены
+    и числа подписчиков.
+    """
+    min_interval = min_interval or refresh_settings.MIN_INTERVAL
+    max_interval = max_interval or refresh_settings.MAX_INTERVAL
+    base = 3 * min_interval * max(days_to_departure, 1 / 3)
+    factor = (1 + changes) * (1 + math.log2(max(subscribers, 1)))
+    return min(max(base / factor, min_interval), max_interval)
+
+
+def route_interval(route: dict, now: datetime) -> float:
+    """интервал проверки маршрута из get_routes_for_refresh"""
+    days = (route["from_date"] - now) / timedelta(days=1)
+    return refresh_interval(days, route["subscribers"], route["changes"])
+
+
+def route_key(route: dict) -> tuple:
+    return cache_key(
+        route["from_station_city"], route["to_station_city"], route["from_date"], True
+    )
+
+
+class RefreshScheduler:
+    """очередь маршрутов на обновление по времени следующей проверки
+
+    Куча из (срок, номер, route_id), устаревшие записи после переноса срока
+    пропускаем при извлечении. Маршруты с тем же ключом поиска забираем вместе
+    с должником: их обновит тот же запрос к ржд.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        # route_id -> (маршрут, срок)
+        self._routes = {}
+        # ключ поиска -> route_id
+        self._groups = {}
+
+    def __len__(self):
+        return len(self._routes)
+
+    def _push(self, route: dict, due_at: datetime):
+        self._routes[route["route_id"]] = (route, due_at)
+        heapq.heappush(self._heap, (due_at, next(self._seq), route["route_id"]))
+
+    def sync(self, routes: list, now: datetime):
+        """приводим очередь к текущему списку подписанных маршрутов
+
+        Новые маршруты обновляем сразу, у известных освежаем данные и сохраняем срок.
+        Маршруты, забранные прошлым заходом и не перенесенные (заход упал), тоже сразу.
+        """
+        known = self._routes
+        self._routes = {}
+        self._groups = {}
+        for route in routes:
+            route_id = route["route_id"]
+            if route_id in known and known[route_id][1] is not None:
+                # запись в куче уже есть, переносим только данные маршрута
+                self._routes[route_id] = (route, known[route_id][1])
+            else:
+                self._push(route, now)
+            self._groups.setdefault(route_key(route), set()).add(route_id)
+
+    def next_due(self) -> datetime | None:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap:
+            due_at, _, route_id = self._heap[0]
+            item = self._routes.get(route_id)
+            if item is not None and item[1] == due_at:
+                return
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now: datetime, max_fetches: int = None) -> list:
+        """маршруты, срок которых наступил, вместе с попутчиками по ключу поиска
+
+        Не больше max_fetches разных поисков, самые просроченные первыми.
+        """
+        max_fetches = max_fetches or refresh_settings.MAX_FETCHES_PER_TICK
+        keys = []
+        while len(keys) < max_fetches:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, _, route_id = heapq.heappop(self._heap)
+            route, _ = self._routes[route_id]
+            # перенесем сроки всей группы после обновления, пока держим ее вне кучи
+            self._routes[route_id] = (route, None)
+            key = route_key(route)
+            if key not in keys:
+                keys.append(key)
+
+        due = []
+        for key in keys:
+            for route_id in sorted(self._groups[key]):
+                route, _ = self._routes[route_id]
+                self._routes[route_id] = (route, None)
+                due.append(route)
+        return due
+
+    def reschedule(self, route: dict, now: datetime):
+        """следующая проверка маршрута после обновления"""
+        self._push(route, now + timedelta(seconds=route_interval(route, now)))
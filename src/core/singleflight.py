@@ -0,0 +1,45 @@
+import asyncio
+
+
+class SingleFlight:
+    """склеивает одинаковые одновременные запросы в один
+
+    Пока по ключу идет запрос, остальные вызовы с тем же ключом ждут его
+    и получают тот же результат (или то же исключение).
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        # сколько раз реально выполнили запрос и сколько вызовов к нему присоединились
+        self.executed = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._inflight[key] = task
+            self.executed += 1
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.shared += 1
+
+        # shield: если отменили одного из ждущих, общий запрос продолжается для остальных
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # забираем исключение, даже если всех ждущих отменили, чтобы asyncio не ругался
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "inflight": len(self._inflight),
+            "executed": self.executed,
+            "shared": self.shared,
+        }
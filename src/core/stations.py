@@ -0,0 +1,101 @@
+import json
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+
+CITY_CODES_PATH = "resources/city_codes.json"
+
+
+class StationIndex:
+    """индекс населенных пунктов/станций из city_codes.json в памяти процесса
+
+    Точное совпадение - поиск в словаре, поиск по началу названия - bisect
+    по отсортированному списку, подсказки при опечатках - по общим триграммам.
+    """
+
+    def __init__(self, codes: dict):
+        self._codes = {name.lower(): code for name, code in codes.items()}
+        self._names = sorted(self._codes)
+        # триграммы строим только при первой подсказке
+        self._trigrams = None
+
+    def __len__(self):
+        return len(self._names)
+
+    def get(self, name: str):
+        """код по точному названию без учета регистра или None"""
+        return self._codes.get(name.strip().lower())
+
+    def prefix(self, prefix: str, limit: int = 10) -> list:
+        """названия, начинающиеся с prefix, по алфавиту"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        result = []
+        i = bisect_left(self._names, prefix)
+        while i < len(self._names) and len(result) < limit:
+            name = self._names[i]
+            if not name.startswith(prefix):
+                break
+            result.append(name)
+            i += 1
+        return result
+
+    def lookup(self, name: str):
+        """как get_city_code в базе: сначала точное совпадение, потом первое по алфавиту по началу"""
+        code = self.get(name)
+        if code is not None:
+            return code
+        names = self.prefix(name, limit=1)
+        if names:
+            return self._codes[names[0]]
+        return None
+
+    def suggest(self, name: str, limit: int = 5, cutoff: float = 0.6) -> list:
+        """похожие названия для опечаток, от самого похожего"""
+        name = name.strip().lower()
+        if not name:
+            return []
+        if self._trigrams is None:
+            self._trigrams = self._build_trigrams()
+
+        # кандидаты - названия с наибольшим числом общих триграмм
+        shared = Counter()
+        for gram in _trigrams(name):
+            shared.update(self._trigrams.get(gram, ()))
+        candidates = [self._names[i] for i, _ in shared.most_common(50)]
+
+        matcher = SequenceMatcher(b=name)
+        scored = []
+        for candidate in candidates:
+            matcher.set_seq1(candidate)
+            ratio = matcher.ratio()
+            if ratio >= cutoff:
+                scored.append((ratio, candidate))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [candidate for _, candidate in scored[:limit]]
+
+    def _build_trigrams(self) -> dict:
+        trigrams = {}
+        for i, name in enumerate(self._names):
+            for gram in set(_trigrams(name)):
+                trigrams.setdefault(gram, []).append(i)
+        return trigrams
+
+
+def _trigrams(name: str) -> list:
+    # пробелы по краям, чтобы короткие названия и начало слова тоже давали триграммы
+    padded = f"  {name} "
+    return [padded[i : i + 3] for i in range(len(padded) - 2)]
+
+
+_index = None
+
+
+def get_station_index() -> StationIndex:
+    """общий на процесс индекс, city_codes.json читаем один раз при первом обращении"""
+    global _index
+    if _index is None:
+        with open(CITY_CODES_PATH, "r", encoding="utf-8") as file:
+            _index = StationIndex(json.load(file))
+    return _index
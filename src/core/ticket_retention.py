@@ -0,0 +1,145 @@
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import ticket_history_settings
+from src.db.database import async_session
+from src.db.models import Ticket, TicketDaily, TicketHourly
+from src.db.queries import merge_rollup, ticket_hours
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"t_ticket_p(\d{4})(\d{2})")
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _rollup(source, target, bucket: str, cutoff: datetime):
+    """сворачиваем строки source старше cutoff в target, сливая с уже свернутыми
+
+    Билет - это цена на отрезке [update_time, last_seen], так что сворачиваем
+    только закончившиеся до cutoff отрезки и раскладываем каждый по всем часам,
+    которые он покрывает: samples у почасовых агрегатов - число часов с ценой.
+    """
+    if source is Ticket:
+        hours = (
+            ticket_hours(Ticket.__table__).filter(Ticket.last_seen < cutoff).subquery()
+        )
+        source = hours.c
+        time_column = hours.c.at
+        min_price = func.min(hours.c.best_price)
+        avg_price = func.avg(hours.c.best_price)
+        max_price = func.max(hours.c.best_price)
+        samples = func.count()
+    else:
+        time_column = source.bucket
+        min_price = func.min(source.min_price)
+        max_price = func.max(source.max_price)
+        samples = func.sum(source.samples)
+        # среднее взвешиваем по числу исходных часов
+        avg_price = func.sum(source.avg_price * source.samples) / samples
+
+    bucket_column = func.date_trunc(bucket, time_column)
+    rows = (
+        select(
+            source.route_id,
+            bucket_column,
+            min_price,
+            avg_price,
+            max_price,
+            samples,
+        )
+        .filter(time_column < cutoff)
+        .group_by(source.route_id, bucket_column)
+    )
+    # rowcount у insert ... from_select драйвер не отдает (-1), строки считаем по returning
+    return merge_rollup(target, rows).returning(target.__table__.c.route_id)
+
+
+async def run_retention(session: AsyncSession, now: datetime = None) -> dict:
+    """секции t_ticket вперед, сворачивание и удаление старой истории
+
+    Сырые билеты, последний раз виденные раньше RAW_RETENTION_MONTHS полных
+    месяцев, сворачиваются в t_ticket_hourly, их секции удаляются целиком.
+    Билеты с ценой, которая держится до сих пор, остаются сырыми. Почасовые агрегаты старше
+    HOURLY_RETENTION_DAYS сворачиваются в t_ticket_daily.
+    """
+    settings = ticket_history_settings
+    if now is None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+    month = datetime(now.year, now.month, 1)
+    raw_cutoff = _add_months(month, -settings.RAW_RETENTION_MONTHS)
+    hourly_cutoff = datetime(now.year, now.month, now.day) - timedelta(
+        days=settings.HOURLY_RETENTION_DAYS
+    )
+
+    await session.execute(
+        text("SELECT t_ticket_ensure_partitions(:from_month, :to_month)"),
+        {
+            "from_month": month.date(),
+            "to_month": _add_months(month, settings.PARTITIONS_AHEAD).date(),
+        },
+    )
+
+    hourly = await session.execute(_rollup(Ticket, TicketHourly, "hour", raw_cutoff))
+    hourly_rows = len(hourly.all())
+
+    # секции целиком старше границы удаляем, это дешевле DELETE по строкам;
+    # секцию с еще не закончившимся отрезком цены (last_seen после границы) оставляем
+    partitions = await session.scalars(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 't_ticket'::regclass"
+        )
+    )
+    dropped = []
+    for name in partitions:
+        match = PARTITION_NAME.fullmatch(name)
+        if not match:
+            continue
+        start = datetime(int(match[1]), int(match[2]), 1)
+        if _add_months(start, 1) > raw_cutoff:
+            continue
+        current = await session.scalar(
+            text(f'SELECT EXISTS (SELECT FROM "{name}" WHERE last_seen >= :cutoff)'),
+            {"cutoff": raw_cutoff},
+        )
+        if not current:
+            await session.execute(text(f'DROP TABLE "{name}"'))
+            dropped.append(name)
+    # свернутые билеты из оставленных секций и секции по умолчанию
+    deleted = await session.execute(
+        Ticket.__table__.delete().where(Ticket.last_seen < raw_cutoff)
+    )
+
+    daily = await session.execute(
+        _rollup(TicketHourly, TicketDaily, "day", hourly_cutoff)
+    )
+    daily_rows = len(daily.all())
+    await session.execute(
+        TicketHourly.__table__.delete().where(TicketHourly.bucket < hourly_cutoff)
+    )
+    await session.commit()
+
+    stats = {
+        "raw_cutoff": raw_cutoff,
+        "hourly_cutoff": hourly_cutoff,
+        "hourly_rows": hourly_rows,
+        "daily_rows": daily_rows,
+        "dropped_partitions": dropped,
+        "deleted_rows": deleted.rowcount,
+    }
+    logger.info(f"Чистка истории цен: {stats}")
+    return stats
+
+
+async def retention():
+    async with async_session() as session:
+        return await run_retention(session)
@@ -1,34 +1,252 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+from aiogram import Bot
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from bot.utils import notify_price_change
-from src.core.rzd import get_train_routes_with_session
-from src.db.queries import (delete_unvalid_routes,
-                            get_route_with_tickets_by_id,
-                            get_routes_subscribed)
-
-
-async def update():
-    delete_unvalid_routes()
-    subscribed = get_routes_subscribed()
-    for route_id in subscribed:
-        obj = get_route_with_tickets_by_id(route_id=route_id)
-        data = get_train_routes_with_session(
-            obj["from_station_city"],
-            obj["to_station_city"],
-            obj["from_date"],
-            place_type=obj["class_name"],
+from src.core.config import refresh_settings
+from src.core.ratelimit import Priority
+from src.core.rzd import TrainRoute, get_trains, select_class
+from src.core.scheduler import RefreshScheduler, route_key
+from src.db.async_queries import (delete_unvalid_routes,
+                                  get_routes_for_refresh, record_price)
+from src.db.database import async_session
+
+logger = logging.getLogger(__name__)
+
+
+async def update(bot: Bot):
+    async with async_session() as session:
+        return await refresh_routes(session, bot)
+
+
+async def update_due(bot: Bot, scheduler: RefreshScheduler, now: datetime = None):
+    """один заход планировщика: обновляем только маршруты, чей срок подошел"""
+    now = now or datetime.now()
+    async with async_session() as session:
+        await purge_departed(session)
+        routes = await get_routes_for_refresh(session, refresh_settings.VOLATILITY_DAYS)
+        scheduler.sync(routes, now)
+        due = scheduler.pop_due(now)
+        if not due:
+            return None
+        stats = await refresh_routes(session, bot, routes=due)
+    for route in due:
+        scheduler.reschedule(route, datetime.now())
+    next_due = scheduler.next_due()
+    logger.info(
+        f"Планировщик: обновлено {len(due)} из {len(scheduler)} маршрутов, "
+        f"следующий срок {next_due}"
+    )
+    return stats
+
+
+class StageTimings:
+    """время по этапам цикла обновления: сколько раз, всего, в среднем, максимум"""
+
+    def __init__(self):
+        self._stages = {}
+
+    @contextmanager
+    def __call__(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self._stages.setdefault(
+                stage, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            stats["count"] += 1
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
+    def stats(self) -> dict:
+        return {
+            stage: {**stats, "avg": stats["total"] / stats["count"]}
+            for stage, stats in self._stages.items()
+        }
+
+
+def group_routes(routes: list) -> dict:
+    """маршруты по ключу поиска (откуда, куда, дата)
+
+    Один поиск отдает все поезда и классы на эту дату, так что вся группа
+    обновляется одним запросом к ржд.
+    """
+    groups = {}
+    for route in routes:
+        groups.setdefault(route_key(route), []).append(route)
+    return groups
+
+
+def match_key(route) -> tuple:
+    """ключ сопоставления: станции, класс, отправление и прибытие"""
+    if isinstance(route, TrainRoute):
+        return (
+            route.station_code_from,
+            route.station_code_to,
+            route.class_name,
+            route.datetime0,
+            route.datetime1,
         )
+    return (
+        route["from_station"],
+        route["to_station"],
+        route["class_name"],
+        route["from_date"],
+        route["to_date"],
+    )
+
+
+def index_trains(trains: list, class_names) -> dict:
+    """поезда поиска в нужных классах по ключу сопоставления"""
+    index = {}
+    for class_name in class_names:
+        for route in select_class(trains, class_name):
+            index[match_key(route)] = route
+    return index
+
+
+def match_routes(group: list, trains: list) -> tuple[list, list]:
+    """находим в результатах поиска каждый маршрут группы
 
-        for route in data:
-            if (
-                route["station_code_from"] == obj["from_station"]
-                and route["station_code_to"] == obj["to_station"]
-                and route["class"] == obj["class_name"]
-                and route["datetime0"] == obj["from_date"]
-                and route["datetime1"] == obj["to_date"]
-            ):
-
-                if obj["best_price"] != route["best_price"]:
-                    old_price = obj["best_price"]
-                    new_price = route["best_price"]
-                    await notify_price_change(bot, route_id, old_price, new_price)
+    Возвращает пары (маршрут, поезд) и маршруты, которых в выдаче нет:
+    поезд отменили или в этом классе не осталось мест.
+    """
+    index = index_trains(trains, {obj["class_name"] for obj in group})
+    matched = []
+    missing = []
+    for obj in group:
+        route = index.get(match_key(obj))
+        if route is None:
+            missing.append(obj)
+        else:
+            matched.append((obj, route))
+    return matched, missing
+
+
+def report_missing(missing: list):
+    for obj in missing:
+        logger.info(
+            f"Маршрута {obj['route_id']} (поезд {obj['train_no']}, {obj['class_name']}, "
+            f"{obj['from_date']}) нет в выдаче ржд: отменен или мест нет"
+        )
+
+
+async def write_route(session: AsyncSession, bot: Bot, obj: dict, route: TrainRoute):
+    """сохраняем новую цену маршрута и оповещаем подписчиков, если она поменялась"""
+    # новая строка в истории только если цена или места поменялись
+    await record_price(session, obj["route_id"], route.best_price, route.frseats)
+
+    if obj["best_price"] != route.best_price:
+        old_price = obj["best_price"]
+        new_price = route.best_price
+        await notify_price_change(session, bot, obj["route_id"], old_price, new_price)
+
+
+async def purge_departed(session: AsyncSession):
+    """удаляем ушедшие маршруты пачками и пишем в лог каждую пачку"""
+    chunks = await delete_unvalid_routes(session)
+    for chunk in chunks:
+        logger.info(
+            f"Удалены ушедшие маршруты: {chunk['routes']}, подписки: "
+            f"{chunk['subscriptions']}, билеты: {chunk['tickets']} "
+            f"(в истории по часам: {chunk['hourly']}) за {chunk['seconds']:.3f} с"
+        )
+
+
+async def refresh_routes(
+    session: AsyncSession, bot: Bot, concurrency: int = None, routes: list = None
+) -> dict:
+    """цикл обновления цен по всем подпискам или по переданным маршрутам
+
+    Группы маршрутов идут через очередь к concurrency параллельным поискам,
+    результаты по мере готовности разбирает и пишет в базу один писатель
+    (сессия одна и не терпит параллельных запросов). Если routes передали,
+    ушедшие маршруты вызывающий код уже удалил.
+    """
+    concurrency = concurrency or refresh_settings.CONCURRENCY
+    cycle_started = time.perf_counter()
+    timings = StageTimings()
+
+    if routes is None:
+        with timings("purge"):
+            await purge_departed(session)
+        with timings("load"):
+            routes = await get_routes_for_refresh(session)
+    groups = group_routes(routes)
+
+    work = asyncio.Queue()
+    for group in groups.values():
+        work.put_nowait(group)
+    results = asyncio.Queue()
+
+    async def fetcher():
+        while not work.empty():
+            group = work.get_nowait()
+            first = group[0]
+            with timings("fetch"):
+                trains = await get_trains(
+                    first["from_station_city"],
+                    first["to_station_city"],
+                    first["from_date"],
+                    priority=Priority.background,
+                )
+            await results.put((group, trains))
+
+    async def fetch_all():
+        try:
+            await asyncio.gather(
+                *(fetcher() for _ in range(min(concurrency, len(groups))))
+            )
+        finally:
+            # писателю больше нечего ждать
+            await results.put(None)
+
+    fetching = asyncio.create_task(fetch_all())
+    missing = 0
+    try:
+        while (item := await results.get()) is not None:
+            group, trains = item
+            if trains is None:
+                # поиск не удался, маршруты не трогаем
+                continue
+            if trains == "NO TICKETS":
+                trains = []
+            with timings("match"):
+                matched, not_found = match_routes(group, trains)
+            missing += len(not_found)
+            report_missing(not_found)
+            with timings("write"):
+                for obj, route in matched:
+                    await write_route(session, bot, obj, route)
+        await fetching
+    finally:
+        fetching.cancel()
+
+    # сжатие: сколько маршрутов в среднем обновил один запрос к ржд
+    stats = {
+        "routes": len(routes),
+        "missing": missing,
+        "fetches": len(groups),
+        "compression": len(routes) / len(groups) if groups else 0.0,
+        "concurrency": concurrency,
+        "cycle_seconds": time.perf_counter() - cycle_started,
+        "stages": timings.stats(),
+    }
+    logger.info(
+        f"Обновлено маршрутов: {stats['routes']} за {stats['fetches']} запросов "
+        f"к ржд, нет в выдаче {stats['missing']}, сжатие {stats['compression']:.1f}, "
+        f"цикл {stats['cycle_seconds']:.2f} с"
+    )
+    for stage, stage_stats in stats["stages"].items():
+        logger.info(
+            f"Этап {stage}: {stage_stats['count']} раз, всего {stage_stats['total']:.3f} с, "
+            f"в среднем {stage_stats['avg']:.3f} с, максимум {stage_stats['max']:.3f} с"
+        )
+    return stats
@@ -0,0 +1,837 @@
+# асинхронные версии запросов из queries.py для бота: каждая функция первым
+# аргументом получает AsyncSession, которую открывает вызывающий код
+# (мидлварь бота на каждый апдейт или задача обновления)
+
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import (Date, Integer, cast, column, delete, func, literal,
+                        or_, select, text, true, union_all, update, values)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, selectinload
+
+from src.db.models import (City, Meta, RefreshJob, Route, RouteCurrentPrice,
+                           Station, Subscription, Ticket, TicketDaily,
+                           TicketHourly, User, UserStatus)
+from src.db.queries import (COPY_CITY_STAGE, CREATE_CITY_STAGE,
+                            MERGE_CITY_STAGE, PURGE_CHUNK_SIZE, get_route_type,
+                            purge_departed_chunk, read_city_codes, save_meta)
+
+
+async def get_users_subscribed_to_route(
+    session: AsyncSession, route_id: int
+) -> list[int]:
+    """Возвращает список user_id, которые подписаны на указанный маршрут"""
+    user_ids = await session.scalars(
+        select(Subscription.user_id).filter_by(route_id=route_id)
+    )
+    return list(user_ids)
+
+
+async def get_user(session: AsyncSession, user_id: int) -> User | None:
+    """получаем пользователя по айди"""
+    return await session.get(User, user_id)
+
+
+async def check_user_is_banned(session: AsyncSession, user_id: int) -> bool | None:
+    """проверяем статус пользователя"""
+    user = await session.get(User, user_id)
+    if user:
+        return user.status == UserStatus.banned
+    raise Exception(f"Пользователь c ID {user_id} не найден")
+
+
+async def get_city(session: AsyncSession, city_id: int):
+    """получаем город по его айди"""
+    return await session.get(City, city_id)
+
+
+async def delete_unvalid_routes(
+    session: AsyncSession, chunk_size: int = PURGE_CHUNK_SIZE
+) -> list[dict]:
+    """удаляет ушедшие маршруты (дата отправления прошла) с подписками и билетами
+
+    Удаляет пачками по chunk_size маршрутов, каждая пачка - своя короткая
+    транзакция. Билеты перед удалением сворачиваются в t_ticket_hourly.
+    Возвращает по пачке: сколько удалено строк и за сколько секунд.
+    """
+    stats = []
+    while True:
+        started = time.perf_counter()
+        row = (await session.execute(purge_departed_chunk(chunk_size))).one()
+        await session.commit()
+        stats.append({**row._asdict(), "seconds": time.perf_counter() - started})
+        if row.routes < chunk_size:
+            return stats
+
+
+async def get_routes_subscribed(session: AsyncSession) -> list:
+    """получаем список уникальных айди маршрутов, которые находятся в таблице подписок"""
+    route_ids = await session.scalars(select(Subscription.route_id).distinct())
+    return list(route_ids)
+
+
+def _subscriptions_query(user_id: int):
+    # все, что нужно экрану подписок, одним запросом: маршрут, станции, их города
+    # и текущая цена из t_route_current_price
+    from_station = aliased(Station)
+    to_station = aliased(Station)
+    from_city = aliased(City)
+    to_city = aliased(City)
+    return (
+        select(
+            Route.route_id,
+            Route.from_station_id.label("from_station"),
+            from_station.station_name.label("from_station_name"),
+            from_city.city_id.label("from_station_city"),
+            from_city.city_name.label("from_city_name"),
+            Route.to_station_id.label("to_station"),
+            to_station.station_name.label("to_station_name"),
+            to_city.city_id.label("to_station_city"),
+            to_city.city_name.label("to_city_name"),
+            Route.from_date,
+            Route.to_date,
+            Route.train_no,
+            Route.class_name,
+            RouteCurrentPrice.best_price,
+            RouteCurrentPrice.prev_price,
+            RouteCurrentPrice.min_price,
+            RouteCurrentPrice.max_price,
+            RouteCurrentPrice.changed_at,
+        )
+        .select_from(Subscription)
+        .join(Route, Route.route_id == Subscription.route_id)
+        .join(from_station, from_station.station_id == Route.from_station_id)
+        .join(from_city, from_city.city_id == from_station.city_id)
+        .join(to_station, to_station.station_id == Route.to_station_id)
+        .join(to_city, to_city.city_id == to_station.city_id)
+        .outerjoin(RouteCurrentPrice, RouteCurrentPrice.route_id == Route.route_id)
+        .filter(Subscription.user_id == user_id)
+        # порядок первичного ключа (user_id, route_id) - страницы читаются по нему
+        .order_by(Subscription.route_id)
+    )
+
+
+def _subscription_row(row) -> dict:
+    result = dict(row)
+    result["class_name"] = row["class_name"].value
+    return result
+
+
+def _refresh_query(volatility_days: int, key: tuple = None):
+    """маршруты с подписками для обновления, key - (город откуда, город куда, день)"""
+    from_station = aliased(Station)
+    to_station = aliased(Station)
+    subscribers = (
+        select(func.count())
+        .select_from(Subscription)
+        .filter(Subscription.route_id == Route.route_id)
+        .scalar_subquery()
+    )
+    changes = (
+        select(func.count())
+        .select_from(Ticket)
+        .filter(
+            Ticket.route_id == Route.route_id,
+            Ticket.update_time
+            > func.timezone("utc", func.now()) - timedelta(days=volatility_days),
+        )
+        .scalar_subquery()
+    )
+    query = (
+        select(
+            Route.route_id,
+            Route.from_station_id.label("from_station"),
+            from_station.city_id.label("from_station_city"),
+            Route.to_station_id.label("to_station"),
+            to_station.city_id.label("to_station_city"),
+            Route.from_date,
+            Route.to_date,
+            Route.train_no,
+            Route.class_name,
+            RouteCurrentPrice.best_price,
+            subscribers.label("subscribers"),
+            changes.label("changes"),
+        )
+        .join(from_station, from_station.station_id == Route.from_station_id)
+        .join(to_station, to_station.station_id == Route.to_station_id)
+        .outerjoin(RouteCurrentPrice, RouteCurrentPrice.route_id == Route.route_id)
+        .filter(
+            select(Subscription.route_id)
+            .filter(Subscription.route_id == Route.route_id)
+            .exists()
+        )
+        .order_by(Route.route_id)
+    )
+    if key is not None:
+        from_city_id, to_city_id, travel_date = key
+        query = query.filter(
+            from_station.city_id == from_city_id,
+            to_station.city_id == to_city_id,
+            Route.from_date >= travel_date,
+            Route.from_date < travel_date + timedelta(days=1),
+        )
+    return query
+
+
+async def get_routes_for_refresh(
+    session: AsyncSession, volatility_days: int = 7
+) -> list[dict]:
+    """все маршруты, на которые кто-то подписан, одним запросом
+
+    Поля как у get_route_with_tickets_by_id: станции, их города, даты, класс
+    и текущая цена. Для планировщика еще число подписчиков и число записей цены
+    за последние volatility_days дней (пишем только изменения, так что это
+    число изменений).
+    """
+    rows = await session.execute(_refresh_query(volatility_days))
+    return [_subscription_row(row) for row in rows.mappings()]
+
+
+async def get_routes_for_job(
+    session: AsyncSession, job: dict, volatility_days: int = 7
+) -> list[dict]:
+    """маршруты с подписками под ключ поиска задачи из t_refresh_job, поля как у get_routes_for_refresh"""
+    key = (job["from_city_id"], job["to_city_id"], job["travel_date"])
+    rows = await session.execute(_refresh_query(volatility_days, key))
+    return [_subscription_row(row) for row in rows.mappings()]
+
+
+async def get_user_subscrtions(session: AsyncSession, user_id: int) -> list:
+    """получаем список подписок пользователя"""
+    rows = await session.execute(_subscriptions_query(user_id))
+    return [_subscription_row(row) for row in rows.mappings()]
+
+
+async def get_user_subscriptions_page(
+    session: AsyncSession, user_id: int, after_route_id: int = 0, limit: int = 10
+) -> tuple[list, int | None]:
+    """страница подписок пользователя по возрастанию айди маршрута
+
+    Постраничность по ключу: следующая страница начинается после after_route_id.
+    Возвращает подписки и after_route_id для следующей страницы (None, если это последняя).
+    """
+    rows = await session.execute(
+        _subscriptions_query(user_id)
+        .filter(Subscription.route_id > after_route_id)
+        .limit(limit + 1)
+    )
+    page = [_subscription_row(row) for row in rows.mappings()]
+    if len(page) > limit:
+        return page[:limit], page[limit - 1]["route_id"]
+    return page, None
+
+
+async def get_route(session: AsyncSession, route_id: int) -> Route | None:
+    """маршрут вместе со станциями и их городами"""
+    return await session.scalar(
+        select(Route)
+        .filter_by(route_id=route_id)
+        .options(
+            selectinload(Route.from_station).selectinload(Station.city),
+            selectinload(Route.to_station).selectinload(Station.city),
+        )
+    )
+
+
+async def get_current_price(
+    session: AsyncSession, route_id: int
+) -> RouteCurrentPrice | None:
+    """текущая, предыдущая, минимальная и максимальная цена маршрута одной строкой"""
+    return await session.get(RouteCurrentPrice, route_id, populate_existing=True)
+
+
+async def get_price_history(
+    session: AsyncSession, route_id: int, bucket: str = "hour"
+) -> list[dict]:
+    """история цены маршрута по часам или дням: min/avg/max и число билетов
+
+    Старая история лежит только в агрегатах t_ticket_daily/t_ticket_hourly,
+    свежая - сырыми билетами, поэтому читаем все три и досворачиваем до bucket.
+    """
+    sources = [
+        select(
+            func.date_trunc(bucket, table.bucket).label("bucket"),
+            table.min_price,
+            (table.avg_price * table.samples).label("total"),
+            table.max_price,
+            table.samples,
+        ).filter(table.route_id == route_id)
+        for table in (TicketDaily, TicketHourly)
+    ]
+    sources.append(
+        select(
+            func.date_trunc(bucket, Ticket.update_time).label("bucket"),
+            Ticket.best_price.label("min_price"),
+            Ticket.best_price.label("total"),
+            Ticket.best_price.label("max_price"),
+            literal(1).label("samples"),
+        ).filter(Ticket.route_id == route_id)
+    )
+    points = union_all(*sources).subquery()
+    rows = await session.execute(
+        select(
+            points.c.bucket,
+            func.min(points.c.min_price).label("min_price"),
+            (func.sum(points.c.total) / func.sum(points.c.samples)).label("avg_price"),
+            func.max(points.c.max_price).label("max_price"),
+            func.sum(points.c.samples).label("samples"),
+        )
+        .group_by(points.c.bucket)
+        .order_by(points.c.bucket)
+    )
+    return [dict(row) for row in rows.mappings()]
+
+
+async def get_price_series(
+    session: AsyncSession, route_id: int, step: timedelta = timedelta(minutes=5)
+) -> list[dict]:
+    """история цены маршрута точками через step
+
+    Билет хранит цену на отрезке [update_time, last_seen], разворачиваем
+    каждый отрезок обратно в ряд точек.
+    """
+    at = func.generate_series(Ticket.update_time, Ticket.last_seen, step).label("at")
+    rows = await session.execute(
+        select(at, Ticket.best_price, Ticket.free_seats)
+        .filter(Ticket.route_id == route_id)
+        .order_by(at)
+    )
+    return [dict(row) for row in rows.mappings()]
+
+
+async def get_route_with_tickets_by_id(session: AsyncSession, route_id: int) -> dict:
+    """получаем маршрут (его данные + последнюю стоимость из собранных "билетов") по его айди"""
+    result = {
+        "route_id": None,
+        "from_station": None,
+        "to_station": None,
+        "from_date": None,
+        "to_date": None,
+        "train_no": None,
+        "class_name": None,
+        "best_price": None,
+    }
+
+    route = await get_route(session, route_id)
+    if route:
+        result["route_id"] = route.route_id
+        result["from_station"] = route.from_station.station_id
+        result["from_station_city"] = route.from_station.city.city_id
+        result["to_station"] = route.to_station.station_id
+        result["to_station_city"] = route.to_station.city.city_id
+        result["from_date"] = route.from_date
+        result["to_date"] = route.to_date
+        result["train_no"] = route.train_no
+
+        # последняя цена ведется триггером на t_ticket, историю не сортируем
+        current_price = await get_current_price(session, route_id)
+
+        if current_price:
+            result["class_name"] = route.class_name.value
+            result["best_price"] = current_price.best_price
+
+    return result
+
+
+async def load_cities_from_json(session: AsyncSession, file_path: str) -> int | None:
+    """загружаем city_codes.json через COPY, если он поменялся с прошлой загрузки
+
+    Как load_cities_from_json в queries.py. Возвращает число добавленных
+    городов или None, если загрузка пропущена.
+    """
+    key, checksum, data = read_city_codes(file_path)
+    meta = await session.get(Meta, key, populate_existing=True)
+    if meta and meta.value == checksum:
+        return None
+
+    await session.execute(text(CREATE_CITY_STAGE))
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    async with raw_connection.driver_connection.cursor() as cursor:
+        async with cursor.copy(COPY_CITY_STAGE) as copy:
+            for city_name, city_id in data.items():
+                await copy.write_row((int(city_id), city_name))
+    added = (await session.execute(text(MERGE_CITY_STAGE))).rowcount
+    await session.execute(save_meta(key, checksum))
+    await session.commit()
+    return added
+
+
+async def add_city(session: AsyncSession, city_name: str, city_id: int):
+    """загружаем город"""
+    if await session.get(City, city_id):
+        return
+    session.add(City(city_id=city_id, city_name=city_name))
+    await session.commit()
+
+
+async def add_station(
+    session: AsyncSession, city_id: int, station_id: int, station_name: str
+):
+    """загружаем станцию"""
+    if await session.get(Station, station_id):
+        return
+    session.add(
+        Station(city_id=city_id, station_name=station_name, station_id=station_id)
+    )
+    await session.commit()
+
+
+async def add_route(
+    session: AsyncSession,
+    from_station_id: int,
+    to_station_id: int,
+    from_date: datetime,
+    to_date: datetime,
+    train_no: str,
+    class_name: str,
+) -> int:
+    """добавляем маршрут или возвращаем айди уже существующего с тем же поездом и классом"""
+    route_id = await session.scalar(
+        _upsert_route(
+            [
+                {
+                    "from_station_id": from_station_id,
+                    "to_station_id": to_station_id,
+                    "from_date": from_date,
+                    "to_date": to_date,
+                    "train_no": train_no,
+                    "class_name": get_route_type(class_name),
+                }
+            ]
+        )
+    )
+    await session.commit()
+    return route_id
+
+
+async def delete_route(session: AsyncSession, route_id: int):
+    """удаляем маршрут"""
+    # подписки, билеты и текущую цену удаляет каскад
+    await session.execute(delete(Route).filter_by(route_id=route_id))
+    await session.commit()
+
+
+async def add_user(session: AsyncSession, user_id: int, status=UserStatus.chill):
+    """добавляем пользователя"""
+    if await session.get(User, user_id):
+        return
+    session.add(User(user_id=user_id, status=status))
+    await session.commit()
+
+
+async def update_user(session: AsyncSession, user_id: int, new_status: str):
+    """обновляем статус пользователя, например, если его заблочили (в этом случае еще и удаляем все подписки)"""
+    user = await session.get(User, user_id)
+    if not user:
+        raise Exception(f"Пользователь c ID {user_id} не найден")
+    user.status = new_status
+    if new_status == "banned":
+        # удаляем все подписки
+        await session.execute(delete(Subscription).filter_by(user_id=user_id))
+    await session.commit()
+
+
+async def delete_user(session: AsyncSession, user_id: int):
+    """удаляем пользователя"""
+    user = await session.get(User, user_id)
+    if user:
+        # удаляем все подписки юзера
+        await session.execute(delete(Subscription).filter_by(user_id=user_id))
+        await session.delete(user)
+        await session.commit()
+
+
+async def add_subscription(session: AsyncSession, user_id: int, route_id: int):
+    """добавляем пользователю новую подписку"""
+    if await session.get(Subscription, (user_id, route_id)):
+        return
+    session.add(Subscription(user_id=user_id, route_id=route_id))
+    await session.commit()
+
+
+async def delete_subscription(session: AsyncSession, user_id: int, route_id: int):
+    """удаляем подписку пользователя"""
+    subscription = await session.get(Subscription, (user_id, route_id))
+    if subscription:
+        await session.delete(subscription)
+        await session.commit()
+
+
+async def add_ticket(session: AsyncSession, route_id: int, best_price: int):
+    """добавляем новую информацию по самому выгодному билету"""
+    # время добавления записи проставится автоматически см. models.Ticket
+    session.add(Ticket(route_id=route_id, best_price=best_price))
+    await session.commit()
+
+
+def _record_prices(prices):
+    """билеты для цен из prices (CTE с колонками route_id, best_price, free_seats)
+
+    Если цена и места те же, что у последнего билета маршрута, только сдвигаем его
+    last_seen, иначе пишем новый билет. Возвращает CTE вставленных билетов,
+    CTE со сдвигом last_seen подтягивается через него.
+    """
+    last = (
+        select(
+            Ticket.ticket_id, Ticket.update_time, Ticket.best_price, Ticket.free_seats
+        )
+        .filter(Ticket.route_id == prices.c.route_id)
+        .order_by(Ticket.update_time.desc())
+        .limit(1)
+        .lateral("last")
+    )
+    latest = (
+        select(
+            prices.c.route_id,
+            prices.c.best_price.label("new_price"),
+            prices.c.free_seats.label("new_seats"),
+            last.c.ticket_id,
+            last.c.update_time,
+            last.c.best_price,
+            last.c.free_seats,
+        )
+        .select_from(prices)
+        .join(last, true())
+        .cte("latest")
+    )
+    seen = (
+        update(Ticket)
+        .where(
+            Ticket.ticket_id == latest.c.ticket_id,
+            Ticket.update_time == latest.c.update_time,
+            latest.c.best_price == latest.c.new_price,
+            latest.c.free_seats.is_not_distinct_from(latest.c.new_seats),
+        )
+        .values(last_seen=text("TIMEZONE('utc', now())"))
+        .returning(Ticket.route_id)
+        .cte("seen")
+    )
+    return (
+        insert(Ticket)
+        .from_select(
+            [Ticket.route_id, Ticket.best_price, Ticket.free_seats],
+            select(prices.c.route_id, prices.c.best_price, prices.c.free_seats).filter(
+                prices.c.route_id.not_in(select(seen.c.route_id))
+            ),
+        )
+        .returning(Ticket.route_id)
+        .cte("added")
+    )
+
+
+async def record_price(
+    session: AsyncSession, route_id: int, best_price: int, free_seats: int = None
+) -> bool:
+    """записываем очередную цену маршрута
+
+    Если цена и места те же, что у последнего билета, только сдвигаем его last_seen,
+    иначе пишем новый билет. Возвращает True, если билет новый.
+    """
+    prices = select(
+        literal(route_id, Integer).label("route_id"),
+        literal(best_price, Integer).label("best_price"),
+        literal(free_seats, Integer).label("free_seats"),
+    ).cte("prices")
+    added = await session.scalar(
+        select(func.count()).select_from(_record_prices(prices))
+    )
+    await session.commit()
+    return added > 0
+
+
+async def delete_ticket_by_id(session: AsyncSession, ticket_id: int):
+    """удаляем билет"""
+    # первичный ключ у секционированной t_ticket составной (ticket_id, update_time)
+    await session.execute(delete(Ticket).filter_by(ticket_id=ticket_id))
+    await session.commit()
+
+
+def _upsert_route(values: list[dict]):
+    # DO UPDATE, а не DO NOTHING, чтобы RETURNING вернул айди и для уже существующего маршрута
+    stmt = insert(Route).values(values)
+    return stmt.on_conflict_do_update(
+        constraint="uq_route_natural_key", set_={"to_date": stmt.excluded.to_date}
+    ).returning(Route.route_id)
+
+
+def _route_key(route: dict) -> tuple:
+    return (
+        route["from_station_id"],
+        route["to_station_id"],
+        route["from_date"],
+        route["train_no"],
+        get_route_type(route["class_name"]),
+    )
+
+
+def _subscription_stations(route: dict) -> list[dict]:
+    return [
+        {
+            "station_id": route["from_station_id"],
+            "city_id": route["from_city_id"],
+            "station_name": route["from_station_name"],
+        },
+        {
+            "station_id": route["to_station_id"],
+            "city_id": route["to_city_id"],
+            "station_name": route["to_station_name"],
+        },
+    ]
+
+
+def _subscription_route(route: dict) -> dict:
+    return {
+        "from_station_id": route["from_station_id"],
+        "to_station_id": route["to_station_id"],
+        "from_date": route["from_date"],
+        "to_date": route["to_date"],
+        "train_no": route["train_no"],
+        "class_name": get_route_type(route["class_name"]),
+    }
+
+
+async def subscribe_to_route(session: AsyncSession, user_id: int, route: dict) -> int:
+    """подписка в один запрос и одну транзакцию: станции, маршрут, подписка и билет
+
+    Билет, как в record_price, новый только если цена или места поменялись.
+    route - словарь с ключами from_city_id, from_station_id, from_station_name,
+    to_city_id, to_station_id, to_station_name, from_date, to_date, train_no,
+    class_name, best_price и необязательным free_seats. Возвращает айди маршрута.
+    """
+    stations = (
+        insert(Station)
+        .values(_subscription_stations(route))
+        .on_conflict_do_nothing(index_elements=[Station.station_id])
+        .cte("stations")
+    )
+    new_route = _upsert_route([_subscription_route(route)]).cte("new_route")
+    subscription = (
+        insert(Subscription)
+        .from_select(
+            [Subscription.user_id, Subscription.route_id],
+            select(literal(user_id), new_route.c.route_id),
+        )
+        .on_conflict_do_nothing()
+        .cte("subscription")
+    )
+    # билет только если цена или места отличаются от последнего, как в record_price
+    ticket = _record_prices(
+        select(
+            new_route.c.route_id,
+            literal(route["best_price"], Integer).label("best_price"),
+            literal(route.get("free_seats"), Integer).label("free_seats"),
+        ).cte("prices")
+    )
+
+    route_id = await session.scalar(
+        select(new_route.c.route_id).add_cte(stations, subscription, ticket)
+    )
+    await session.commit()
+    return route_id
+
+
+async def subscribe_many(
+    session: AsyncSession, subscriptions: list[tuple[int, dict]]
+) -> list[int]:
+    """пачка подписок (user_id, route) одной транзакцией, по запросу на таблицу
+
+    Формат route как в subscribe_to_route. Возвращает айди маршрутов в том же порядке.
+    """
+    if not subscriptions:
+        return []
+
+    stations = {}
+    for _, route in subscriptions:
+        for station in _subscription_stations(route):
+            stations[station["station_id"]] = station
+    await session.execute(
+        insert(Station)
+        .values(list(stations.values()))
+        .on_conflict_do_nothing(index_elements=[Station.station_id])
+    )
+
+    # одинаковые маршруты в одной пачке схлопываем: ON CONFLICT DO UPDATE
+    # не может дважды затронуть одну строку в одном запросе
+    routes = {}
+    for _, route in subscriptions:
+        routes.setdefault(_route_key(route), _subscription_route(route))
+    # порядок RETURNING у многострочной вставки не гарантирован - сопоставляем по ключу
+    rows = await session.execute(
+        _upsert_route(list(routes.values())).returning(
+            Route.from_station_id,
+            Route.to_station_id,
+            Route.from_date,
+            Route.train_no,
+            Route.class_name,
+        )
+    )
+    ids_by_key = {tuple(row[1:]): row[0] for row in rows}
+    route_ids = [ids_by_key[_route_key(route)] for _, route in subscriptions]
+
+    await session.execute(
+        insert(Subscription)
+        .values(
+            [
+                {"user_id": user_id, "route_id": route_id}
+                for user_id, route_id in dict.fromkeys(
+                    (user_id, route_id)
+                    for (user_id, _), route_id in zip(subscriptions, route_ids)
+                )
+            ]
+        )
+        .on_conflict_do_nothing()
+    )
+    # по билету на маршрут (последняя цена в пачке) и только если цена
+    # или места поменялись, как в record_price
+    prices = {
+        route_id: (route_id, route["best_price"], route.get("free_seats"))
+        for (_, route), route_id in zip(subscriptions, route_ids)
+    }
+    batch = values(
+        column("route_id", Integer),
+        column("best_price", Integer),
+        column("free_seats", Integer),
+        name="batch",
+    ).data(list(prices.values()))
+    await session.execute(
+        select(func.count()).select_from(
+            _record_prices(
+                select(
+                    batch.c.route_id,
+                    batch.c.best_price,
+                    # NULL в VALUES без типа Postgres считает текстом
+                    cast(batch.c.free_seats, Integer).label("free_seats"),
+                ).cte("prices")
+            )
+        )
+    )
+    await session.commit()
+    return route_ids
+
+
+# ключ advisory lock, под которым один из воркеров раскладывает задачи
+REFRESH_PLAN_LOCK = 7305001
+
+
+async def sync_refresh_jobs(session: AsyncSession) -> dict | None:
+    """приводим t_refresh_job к ключам поиска подписанных маршрутов
+
+    Новым ключам - задача со сроком сейчас, задачи без маршрутов удаляем.
+    Если этим уже занят другой воркер, ничего не делаем и возвращаем None.
+    """
+    locked = await session.scalar(
+        select(func.pg_try_advisory_xact_lock(REFRESH_PLAN_LOCK))
+    )
+    if not locked:
+        await session.rollback()
+        return None
+
+    from_station = aliased(Station)
+    to_station = aliased(Station)
+    subscribed = (
+        select(Subscription.route_id)
+        .filter(Subscription.route_id == Route.route_id)
+        .exists()
+    )
+    keys = (
+        select(
+            from_station.city_id,
+            to_station.city_id,
+            cast(Route.from_date, Date),
+        )
+        .distinct()
+        .join(from_station, from_station.station_id == Route.from_station_id)
+        .join(to_station, to_station.station_id == Route.to_station_id)
+        .filter(subscribed)
+    )
+    added = await session.execute(
+        insert(RefreshJob)
+        .from_select(["from_city_id", "to_city_id", "travel_date"], keys)
+        .on_conflict_do_nothing(constraint="uq_refresh_job_key")
+        .returning(RefreshJob.job_id)
+    )
+    removed = await session.execute(
+        delete(RefreshJob)
+        .filter(
+            ~select(Route.route_id)
+            .join(from_station, from_station.station_id == Route.from_station_id)
+            .join(to_station, to_station.station_id == Route.to_station_id)
+            .filter(
+                from_station.city_id == RefreshJob.from_city_id,
+                to_station.city_id == RefreshJob.to_city_id,
+                Route.from_date >= RefreshJob.travel_date,
+                Route.from_date < RefreshJob.travel_date + 1,
+                subscribed,
+            )
+            .exists()
+        )
+        .returning(RefreshJob.job_id)
+    )
+    stats = {"added": len(added.all()), "removed": len(removed.all())}
+    await session.commit()
+    return stats
+
+
+async def claim_refresh_jobs(
+    session: AsyncSession, worker: str, limit: int, lease: float
+) -> list[dict]:
+    """забираем до limit задач, чей срок подошел, на lease секунд
+
+    Строки, которые сейчас забирает другой воркер, пропускаем (SKIP LOCKED),
+    задачи с истекшей арендой (воркер упал) снова доступны.
+    """
+    now = func.timezone("utc", func.now())
+    ready = (
+        select(RefreshJob.job_id)
+        .filter(
+            RefreshJob.due_at <= now,
+            or_(RefreshJob.locked_until.is_(None), RefreshJob.locked_until < now),
+        )
+        .order_by(RefreshJob.due_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    rows = await session.execute(
+        update(RefreshJob)
+        .filter(RefreshJob.job_id.in_(ready))
+        .values(
+            locked_by=worker,
+            locked_until=now + timedelta(seconds=lease),
+            attempts=RefreshJob.attempts + 1,
+        )
+        .returning(
+            RefreshJob.job_id,
+            RefreshJob.from_city_id,
+            RefreshJob.to_city_id,
+            RefreshJob.travel_date,
+            RefreshJob.attempts,
+        )
+    )
+    jobs = [dict(row) for row in rows.mappings()]
+    await session.commit()
+    return jobs
+
+
+async def finish_refresh_job(
+    session: AsyncSession, job_id: int, worker: str, delay: float, ok: bool = True
+) -> bool:
+    """отпускаем задачу со следующим сроком через delay секунд
+
+    False, если аренда истекла и задачу уже забрал другой воркер.
+    """
+    values = {
+        "due_at": func.timezone("utc", func.now()) + timedelta(seconds=delay),
+        "locked_by": None,
+        "locked_until": None,
+    }
+    if ok:
+        values["attempts"] = 0
+    result = await session.execute(
+        update(RefreshJob).filter_by(job_id=job_id, locked_by=worker).values(**values)
+    )
+    await session.commit()
+    return result.rowcount == 1
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 from bot.config import settings
@@ -6,3 +7,9 @@ from bot.config import settings
 engine = create_engine(url=settings.DATABASE_URL_psycopg, echo=True)
 
 session = scoped_session(sessionmaker(engine))
+
+# асинхронный движок на psycopg 3 для бота: своя сессия на каждую задачу,
+# чтобы запросы в базу не блокировали event loop
+async_engine = create_async_engine(url=settings.DATABASE_URL_psycopg)
+
+async_session = async_sessionmaker(async_engine, expire_on_commit=False)
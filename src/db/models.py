@@ -1,7 +1,7 @@
 import enum
 
-from sqlalchemy import (Column, DateTime, Enum, ForeignKey, Integer, String,
-                        text)
+from sqlalchemy import (Column, Date, DateTime, Enum, Float, ForeignKey, Index,
+                        Integer, String, UniqueConstraint, text)
 from sqlalchemy.orm import DeclarativeBase, relationship
 
 
@@ -13,7 +13,15 @@ class City(Base):
     """модель таблички городов"""
 
     __tablename__ = "t_city"
-    __table_args__ = {"extend_existing": True}
+    # text_pattern_ops - чтобы поиск по началу названия (LIKE 'x%') шел по индексу
+    __table_args__ = (
+        Index(
+            "ix_city_city_name_pattern",
+            "city_name",
+            postgresql_ops={"city_name": "text_pattern_ops"},
+        ),
+        {"extend_existing": True},
+    )
 
     city_id = Column(Integer, primary_key=True)
     city_name = Column(String(50), nullable=False)
@@ -57,7 +65,20 @@ class RouteType(enum.Enum):
 class Route(Base):
     """модель таблички маршрутов поездов"""
 
-    __table_args__ = {"extend_existing": True}
+    # один и тот же поезд/класс хранится один раз, сколько бы на него ни подписалось
+    __table_args__ = (
+        UniqueConstraint(
+            "from_station_id",
+            "to_station_id",
+            "from_date",
+            "train_no",
+            "class_name",
+            name="uq_route_natural_key",
+        ),
+        # чистка ушедших поездов
+        Index("ix_route_from_date", "from_date"),
+        {"extend_existing": True},
+    )
     __tablename__ = "t_route"
 
     route_id = Column(Integer, primary_key=True, autoincrement=True)
@@ -88,6 +109,8 @@ class Route(Base):
         back_populates="route",
         foreign_keys="Ticket.route_id",
         order_by="Ticket.best_price.asc()",
+        # билеты удаляет каскад в базе, историю в память не грузим
+        passive_deletes=True,
     )
 
     def __str__(self) -> str:
@@ -118,28 +141,52 @@ class User(Base):
 class Subscription(Base):
     """ассоциативная таблица с маршрутами, за которыми следят пользователи"""
 
-    __table_args__ = {"extend_existing": True}
+    # первичный ключ начинается с user_id, для поиска подписчиков маршрута нужен свой индекс
+    __table_args__ = (
+        Index("ix_subscription_route_id", "route_id"),
+        {"extend_existing": True},
+    )
     __tablename__ = "t_subscription"
 
     user_id = Column(Integer, ForeignKey("t_user.user_id"), primary_key=True)
-    route_id = Column(Integer, ForeignKey("t_route.route_id"), primary_key=True)
+    route_id = Column(
+        Integer, ForeignKey("t_route.route_id", ondelete="CASCADE"), primary_key=True
+    )
 
 
 class Ticket(Base):
     """табличка со стоимостью билетов для маршрутов"""
 
     __tablename__ = "t_ticket"
-    __table_args__ = {"extend_existing": True}
+    # секции по месяцам update_time (t_ticket_pYYYYMM), старые сворачивает
+    # в t_ticket_hourly/t_ticket_daily и удаляет src/core/ticket_retention.py
+    __table_args__ = (
+        # последняя цена по маршруту
+        Index("ix_ticket_route_id_update_time", "route_id", text("update_time DESC")),
+        {"extend_existing": True, "postgresql_partition_by": "RANGE (update_time)"},
+    )
 
-    ticket_id = Column(Integer, primary_key=True)
-    route_id = Column(Integer, ForeignKey("t_route.route_id"), nullable=False)
+    # ключ секционирования обязан входить в первичный ключ
+    ticket_id = Column(Integer, primary_key=True, autoincrement=True)
+    route_id = Column(
+        Integer, ForeignKey("t_route.route_id", ondelete="CASCADE"), nullable=False
+    )
     best_price = Column(
         Integer,
         nullable=False,
     )
     update_time = Column(
-        DateTime, nullable=False, server_default=text("TIMEZONE('utc', now())")
+        DateTime,
+        primary_key=True,
+        nullable=False,
+        server_default=text("TIMEZONE('utc', now())"),
     )  # постгрес автоматически подставит время получения инфы
+    # строка пишется только при изменении цены или мест, пока они прежние -
+    # сдвигаем время, когда такую цену видели последний раз
+    last_seen = Column(
+        DateTime, nullable=False, server_default=text("TIMEZONE('utc', now())")
+    )
+    free_seats = Column(Integer)
 
     # связь с маршрутами - маршут, к которому относится билет
     route = relationship(
@@ -151,3 +198,99 @@ class Ticket(Base):
 
     def __repr__(self):
         return f"--------- ticket_id {self.ticket_id}, for route_id {self.route_id}, {self.route.class_name.value}, {self.best_price} rub, updated: {self.update_time} \n"
+
+
+class TicketHourly(Base):
+    """почасовые min/avg/max цены по маршруту, сюда сворачиваются старые билеты"""
+
+    __tablename__ = "t_ticket_hourly"
+    __table_args__ = {"extend_existing": True}
+
+    # без внешнего ключа: агрегаты нужны и после удаления ушедших маршрутов
+    route_id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    min_price = Column(Integer, nullable=False)
+    avg_price = Column(Float, nullable=False)
+    max_price = Column(Integer, nullable=False)
+    # сколько исходных билетов в агрегате, нужно для среднего при слиянии
+    samples = Column(Integer, nullable=False)
+
+
+class TicketDaily(Base):
+    """подневные min/avg/max цены по маршруту, сюда сворачиваются старые почасовые"""
+
+    __tablename__ = "t_ticket_daily"
+    __table_args__ = {"extend_existing": True}
+
+    route_id = Column(Integer, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    min_price = Column(Integer, nullable=False)
+    avg_price = Column(Float, nullable=False)
+    max_price = Column(Integer, nullable=False)
+    samples = Column(Integer, nullable=False)
+
+
+class RouteCurrentPrice(Base):
+    """текущая цена маршрута, чтобы не сортировать всю историю t_ticket
+
+    Ведется триггером на вставку в t_ticket (см. миграцию c1d9e5f3a2b8).
+    """
+
+    __tablename__ = "t_route_current_price"
+    __table_args__ = {"extend_existing": True}
+
+    route_id = Column(
+        Integer, ForeignKey("t_route.route_id", ondelete="CASCADE"), primary_key=True
+    )
+    # последняя и предыдущая отличающаяся от нее цена
+    best_price = Column(Integer, nullable=False)
+    prev_price = Column(Integer)
+    min_price = Column(Integer, nullable=False)
+    max_price = Column(Integer, nullable=False)
+    # когда цена последний раз поменялась и когда пришел последний билет
+    changed_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class Meta(Base):
+    """служебные пары ключ-значение, например контрольная сумма загруженного city_codes.json"""
+
+    __tablename__ = "t_meta"
+    __table_args__ = {"extend_existing": True}
+
+    key = Column(String(50), primary_key=True)
+    value = Column(String(200), nullable=False)
+
+
+class RefreshJob(Base):
+    """очередь обновления для воркеров src/core/refresh_worker.py
+
+    Одна задача на ключ поиска ржд (города и день отправления): один поиск
+    обновляет все подписанные маршруты этого ключа. Воркер забирает задачу
+    через FOR UPDATE SKIP LOCKED и держит ее до locked_until, задачу упавшего
+    воркера после этого забирает другой.
+    """
+
+    __tablename__ = "t_refresh_job"
+    __table_args__ = (
+        UniqueConstraint(
+            "from_city_id", "to_city_id", "travel_date", name="uq_refresh_job_key"
+        ),
+        # выбор задач, чей срок подошел
+        Index("ix_refresh_job_due_at", "due_at"),
+        {"extend_existing": True},
+    )
+
+    job_id = Column(Integer, primary_key=True)
+    from_city_id = Column(Integer, nullable=False)
+    to_city_id = Column(Integer, nullable=False)
+    travel_date = Column(Date, nullable=False)
+    # когда обновить в следующий раз
+    due_at = Column(
+        DateTime, nullable=False, server_default=text("TIMEZONE('utc', now())")
+    )
+    # кто держит задачу и до какого момента
+    locked_by = Column(String(100))
+    locked_until = Column(DateTime)
+    # попытки с последнего успешного обновления, для отсрочки повтора
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
@@ -1,11 +1,16 @@
+import hashlib
 import json
-from datetime import datetime
+import os
+import time
+from datetime import datetime, timedelta
 
-from sqlalchemy import text
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
 
 from src.db.database import engine, session
-from src.db.models import (Base, City, Route, RouteType, Station, Subscription,
-                           Ticket, User, UserStatus)
+from src.db.models import (Base, City, Meta, Route, RouteCurrentPrice,
+                           RouteType, Station, Subscription, Ticket,
+                           TicketHourly, User, UserStatus)
 
 
 def create_tables():
@@ -15,17 +20,56 @@ def create_tables():
     engine.echo = True
 
 
-def load_cities_from_json(file_path: str):
-    """загружаем населенные пункты России в базу из city_codes.json"""
-    with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+# временная таблица под COPY, удаляется в конце транзакции
+CREATE_CITY_STAGE = (
+    "CREATE TEMPORARY TABLE city_stage (city_id integer, city_name varchar(50)) "
+    "ON COMMIT DROP"
+)
+COPY_CITY_STAGE = "COPY city_stage (city_id, city_name) FROM STDIN"
+MERGE_CITY_STAGE = (
+    "INSERT INTO t_city (city_id, city_name) "
+    "SELECT city_id, city_name FROM city_stage ON CONFLICT (city_id) DO NOTHING"
+)
 
-        for city_name in data:
-            city_id = int(data.get(city_name))
-            new_city = City(city_id=city_id, city_name=city_name)
-            session.add(new_city)
 
-        session.commit()
+def read_city_codes(file_path: str) -> tuple[str, str, dict]:
+    """ключ в t_meta, sha256 содержимого и сами коды из city_codes.json"""
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    key = f"{os.path.basename(file_path)}_sha256"
+    return key, hashlib.sha256(raw).hexdigest(), json.loads(raw)
+
+
+def save_meta(key: str, value: str):
+    stmt = insert(Meta).values(key=key, value=value)
+    return stmt.on_conflict_do_update(
+        index_elements=[Meta.key], set_={"value": stmt.excluded.value}
+    )
+
+
+def load_cities_from_json(file_path: str) -> int | None:
+    """загружаем населенные пункты России в базу из city_codes.json
+
+    Коды идут через COPY во временную таблицу и сливаются в t_city с
+    ON CONFLICT DO NOTHING, так что повторный запуск безопасен. Если файл
+    не менялся с прошлой загрузки (sha256 в t_meta), ничего не делаем.
+    Возвращает число добавленных городов или None, если загрузка пропущена.
+    """
+    key, checksum, data = read_city_codes(file_path)
+    meta = session.get(Meta, key)
+    if meta and meta.value == checksum:
+        return None
+
+    session.execute(text(CREATE_CITY_STAGE))
+    driver_connection = session.connection().connection.driver_connection
+    with driver_connection.cursor() as cursor:
+        with cursor.copy(COPY_CITY_STAGE) as copy:
+            for city_name, city_id in data.items():
+                copy.write_row((int(city_id), city_name))
+    added = session.execute(text(MERGE_CITY_STAGE)).rowcount
+    session.execute(save_meta(key, checksum))
+    session.commit()
+    return added
 
 
 def get_users_subscribed_to_route(route_id: int) -> list[int]:
@@ -71,26 +115,126 @@ def get_city(city_id: int):
     return session.query(City).filter(City.city_id == city_id).first()
 
 
-def delete_unvalid_routes():
-    """удаляет все подписки поезда которых уже ушли (т.е. дата маршрута прошла)"""
+# сколько ушедших маршрутов удаляем за одну транзакцию
+PURGE_CHUNK_SIZE = 1000
+
+
+def ticket_hours(tickets):
+    """каждый отрезок цены [update_time, last_seen] по всем часам, которые он покрывает"""
+    return select(
+        tickets.c.route_id,
+        func.generate_series(
+            func.date_trunc("hour", tickets.c.update_time),
+            func.date_trunc("hour", tickets.c.last_seen),
+            timedelta(hours=1),
+        ).label("at"),
+        tickets.c.best_price,
+    )
+
+
+def merge_rollup(target, rows):
+    """insert агрегатов rows в target, слитых с уже свернутыми за тот же bucket
+
+    rows - route_id, bucket, min_price, avg_price, max_price, samples.
+    """
+    table = target.__table__
+    stmt = insert(table).from_select(
+        ["route_id", "bucket", "min_price", "avg_price", "max_price", "samples"], rows
+    )
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.route_id, table.c.bucket],
+        set_={
+            "min_price": func.least(table.c.min_price, excluded.min_price),
+            "max_price": func.greatest(table.c.max_price, excluded.max_price),
+            # при слиянии среднее взвешиваем по samples
+            "avg_price": (
+                table.c.avg_price * table.c.samples
+                + excluded.avg_price * excluded.samples
+            )
+            / (table.c.samples + excluded.samples),
+            "samples": table.c.samples + excluded.samples,
+        },
+    )
+
+
+def purge_departed_chunk(chunk_size: int):
+    """один запрос, удаляющий пачку ушедших маршрутов с подписками и билетами
+
+    Возвращает одну строку: сколько удалено маршрутов, подписок и билетов
+    и сколько часов истории цен записано. Подписки и билеты удаляются и
+    каскадом, явные DELETE нужны для подсчета. Удаленные билеты сначала
+    сворачиваются в t_ticket_hourly, как это делает чистка истории.
+    """
+    chunk = (
+        select(Route.route_id)
+        .filter(Route.from_date < text("TIMEZONE('utc', now())"))
+        .order_by(Route.from_date)
+        .limit(chunk_size)
+        # параллельный запуск не ждет чужие блокировки, а берет другие маршруты
+        .with_for_update(skip_locked=True)
+        .cte("chunk")
+    )
+    subscriptions = (
+        delete(Subscription)
+        .where(Subscription.route_id == chunk.c.route_id)
+        .returning(Subscription.route_id)
+        .cte("subscriptions")
+    )
+    tickets = (
+        delete(Ticket)
+        .where(Ticket.route_id == chunk.c.route_id)
+        .returning(
+            Ticket.route_id, Ticket.best_price, Ticket.update_time, Ticket.last_seen
+        )
+        .cte("tickets")
+    )
+    hours = ticket_hours(tickets).subquery()
+    hourly = (
+        merge_rollup(
+            TicketHourly,
+            select(
+                hours.c.route_id,
+                hours.c.at,
+                func.min(hours.c.best_price),
+                func.avg(hours.c.best_price),
+                func.max(hours.c.best_price),
+                func.count(),
+            ).group_by(hours.c.route_id, hours.c.at),
+        )
+        .returning(TicketHourly.route_id)
+        .cte("hourly")
+    )
     routes = (
-        session.query(Route)
-        .filter(Route.from_date >= text("TIMEZONE('utc', now())"))
-        .all()
+        delete(Route)
+        .where(Route.route_id == chunk.c.route_id)
+        .returning(Route.route_id)
+        .cte("routes")
     )
-    if routes:
-        # удаляем все подписки с прошедшедшими датами, а также все маршруты из этих подписок
-        session.query(Subscription).filter(
-            Subscription.route_id in [route.route_id for route in routes]
-        ).delete(synchronize_session=False)
-        # удаляем все билеты с прошедшедшими датами, а также все маршруты из этих подписок
-        session.query(Ticket).filter(
-            Ticket.route.route.route_id in [route.route_id for route in routes]
-        ).delete(synchronize_session=False)
-        # наконец все маршруты удаляем
-        session.delete(routes)
+    return select(
+        select(func.count()).select_from(routes).scalar_subquery().label("routes"),
+        select(func.count())
+        .select_from(subscriptions)
+        .scalar_subquery()
+        .label("subscriptions"),
+        select(func.count()).select_from(tickets).scalar_subquery().label("tickets"),
+        select(func.count()).select_from(hourly).scalar_subquery().label("hourly"),
+    )
+
+
+def delete_unvalid_routes(chunk_size: int = PURGE_CHUNK_SIZE) -> list:
+    """удаляет все подписки поезда которых уже ушли (т.е. дата маршрута прошла)
+
+    Тот же запрос пачками, что и в async_queries, статистика по каждой пачке.
+    """
+    stats = []
+    while True:
+        started = time.perf_counter()
+        row = session.execute(purge_departed_chunk(chunk_size)).one()
         session.commit()
-    return []
+        stats.append({**row._asdict(), "seconds": time.perf_counter() - started})
+        if row.routes < chunk_size:
+            return stats
 
 
 def get_routes_subscribed() -> list:
@@ -138,17 +282,13 @@ def get_route_with_tickets_by_id(route_id: int) -> dict:
         result["to_date"] = route.to_date
         result["train_no"] = route.train_no
 
-        # получили самый последний по времени обновления билет с таким маршрутом
-        last_ticket = (
-            session.query(Ticket)
-            .filter_by(route_id=route_id)
-            .order_by(Ticket.update_time.desc())
-            .first()
-        )
+        # последняя цена из t_route_current_price, ее ведет триггер на t_ticket;
+        # сессия общая на модуль, поэтому строку перечитываем, а не берем из кэша
+        current_price = session.get(RouteCurrentPrice, route_id, populate_existing=True)
 
-        if last_ticket:
-            result["class_name"] = last_ticket.route.class_name.value
-            result["best_price"] = last_ticket.best_price
+        if current_price:
+            result["class_name"] = route.class_name.value
+            result["best_price"] = current_price.best_price
 
     return result
 
@@ -173,6 +313,21 @@ def add_station(city_id: int, station_id: int, station_name: str):
     session.commit()
 
 
+def get_route_type(class_name: str) -> RouteType:
+    """переводим название класса из ответа ржд в RouteType"""
+    if class_name == "плацкартный":
+        return RouteType.plackart
+    elif class_name == "купе":
+        return RouteType.cupe
+    elif class_name == "сидячий":
+        return RouteType.seated
+    elif class_name == "св":
+        return RouteType.sv
+    raise Exception(
+        'Неправильно указан класс поезда (не "купе", "плацкарт", "св" или "сидячий")'
+    )
+
+
 def add_route(
     from_station_id: int,
     to_station_id: int,
@@ -181,19 +336,22 @@ def add_route(
     train_no: str,
     class_name: str,
 ) -> int:
-    """добавляем новый маршрут"""
-    if class_name == "плацкартный":
-        class_name = RouteType.plackart
-    elif class_name == "купе":
-        class_name = RouteType.cupe
-    elif class_name == "сидячий":
-        class_name = RouteType.seated
-    elif class_name == "св":
-        class_name = RouteType.sv
-    else:
-        raise Exception(
-            'Неправильно указан класс поезда (не "купе", "плацкарт", "св" или "сидячий")'
+    """добавляем новый маршрут, если такого поезда с таким классом еще нет"""
+    class_name = get_route_type(class_name)
+
+    route = (
+        session.query(Route)
+        .filter_by(
+            from_station_id=from_station_id,
+            to_station_id=to_station_id,
+            from_date=from_date,
+            train_no=train_no,
+            class_name=class_name,
         )
+        .first()
+    )
+    if route:
+        return route.route_id
 
     new_route = Route(
         from_station_id=from_station_id,
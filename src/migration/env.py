@@ -1,5 +1,6 @@
 # почему алембик на видит таблицы???
 
+import re
 from logging.config import fileConfig
 
 from alembic import context
@@ -18,6 +19,15 @@ if config.config_file_name is not None:
 
 target_metadata = Base.metadata
 
+# секции t_ticket создаются на лету (см. t_ticket_ensure_partitions), в моделях их нет
+TICKET_PARTITION = re.compile(r"t_ticket_(p\d{6}|default)")
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "table" and reflected and TICKET_PARTITION.fullmatch(name):
+        return False
+    return True
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
@@ -35,6 +45,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -57,7 +68,11 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+        )
 
         with context.begin_transaction():
             context.run_migrations()
@@ -0,0 +1,89 @@
+"""move default partition rows into new ticket partitions
+
+Revision ID: 6d2f8b4a1c39
+Revises: 3b5d8e1f7a92
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "6d2f8b4a1c39"
+down_revision: Union[str, None] = "3b5d8e1f7a92"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CREATE TABLE ... PARTITION OF падает, если в секции по умолчанию уже есть
+    # строки за этот месяц. Поэтому секцию создаем отдельной таблицей, переносим
+    # в нее строки из t_ticket_default и только потом присоединяем
+    op.execute("""
+        CREATE OR REPLACE FUNCTION t_ticket_ensure_partitions(
+            from_month date, to_month date
+        )
+        RETURNS void AS $$
+        DECLARE
+            month date := date_trunc('month', from_month);
+            partition text;
+        BEGIN
+            WHILE month <= to_month LOOP
+                partition := 't_ticket_p' || to_char(month, 'YYYYMM');
+                IF to_regclass(partition) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I (LIKE t_ticket '
+                        'INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                        partition
+                    );
+                    -- у отдельной таблицы нет триггера текущей цены,
+                    -- так что перенос t_route_current_price не трогает
+                    EXECUTE format(
+                        'WITH moved AS ('
+                        'DELETE FROM t_ticket_default '
+                        'WHERE update_time >= %L AND update_time < %L '
+                        'RETURNING *'
+                        ') INSERT INTO %I SELECT * FROM moved',
+                        month,
+                        month + INTERVAL '1 month',
+                        partition
+                    );
+                    EXECUTE format(
+                        'ALTER TABLE t_ticket ATTACH PARTITION %I '
+                        'FOR VALUES FROM (%L) TO (%L)',
+                        partition,
+                        month,
+                        month + INTERVAL '1 month'
+                    );
+                END IF;
+                month := month + INTERVAL '1 month';
+            END LOOP;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION t_ticket_ensure_partitions(
+            from_month date, to_month date
+        )
+        RETURNS void AS $$
+        DECLARE
+            month date := date_trunc('month', from_month);
+        BEGIN
+            WHILE month <= to_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF t_ticket '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    't_ticket_p' || to_char(month, 'YYYYMM'),
+                    month,
+                    month + INTERVAL '1 month'
+                );
+                month := month + INTERVAL '1 month';
+            END LOOP;
+        END
+        $$ LANGUAGE plpgsql
+        """)
@@ -0,0 +1,74 @@
+"""route natural key
+
+Revision ID: 8d3f1c2a9b47
+Revises: 5e6f6b29cbd0
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8d3f1c2a9b47"
+down_revision: Union[str, None] = "5e6f6b29cbd0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # для каждого дубликата - самый старый маршрут с тем же ключом, он и останется
+    op.execute(
+        """
+        CREATE TEMPORARY TABLE route_merge ON COMMIT DROP AS
+        SELECT route_id, keep_id FROM (
+            SELECT route_id,
+                   min(route_id) OVER (
+                       PARTITION BY from_station_id, to_station_id, from_date,
+                                    train_no, class_name
+                   ) AS keep_id
+            FROM t_route
+        ) routes
+        WHERE route_id <> keep_id
+        """
+    )
+    # подписки переносим на оставшийся маршрут, если юзер был подписан на
+    # несколько дубликатов - остается одна подписка
+    op.execute(
+        """
+        INSERT INTO t_subscription (user_id, route_id)
+        SELECT s.user_id, m.keep_id
+        FROM t_subscription s JOIN route_merge m ON m.route_id = s.route_id
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM t_subscription s USING route_merge m
+        WHERE s.route_id = m.route_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE t_ticket t SET route_id = m.keep_id
+        FROM route_merge m WHERE t.route_id = m.route_id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM t_route r USING route_merge m
+        WHERE r.route_id = m.route_id
+        """
+    )
+    op.create_unique_constraint(
+        "uq_route_natural_key",
+        "t_route",
+        ["from_station_id", "to_station_id", "from_date", "train_no", "class_name"],
+    )
+
+
+def downgrade() -> None:
+    # слитые дубликаты обратно не разделить, снимаем только ограничение
+    op.drop_constraint("uq_route_natural_key", "t_route", type_="unique")
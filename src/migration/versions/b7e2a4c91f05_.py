@@ -0,0 +1,68 @@
+"""indexes for hot queries
+
+Revision ID: b7e2a4c91f05
+Revises: 8d3f1c2a9b47
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b7e2a4c91f05"
+down_revision: Union[str, None] = "8d3f1c2a9b47"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY не блокирует запись в таблицы, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_ticket_route_id_update_time",
+            "t_ticket",
+            ["route_id", sa.text("update_time DESC")],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_subscription_route_id",
+            "t_subscription",
+            ["route_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_city_city_name_pattern",
+            "t_city",
+            ["city_name"],
+            postgresql_ops={"city_name": "text_pattern_ops"},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_route_from_date",
+            "t_route",
+            ["from_date"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index_name, table_name in [
+            ("ix_route_from_date", "t_route"),
+            ("ix_city_city_name_pattern", "t_city"),
+            ("ix_subscription_route_id", "t_subscription"),
+            ("ix_ticket_route_id_update_time", "t_ticket"),
+        ]:
+            op.drop_index(
+                index_name,
+                table_name=table_name,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
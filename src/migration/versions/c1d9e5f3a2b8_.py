@@ -0,0 +1,94 @@
+"""route current price
+
+Revision ID: c1d9e5f3a2b8
+Revises: b7e2a4c91f05
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "c1d9e5f3a2b8"
+down_revision: Union[str, None] = "b7e2a4c91f05"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "t_route_current_price",
+        sa.Column("route_id", sa.Integer(), nullable=False),
+        sa.Column("best_price", sa.Integer(), nullable=False),
+        sa.Column("prev_price", sa.Integer(), nullable=True),
+        sa.Column("min_price", sa.Integer(), nullable=False),
+        sa.Column("max_price", sa.Integer(), nullable=False),
+        sa.Column("changed_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["route_id"], ["t_route.route_id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("route_id"),
+    )
+    # применяем одну цену к текущей; билеты старше уже учтенного не трогают цену
+    op.execute("""
+        CREATE FUNCTION route_current_price_apply(
+            p_route_id integer, p_price integer, p_at timestamp
+        ) RETURNS void AS $$
+        INSERT INTO t_route_current_price AS cur (
+            route_id, best_price, prev_price, min_price, max_price,
+            changed_at, updated_at
+        )
+        VALUES (p_route_id, p_price, NULL, p_price, p_price, p_at, p_at)
+        ON CONFLICT (route_id) DO UPDATE SET
+            best_price = EXCLUDED.best_price,
+            prev_price = CASE WHEN cur.best_price <> EXCLUDED.best_price
+                              THEN cur.best_price ELSE cur.prev_price END,
+            min_price = LEAST(cur.min_price, EXCLUDED.best_price),
+            max_price = GREATEST(cur.max_price, EXCLUDED.best_price),
+            changed_at = CASE WHEN cur.best_price <> EXCLUDED.best_price
+                              THEN EXCLUDED.updated_at ELSE cur.changed_at END,
+            updated_at = EXCLUDED.updated_at
+        WHERE cur.updated_at <= EXCLUDED.updated_at
+        $$ LANGUAGE sql
+        """)
+    op.execute("""
+        CREATE FUNCTION route_current_price_on_ticket() RETURNS trigger AS $$
+        BEGIN
+            PERFORM route_current_price_apply(
+                NEW.route_id, NEW.best_price, NEW.update_time
+            );
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    op.execute("""
+        CREATE TRIGGER t_ticket_current_price
+        AFTER INSERT ON t_ticket
+        FOR EACH ROW EXECUTE FUNCTION route_current_price_on_ticket()
+        """)
+    # заполняем по уже собранной истории в порядке поступления
+    op.execute("""
+        DO $$
+        DECLARE
+            ticket record;
+        BEGIN
+            FOR ticket IN
+                SELECT route_id, best_price, update_time FROM t_ticket
+                ORDER BY update_time, ticket_id
+            LOOP
+                PERFORM route_current_price_apply(
+                    ticket.route_id, ticket.best_price, ticket.update_time
+                );
+            END LOOP;
+        END
+        $$
+        """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER t_ticket_current_price ON t_ticket")
+    op.execute("DROP FUNCTION route_current_price_on_ticket()")
+    op.execute("DROP FUNCTION route_current_price_apply(integer, integer, timestamp)")
+    op.drop_table("t_route_current_price")
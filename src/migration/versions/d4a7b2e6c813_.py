@@ -0,0 +1,137 @@
+"""partitioned ticket history and rollups
+
+Revision ID: d4a7b2e6c813
+Revises: c1d9e5f3a2b8
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "d4a7b2e6c813"
+down_revision: Union[str, None] = "c1d9e5f3a2b8"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # старую таблицу переименовываем, данные переложим в секционированную
+    op.execute("DROP TRIGGER t_ticket_current_price ON t_ticket")
+    op.execute("DROP INDEX ix_ticket_route_id_update_time")
+    op.execute("ALTER TABLE t_ticket RENAME TO t_ticket_old")
+    op.execute(
+        "ALTER TABLE t_ticket_old RENAME CONSTRAINT t_ticket_pkey TO t_ticket_old_pkey"
+    )
+
+    # ключ секционирования обязан входить в первичный ключ
+    op.execute("""
+        CREATE TABLE t_ticket (
+            ticket_id integer NOT NULL DEFAULT nextval('t_ticket_ticket_id_seq'),
+            route_id integer NOT NULL,
+            best_price integer NOT NULL,
+            update_time timestamp NOT NULL DEFAULT TIMEZONE('utc', now()),
+            CONSTRAINT t_ticket_pkey PRIMARY KEY (ticket_id, update_time),
+            CONSTRAINT t_ticket_route_id_fkey FOREIGN KEY (route_id)
+                REFERENCES t_route (route_id)
+        ) PARTITION BY RANGE (update_time)
+        """)
+    op.execute(
+        "CREATE INDEX ix_ticket_route_id_update_time "
+        "ON t_ticket (route_id, update_time DESC)"
+    )
+    # сюда попадает то, для чего месячной секции еще нет
+    op.execute("CREATE TABLE t_ticket_default PARTITION OF t_ticket DEFAULT")
+
+    # секции t_ticket_pYYYYMM на каждый месяц из [from_month, to_month]
+    op.execute("""
+        CREATE FUNCTION t_ticket_ensure_partitions(from_month date, to_month date)
+        RETURNS void AS $$
+        DECLARE
+            month date := date_trunc('month', from_month);
+        BEGIN
+            WHILE month <= to_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF t_ticket '
+                    'FOR VALUES FROM (%L) TO (%L)',
+                    't_ticket_p' || to_char(month, 'YYYYMM'),
+                    month,
+                    month + INTERVAL '1 month'
+                );
+                month := month + INTERVAL '1 month';
+            END LOOP;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    op.execute("""
+        SELECT t_ticket_ensure_partitions(
+            COALESCE(min(update_time), TIMEZONE('utc', now()))::date,
+            (TIMEZONE('utc', now()) + INTERVAL '2 months')::date
+        )
+        FROM t_ticket_old
+        """)
+    op.execute("""
+        INSERT INTO t_ticket (ticket_id, route_id, best_price, update_time)
+        SELECT ticket_id, route_id, best_price, update_time FROM t_ticket_old
+        """)
+    op.execute("ALTER SEQUENCE t_ticket_ticket_id_seq OWNED BY t_ticket.ticket_id")
+    op.execute("DROP TABLE t_ticket_old")
+    # текущие цены уже посчитаны по этим же данным, триггер вешаем после переноса
+    op.execute("""
+        CREATE TRIGGER t_ticket_current_price
+        AFTER INSERT ON t_ticket
+        FOR EACH ROW EXECUTE FUNCTION route_current_price_on_ticket()
+        """)
+
+    for table_name in ["t_ticket_hourly", "t_ticket_daily"]:
+        op.create_table(
+            table_name,
+            sa.Column("route_id", sa.Integer(), nullable=False),
+            sa.Column("bucket", sa.DateTime(), nullable=False),
+            sa.Column("min_price", sa.Integer(), nullable=False),
+            sa.Column("avg_price", sa.Float(), nullable=False),
+            sa.Column("max_price", sa.Integer(), nullable=False),
+            sa.Column("samples", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("route_id", "bucket"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("t_ticket_daily")
+    op.drop_table("t_ticket_hourly")
+
+    op.execute("ALTER TABLE t_ticket RENAME TO t_ticket_old")
+    op.execute("ALTER SEQUENCE t_ticket_ticket_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE t_ticket (
+            ticket_id integer NOT NULL DEFAULT nextval('t_ticket_ticket_id_seq'),
+            route_id integer NOT NULL,
+            best_price integer NOT NULL,
+            update_time timestamp NOT NULL DEFAULT TIMEZONE('utc', now()),
+            CONSTRAINT t_ticket_route_id_fkey FOREIGN KEY (route_id)
+                REFERENCES t_route (route_id)
+        )
+        """)
+    op.execute("""
+        INSERT INTO t_ticket (ticket_id, route_id, best_price, update_time)
+        SELECT ticket_id, route_id, best_price, update_time FROM t_ticket_old
+        """)
+    op.execute("ALTER SEQUENCE t_ticket_ticket_id_seq OWNED BY t_ticket.ticket_id")
+    # секции удаляются вместе с родительской таблицей
+    op.execute("DROP TABLE t_ticket_old")
+    op.execute(
+        "ALTER TABLE t_ticket ADD CONSTRAINT t_ticket_pkey PRIMARY KEY (ticket_id)"
+    )
+    op.execute(
+        "CREATE INDEX ix_ticket_route_id_update_time "
+        "ON t_ticket (route_id, update_time DESC)"
+    )
+    op.execute("DROP FUNCTION t_ticket_ensure_partitions(date, date)")
+    op.execute("""
+        CREATE TRIGGER t_ticket_current_price
+        AFTER INSERT ON t_ticket
+        FOR EACH ROW EXECUTE FUNCTION route_current_price_on_ticket()
+        """)
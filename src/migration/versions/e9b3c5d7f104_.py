@@ -0,0 +1,68 @@
+"""ticket last seen and free seats
+
+Revision ID: e9b3c5d7f104
+Revises: d4a7b2e6c813
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e9b3c5d7f104"
+down_revision: Union[str, None] = "d4a7b2e6c813"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("t_ticket", sa.Column("last_seen", sa.DateTime(), nullable=True))
+    op.add_column("t_ticket", sa.Column("free_seats", sa.Integer(), nullable=True))
+    op.execute("UPDATE t_ticket SET last_seen = update_time")
+    op.alter_column(
+        "t_ticket",
+        "last_seen",
+        nullable=False,
+        server_default=sa.text("TIMEZONE('utc', now())"),
+    )
+
+    # подряд идущие билеты с той же ценой схлопываем в первый из них,
+    # время последнего повтора переносим в его last_seen
+    op.execute("""
+        CREATE TEMPORARY TABLE ticket_runs ON COMMIT DROP AS
+        SELECT ticket_id, update_time, is_start,
+               max(update_time) OVER (PARTITION BY route_id, run) AS run_end
+        FROM (
+            SELECT *,
+                   count(*) FILTER (WHERE is_start) OVER (
+                       PARTITION BY route_id ORDER BY update_time, ticket_id
+                   ) AS run
+            FROM (
+                SELECT ticket_id, route_id, update_time,
+                       best_price IS DISTINCT FROM lag(best_price) OVER (
+                           PARTITION BY route_id ORDER BY update_time, ticket_id
+                       ) AS is_start
+                FROM t_ticket
+            ) starts
+        ) runs
+        """)
+    op.execute("""
+        UPDATE t_ticket t SET last_seen = r.run_end
+        FROM ticket_runs r
+        WHERE r.is_start
+          AND t.ticket_id = r.ticket_id AND t.update_time = r.update_time
+        """)
+    op.execute("""
+        DELETE FROM t_ticket t USING ticket_runs r
+        WHERE NOT r.is_start
+          AND t.ticket_id = r.ticket_id AND t.update_time = r.update_time
+        """)
+
+
+def downgrade() -> None:
+    # схлопнутые повторы не восстанавливаем, история остается по изменениям
+    op.drop_column("t_ticket", "free_seats")
+    op.drop_column("t_ticket", "last_seen")
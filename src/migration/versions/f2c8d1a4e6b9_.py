@@ -0,0 +1,41 @@
+"""cascade route deletes
+
+Revision ID: f2c8d1a4e6b9
+Revises: e9b3c5d7f104
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "f2c8d1a4e6b9"
+down_revision: Union[str, None] = "e9b3c5d7f104"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _route_foreign_keys(ondelete: Union[str, None]) -> None:
+    for table_name in ["t_subscription", "t_ticket"]:
+        constraint_name = f"{table_name}_route_id_fkey"
+        op.drop_constraint(constraint_name, table_name, type_="foreignkey")
+        op.create_foreign_key(
+            constraint_name,
+            table_name,
+            "t_route",
+            ["route_id"],
+            ["route_id"],
+            ondelete=ondelete,
+        )
+
+
+def upgrade() -> None:
+    # при удалении маршрута подписки и билеты уходят вместе с ним
+    _route_foreign_keys("CASCADE")
+
+
+def downgrade() -> None:
+    _route_foreign_keys(None)
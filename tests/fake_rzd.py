@@ -0,0 +1,199 @@
+"""Локальная замена апи расписания ржд для офлайн-тестов и нагрузки.
+
+Отдает записанные ответы из tests/fixtures (или синтетические нужного размера),
+RID становится готов через rid_delay секунд, часть запросов может падать.
+
+Запуск отдельным процессом из корня репозитория:
+    python -m tests.fake_rzd --port 8085 --rid-delay 0.8 --error-rate 0.05 --trains 200
+и в .env: RZD_BASE_URL=http://127.0.0.1:8085/timetable/public/ru
+"""
+
+import argparse
+import itertools
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+FIXTURES_PATH = "tests/fixtures"
+PATH = "/timetable/public/ru"
+CLASSES = ["Плацкартный", "Купе", "СВ", "Сидячий", "Люкс"]
+
+
+def load_fixture(name: str) -> dict:
+    with open(f"{FIXTURES_PATH}/{name}", "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def make_response(trains: int, cars: int, seed: int = 0) -> dict:
+    """синтетический ответ ржд нужного размера"""
+    rnd = random.Random(seed)
+    start = datetime(2026, 10, 28)
+    train_list = []
+    for i in range(trains):
+        dep = start + timedelta(minutes=rnd.randrange(0, 24 * 60, 5))
+        arr = dep + timedelta(minutes=rnd.randrange(240, 24 * 60, 5))
+        train_list.append(
+            {
+                "number": f"{i:03d}А",
+                "station0": "МОСКВА ОКТЯБРЬСКАЯ",
+                "station1": "САНКТ-ПЕТЕРБУРГ-ГЛАВН.",
+                "code0": 2006004,
+                "code1": 2004001,
+                "route0": "МОСКВА",
+                "route1": "С-ПЕТЕР-ГЛ",
+                "date0": dep.strftime("%d.%m.%Y"),
+                "time0": dep.strftime("%H:%M"),
+                "date1": arr.strftime("%d.%m.%Y"),
+                "time1": arr.strftime("%H:%M"),
+                "cars": [
+                    {
+                        "typeLoc": rnd.choice(CLASSES),
+                        "type": "Купе",
+                        "tariff": rnd.randrange(1500, 20000),
+                        "freeSeats": rnd.randrange(1, 60),
+                    }
+                    for _ in range(cars)
+                ],
+            }
+        )
+    return {
+        "result": "OK",
+        "tp": [
+            {
+                "from": "МОСКВА",
+                "fromCode": 2000000,
+                "where": "САНКТ-ПЕТЕРБУРГ",
+                "whereCode": 2004000,
+                "list": train_list,
+            }
+        ],
+    }
+
+
+class FakeRzd:
+    """фейковый pass.rzd.ru на aiohttp.web
+
+    rid_delay - через сколько секунд RID готов, error_rate - доля запросов с 503,
+    no_tickets_rate - доля поисков, где билетов нет, trains/cars - размер
+    синтетического ответа (0 поездов - записанный ответ из фикстур).
+    """
+
+    def __init__(
+        self,
+        rid_delay: float = 0.5,
+        error_rate: float = 0.0,
+        no_tickets_rate: float = 0.0,
+        trains: int = 0,
+        cars: int = 12,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = None,
+    ):
+        self.rid_delay = rid_delay
+        self.error_rate = error_rate
+        self.no_tickets_rate = no_tickets_rate
+        self.host = host
+        self.port = port
+        self._random = random.Random(seed)
+
+        self._rid_response = load_fixture("rzd_rid.json")
+        if trains:
+            self._timetable = make_response(trains, cars)
+        else:
+            self._timetable = load_fixture("rzd_timetable.json")
+        self._body = json.dumps(self._timetable, ensure_ascii=False)
+
+        self._rids = {}
+        self._rid_seq = itertools.count(self._rid_response["RID"])
+        self._runner = None
+
+        self.searches = 0
+        self.rid_polls = 0
+        self.errors = 0
+
+        self.app = web.Application()
+        self.app.router.add_get(PATH, self.handle)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{PATH}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # port=0 - порт выбрала система
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text="Service Unavailable")
+
+        rid = request.query.get("rid")
+        if rid is None:
+            self.searches += 1
+            if self._random.random() < self.no_tickets_rate:
+                return web.json_response({"result": "OK", "tp": []})
+            rid = str(next(self._rid_seq))
+            self._rids[rid] = time.monotonic()
+            return web.json_response({**self._rid_response, "RID": int(rid)})
+
+        self.rid_polls += 1
+        created = self._rids.get(rid)
+        if created is None:
+            return web.json_response({"result": "FAIL", "message": "RID не найден"})
+        if time.monotonic() - created < self.rid_delay:
+            return web.json_response({"result": "RID", "RID": int(rid)})
+
+        del self._rids[rid]
+        return web.Response(text=self._body, content_type="application/json")
+
+    def stats(self) -> dict:
+        return {
+            "searches": self.searches,
+            "rid_polls": self.rid_polls,
+            "errors": self.errors,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--rid-delay", type=float, default=0.8)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--no-tickets-rate", type=float, default=0.0)
+    parser.add_argument("--trains", type=int, default=0)
+    parser.add_argument("--cars", type=int, default=12)
+    args = parser.parse_args()
+
+    fake = FakeRzd(
+        rid_delay=args.rid_delay,
+        error_rate=args.error_rate,
+        no_tickets_rate=args.no_tickets_rate,
+        trains=args.trains,
+        cars=args.cars,
+    )
+    print(f"RZD_BASE_URL=http://{args.host}:{args.port}{PATH}")
+    web.run_app(fake.app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, event, func, select, update
+
+from src.db.async_queries import (add_route, add_station, add_subscription,
+                                  add_ticket, add_user, check_user_is_banned,
+                                  delete_route, delete_subscription,
+                                  delete_unvalid_routes, get_current_price,
+                                  get_price_series,
+                                  get_route_with_tickets_by_id,
+                                  get_user_subscriptions_page,
+                                  get_user_subscrtions,
+                                  get_users_subscribed_to_route, record_price,
+                                  subscribe_many, subscribe_to_route)
+from src.db.database import async_engine, async_session
+from src.db.models import (Route, RouteCurrentPrice, Subscription, Ticket,
+                           TicketHourly)
+
+
+def seed_route(n: int, **fields) -> dict:
+    """маршрут для subscribe_to_route на своих станциях "пупупу-n", чтобы тесты не пересекались"""
+    return {
+        "from_city_id": 2010359,
+        "from_station_id": 58857 + n,
+        "from_station_name": f"пупупу-{n}",
+        "to_city_id": 2060533,
+        "to_station_id": 3932 + n,
+        "to_station_name": f"у черта на куличиках-{n}",
+        "from_date": datetime(2024, 6, 20, 9, 14, 10),
+        "to_date": datetime(2024, 6, 21, 7, 34, 11),
+        "train_no": "ЪЫЪ",
+        "class_name": "купе",
+        "best_price": 1000,
+        **fields,
+    }
+
+
+class TestAsyncQueries(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = async_session()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        # пул соединений привязан к event loop, а у каждого теста он свой
+        await async_engine.dispose()
+
+    async def test_subscribe_flow(self):
+        await add_user(self.session, user_id=19998)
+        await add_station(
+            self.session, station_name="пупупу", station_id=58858, city_id=2010359
+        )
+        await add_station(
+            self.session,
+            station_name="у черта на куличиках",
+            station_id=3933,
+            city_id=2060533,
+        )
+        route_id = await add_route(
+            self.session,
+            from_station_id=58858,
+            from_date=datetime(2024, 6, 19, 9, 14, 10),
+            to_station_id=3933,
+            to_date=datetime(2024, 7, 23, 7, 34, 11),
+            train_no="ЪЫЪ",
+            class_name="купе",
+        )
+        await add_subscription(self.session, user_id=19998, route_id=route_id)
+        await add_ticket(self.session, route_id=route_id, best_price=1377)
+
+        self.assertFalse(await check_user_is_banned(self.session, 19998))
+        self.assertIn(
+            19998, await get_users_subscribed_to_route(self.session, route_id)
+        )
+
+        route = await get_route_with_tickets_by_id(self.session, route_id)
+        self.assertEqual(route["train_no"], "ЪЫЪ")
+        self.assertEqual(route["class_name"], "купе")
+        self.assertEqual(route["best_price"], 1377)
+        self.assertEqual(route["from_station_city"], 2010359)
+
+        subscriptions = await get_user_subscrtions(self.session, 19998)
+        self.assertIn(route_id, [sub["route_id"] for sub in subscriptions])
+
+        await delete_subscription(self.session, user_id=19998, route_id=route_id)
+        self.assertNotIn(
+            19998, await get_users_subscribed_to_route(self.session, route_id)
+        )
+
+    async def test_subscribe_to_route(self):
+        await add_user(self.session, user_id=19997)
+        route = seed_route(
+            2,
+            from_date=datetime(2024, 6, 19, 9, 14, 10),
+            to_date=datetime(2024, 7, 23, 7, 34, 11),
+            class_name="сидячий",
+            best_price=990,
+        )
+        route_id = await subscribe_to_route(self.session, 19997, route)
+
+        self.assertIn(
+            19997, await get_users_subscribed_to_route(self.session, route_id)
+        )
+        saved = await get_route_with_tickets_by_id(self.session, route_id)
+        self.assertEqual(saved["from_station"], 58859)
+        self.assertEqual(saved["to_station_city"], 2060533)
+        self.assertEqual(saved["class_name"], "сидячий")
+        self.assertEqual(saved["best_price"], 990)
+
+        # станции уже есть - повторная подписка их не трогает
+        route_ids = await subscribe_many(
+            self.session,
+            [(19997, route), (19997, {**route, "train_no": "ЪЪЪ", "best_price": 1200})],
+        )
+        self.assertEqual(len(route_ids), 2)
+        # тот же поезд и класс - тот же маршрут
+        self.assertEqual(route_ids[0], route_id)
+        self.assertNotEqual(route_ids[1], route_id)
+        saved = await get_route_with_tickets_by_id(self.session, route_ids[1])
+        self.assertEqual(saved["train_no"], "ЪЪЪ")
+        self.assertEqual(saved["best_price"], 1200)
+
+        for route_id in [route_id, *route_ids]:
+            await delete_subscription(self.session, user_id=19997, route_id=route_id)
+
+    async def count_tickets(self, route_id: int) -> int:
+        return await self.session.scalar(
+            select(func.count()).select_from(Ticket).filter_by(route_id=route_id)
+        )
+
+    async def test_route_is_deduplicated(self):
+        await add_user(self.session, user_id=19996)
+        await add_user(self.session, user_id=19995)
+        route = seed_route(3, best_price=3000)
+        first = await subscribe_to_route(self.session, 19996, route)
+        tickets = await self.count_tickets(first)
+        second = await subscribe_to_route(self.session, 19995, route)
+        self.assertEqual(first, second)
+        # та же цена у второго подписчика - новой строки в истории нет
+        self.assertEqual(await self.count_tickets(first), tickets)
+        await subscribe_many(self.session, [(19995, route), (19996, route)])
+        self.assertEqual(await self.count_tickets(first), tickets)
+        await subscribe_many(self.session, [(19995, {**route, "best_price": 3100})])
+        self.assertEqual(await self.count_tickets(first), tickets + 1)
+        self.assertEqual(
+            first,
+            await add_route(
+                self.session,
+                from_station_id=58860,
+                to_station_id=3935,
+                from_date=datetime(2024, 6, 20, 9, 14, 10),
+                to_date=datetime(2024, 6, 21, 7, 34, 11),
+                train_no="ЪЫЪ",
+                class_name="купе",
+            ),
+        )
+        self.assertEqual(
+            {19995, 19996},
+            set(await get_users_subscribed_to_route(self.session, first))
+            & {19995, 19996},
+        )
+
+        await delete_subscription(self.session, user_id=19996, route_id=first)
+        await delete_subscription(self.session, user_id=19995, route_id=first)
+
+    async def test_subscriptions_in_one_query(self):
+        await add_user(self.session, user_id=19994)
+        route = seed_route(4, class_name="плацкартный", best_price=2000)
+        route_ids = await subscribe_many(
+            self.session,
+            [
+                (
+                    19994,
+                    {**route, "from_date": datetime(2024, 6, 20) + timedelta(hours=i)},
+                )
+                for i in range(5)
+            ],
+        )
+        await add_ticket(self.session, route_id=route_ids[0], best_price=2500)
+
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+        try:
+            subscriptions = await get_user_subscrtions(self.session, 19994)
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+        self.assertEqual(len(statements), 1)
+
+        by_id = {sub["route_id"]: sub for sub in subscriptions}
+        self.assertEqual(set(route_ids), set(by_id) & set(route_ids))
+        self.assertEqual(by_id[route_ids[0]]["best_price"], 2500)
+        self.assertEqual(by_id[route_ids[1]]["best_price"], 2000)
+        self.assertEqual(by_id[route_ids[1]]["from_station_name"], "пупупу-4")
+        self.assertEqual(by_id[route_ids[1]]["class_name"], "плацкарт")
+        self.assertIsNotNone(by_id[route_ids[1]]["to_city_name"])
+
+        pages = []
+        after = 0
+        while after is not None:
+            page, after = await get_user_subscriptions_page(
+                self.session, 19994, after_route_id=after, limit=2
+            )
+            self.assertLessEqual(len(page), 2)
+            pages.extend(sub["route_id"] for sub in page)
+        self.assertEqual(pages, sorted(by_id))
+
+        for route_id in route_ids:
+            await delete_subscription(self.session, user_id=19994, route_id=route_id)
+
+    async def test_current_price(self):
+        await add_user(self.session, user_id=19993)
+        route_id = await subscribe_to_route(
+            self.session,
+            19993,
+            seed_route(5, class_name="св", best_price=100),
+        )
+        for price in [80, 80, 120]:
+            await add_ticket(self.session, route_id=route_id, best_price=price)
+
+        current = await get_current_price(self.session, route_id)
+        self.assertEqual(current.best_price, 120)
+        self.assertEqual(current.prev_price, 80)
+        self.assertEqual(current.min_price, 80)
+        self.assertEqual(current.max_price, 120)
+        self.assertEqual(
+            (await get_route_with_tickets_by_id(self.session, route_id))["best_price"],
+            120,
+        )
+
+        await delete_subscription(self.session, user_id=19993, route_id=route_id)
+
+    async def test_record_price_only_on_change(self):
+        await add_user(self.session, user_id=19992)
+        route_id = await subscribe_to_route(
+            self.session,
+            19992,
+            seed_route(6, best_price=700, free_seats=12),
+        )
+        await self.session.execute(delete(Ticket).filter_by(route_id=route_id))
+        await self.session.commit()
+
+        self.assertTrue(await record_price(self.session, route_id, 700, 12))
+        self.assertFalse(await record_price(self.session, route_id, 700, 12))
+        self.assertFalse(await record_price(self.session, route_id, 700, 12))
+        # места поменялись - новая строка, хоть цена и та же
+        self.assertTrue(await record_price(self.session, route_id, 700, 10))
+        self.assertTrue(await record_price(self.session, route_id, 650, 10))
+
+        tickets = list(
+            await self.session.scalars(
+                select(Ticket).filter_by(route_id=route_id).order_by(Ticket.update_time)
+            )
+        )
+        self.assertEqual(
+            [(t.best_price, t.free_seats) for t in tickets],
+            [(700, 12), (700, 10), (650, 10)],
+        )
+        self.assertGreater(tickets[0].last_seen, tickets[0].update_time)
+
+        # отрезок первого билета разворачивается в точки с шагом
+        await self.session.execute(
+            update(Ticket)
+            .filter_by(ticket_id=tickets[0].ticket_id)
+            .values(last_seen=tickets[0].update_time + timedelta(minutes=12))
+        )
+        await self.session.commit()
+        series = await get_price_series(self.session, route_id, timedelta(minutes=5))
+        first = [point["at"] for point in series if point["free_seats"] == 12]
+        self.assertEqual(
+            first, [tickets[0].update_time + timedelta(minutes=m) for m in (0, 5, 10)]
+        )
+        self.assertEqual(len(series), 5)
+
+        await delete_subscription(self.session, user_id=19992, route_id=route_id)
+
+    async def test_delete_unvalid_routes(self):
+        await add_user(self.session, user_id=19991)
+        route = seed_route(7, best_price=700)
+        departed = await subscribe_many(
+            self.session,
+            [
+                (19991, {**route, "from_date": datetime(2024, 6, 20, hour)})
+                for hour in range(5)
+            ],
+        )
+        upcoming = await subscribe_to_route(
+            self.session, 19991, {**route, "from_date": datetime(2099, 1, 1)}
+        )
+
+        stats = await delete_unvalid_routes(self.session, chunk_size=2)
+
+        self.assertGreaterEqual(sum(chunk["routes"] for chunk in stats), 5)
+        self.assertGreaterEqual(sum(chunk["subscriptions"] for chunk in stats), 5)
+        self.assertGreaterEqual(sum(chunk["tickets"] for chunk in stats), 5)
+        self.assertTrue(all(chunk["routes"] <= 2 for chunk in stats))
+        self.assertLess(stats[-1]["routes"], 2)
+        self.assertTrue(all(chunk["seconds"] >= 0 for chunk in stats))
+
+        for model in (Route, Subscription, Ticket, RouteCurrentPrice):
+            left = await self.session.scalars(
+                select(model.route_id).filter(model.route_id.in_(departed))
+            )
+            self.assertEqual(list(left), [])
+        self.assertIsNotNone(await self.session.get(Route, upcoming))
+        # история цен ушедших маршрутов осталась в почасовых агрегатах
+        hourly = await self.session.scalars(
+            select(TicketHourly).filter(TicketHourly.route_id.in_(departed))
+        )
+        hourly = list(hourly)
+        self.assertEqual({row.route_id for row in hourly}, set(departed))
+        self.assertTrue(all(row.max_price == 700 for row in hourly))
+        await self.session.execute(
+            delete(TicketHourly).filter(TicketHourly.route_id.in_(departed))
+        )
+
+        await delete_route(self.session, upcoming)
+        self.assertIsNone(await self.session.get(Route, upcoming))
@@ -0,0 +1,45 @@
+from src.core.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_hit_and_miss():
+    """Тест на попадание и промах"""
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("мск-спб") is None
+    cache.set("мск-спб", [1, 2, 3])
+    assert cache.get("мск-спб") == [1, 2, 3]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_ttl_expiration():
+    """Тест на протухание записи по ttl"""
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("мск-спб", "NO TICKETS")
+    clock.now = 59
+    assert cache.get("мск-спб") == "NO TICKETS"
+    clock.now = 60
+    assert cache.get("мск-спб") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_cache_lru_eviction():
+    """Тест на вытеснение самой давно использованной записи"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,88 @@
+import unittest
+
+from sqlalchemy import text
+
+from src.db.database import engine
+
+# данные для проверки планов, все в одной транзакции, которую потом откатываем
+SEED = [
+    """
+    INSERT INTO t_city (city_id, city_name)
+    SELECT 900000000 + i, 'тестоград-' || i FROM generate_series(1, 20000) i
+    """,
+    """
+    INSERT INTO t_station (station_id, city_id, station_name)
+    SELECT 900000000 + i, 900000000 + i, 'тестовая-' || i FROM generate_series(1, 2) i
+    """,
+    """
+    INSERT INTO t_route (route_id, from_station_id, from_date, to_station_id,
+                         to_date, train_no, class_name)
+    SELECT 900000000 + i, 900000001, TIMESTAMP '2030-01-01' + i * INTERVAL '1 hour',
+           900000002, TIMESTAMP '2030-01-02' + i * INTERVAL '1 hour', 'Т' || i, 'cupe'
+    FROM generate_series(1, 5000) i
+    """,
+    """
+    INSERT INTO t_user (user_id, status)
+    SELECT 900000000 + i, 'chill' FROM generate_series(1, 50) i
+    """,
+    """
+    INSERT INTO t_subscription (user_id, route_id)
+    SELECT 900000000 + u, 900000000 + r
+    FROM generate_series(1, 50) u, generate_series(1, 5000, 10) r
+    """,
+    """
+    INSERT INTO t_ticket (route_id, best_price, update_time)
+    SELECT 900000000 + r, 1000 + v, TIMESTAMP '2029-01-01' + v * INTERVAL '1 day'
+    FROM generate_series(1, 2000) r, generate_series(1, 20) v
+    """,
+    "ANALYZE t_city, t_station, t_route, t_user, t_subscription, t_ticket",
+]
+
+
+class TestIndexes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.connection = engine.connect()
+        cls.transaction = cls.connection.begin()
+        for statement in SEED:
+            cls.connection.execute(text(statement))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.transaction.rollback()
+        cls.connection.close()
+
+    def explain(self, query: str, **params) -> str:
+        rows = self.connection.execute(text(f"EXPLAIN {query}"), params)
+        return "\n".join(row[0] for row in rows)
+
+    def test_latest_ticket(self):
+        plan = self.explain(
+            "SELECT * FROM t_ticket WHERE route_id = :route_id "
+            "ORDER BY update_time DESC LIMIT 1",
+            route_id=900000100,
+        )
+        # t_ticket секционирована, индекс родителя у каждой секции свой
+        self.assertRegex(plan, r"Index Scan using \S*route_id_update_time")
+        self.assertNotRegex(plan, r"Sort\s+\(cost")
+
+    def test_subscribers_by_route(self):
+        plan = self.explain(
+            "SELECT user_id FROM t_subscription WHERE route_id = :route_id",
+            route_id=900000101,
+        )
+        self.assertIn("ix_subscription_route_id", plan)
+
+    def test_city_prefix(self):
+        plan = self.explain(
+            "SELECT * FROM t_city WHERE city_name LIKE :prefix",
+            prefix="тестоград-1234%",
+        )
+        self.assertIn("ix_city_city_name_pattern", plan)
+
+    def test_departed_routes(self):
+        plan = self.explain(
+            "SELECT route_id FROM t_route WHERE from_date < :now",
+            now="2030-01-02",
+        )
+        self.assertIn("ix_route_from_date", plan)
@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import delete
+
+from src.db import queries
+from src.db.async_queries import load_cities_from_json
+from src.db.database import async_engine, async_session
+from src.db.models import City, Meta
+
+CITIES = {"тестоград-загрузка": "990000001", "тестовка-загрузка": "990000002"}
+
+
+class TestLoadCities(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = async_session()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "test_city_codes.json")
+        self.write(CITIES)
+
+    async def asyncTearDown(self):
+        await self.session.execute(
+            delete(City).filter(City.city_id.in_([990000001, 990000002, 990000003]))
+        )
+        await self.session.execute(
+            delete(Meta).filter_by(key="test_city_codes.json_sha256")
+        )
+        await self.session.commit()
+        await self.session.close()
+        await async_engine.dispose()
+        self.dir.cleanup()
+
+    def write(self, codes: dict):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(codes, f, ensure_ascii=False)
+
+    async def test_load_is_idempotent(self):
+        self.assertEqual(await load_cities_from_json(self.session, self.path), 2)
+        city = await self.session.get(City, 990000001)
+        self.assertEqual(city.city_name, "тестоград-загрузка")
+
+        # файл тот же - загрузку пропускаем
+        self.assertIsNone(await load_cities_from_json(self.session, self.path))
+
+        # файл поменялся - добавляем только новое, старое не конфликтует
+        self.write({**CITIES, "новгород-загрузка": "990000003"})
+        self.assertEqual(await load_cities_from_json(self.session, self.path), 1)
+        self.assertIsNotNone(await self.session.get(City, 990000003))
+
+    async def test_sync_loader(self):
+        self.assertEqual(queries.load_cities_from_json(self.path), 2)
+        self.assertIsNone(queries.load_cities_from_json(self.path))
+        # асинхронный видит ту же контрольную сумму
+        self.assertIsNone(await load_cities_from_json(self.session, self.path))
@@ -0,0 +1,129 @@
+from datetime import datetime
+
+from src.core.rzd import (Offer, TrainRoute, get_parsed_data, parse_trains,
+                          select_class)
+
+RESPONSE = {
+    "result": "OK",
+    "tp": [
+        {
+            "from": "МОСКВА",
+            "fromCode": 2000000,
+            "where": "САНКТ-ПЕТЕРБУРГ",
+            "whereCode": 2004000,
+            "list": [
+                {
+                    "number": "020У",
+                    "station0": "МОСКВА ОКТЯБРЬСКАЯ",
+                    "station1": "САНКТ-ПЕТЕРБУРГ-ГЛАВН.",
+                    "code0": 2006004,
+                    "code1": 2004001,
+                    "route0": "МОСКВА",
+                    "route1": "С-ПЕТЕР-ГЛ",
+                    "date0": "28.10.2026",
+                    "time0": "23:55",
+                    "date1": "29.10.2026",
+                    "time1": "08:05",
+                    "cars": [
+                        {"typeLoc": "Плацкартный", "tariff": 3100, "freeSeats": 12},
+                        {"typeLoc": "Плацкартный", "tariff": 2900, "freeSeats": 4},
+                        {"typeLoc": "Купе", "tariff": 5200, "freeSeats": 7},
+                        {
+                            "typeLoc": "Купе",
+                            "tariff": 1000,
+                            "freeSeats": 1,
+                            "disabledPerson": True,
+                        },
+                    ],
+                },
+                {
+                    "number": "752А",
+                    "station0": "МОСКВА ОКТЯБРЬСКАЯ",
+                    "station1": "САНКТ-ПЕТЕРБУРГ-ГЛАВН.",
+                    "code0": 2006004,
+                    "code1": 2004001,
+                    "route0": "МОСКВА",
+                    "route1": "С-ПЕТЕР-ГЛ",
+                    "date0": "28.10.2026",
+                    "time0": "05:40",
+                    "date1": "28.10.2026",
+                    "time1": "09:42",
+                    "cars": [{"typeLoc": "Сидячий", "tariff": 4500, "freeSeats": 90}],
+                },
+            ],
+        }
+    ],
+}
+
+
+def test_parse_trains_collects_every_class():
+    """Тест на то, что за один разбор получаем лучший тариф по каждому классу"""
+    trains = parse_trains(RESPONSE)
+    assert len(trains) == 2
+    assert trains[0].classes == {
+        "Плацкартный": Offer(2900, 4),
+        "Купе": Offer(5200, 7),
+    }
+    assert trains[0].datetime0 == datetime(2026, 10, 28, 23, 55)
+    assert trains[0].datetime1 == datetime(2026, 10, 29, 8, 5)
+    assert trains[0].route_global == "МОСКВА-С-ПЕТЕР-ГЛ"
+
+
+def test_select_class_without_new_request():
+    """Тест на выбор класса из уже разобранного ответа"""
+    trains = parse_trains(RESPONSE)
+
+    routes = select_class(trains, "Купе")
+    assert [r.route_id for r in routes] == ["020У"]
+    assert routes[0].best_price == 5200
+    assert routes[0].class_name == "Купе"
+
+    # в базе класс хранится как "плацкарт"
+    routes = select_class(trains, "плацкарт")
+    assert routes[0].best_price == 2900
+    assert routes[0].frseats == 4
+
+    cheapest = select_class(trains, None)
+    assert [r.class_name for r in cheapest] == ["Плацкартный", "Сидячий"]
+
+
+def test_select_class_exact_match():
+    """Тест: класс с похожим началом названия не выдается за запрошенный"""
+    train = parse_trains(RESPONSE)[0]
+    train = train._replace(
+        classes={
+            "Купе-Сьют": Offer(20000, 2),
+            "Купе": Offer(5200, 7),
+            "СВ": Offer(9000, 3),
+        }
+    )
+    for place_type in ("купе", "Купе"):
+        routes = select_class([train], place_type)
+        assert routes[0].best_price == 5200
+        assert routes[0].frseats == 7
+    assert select_class([train], "св")[0].best_price == 9000
+    assert select_class([train], "сидячий") == []
+
+
+def test_get_parsed_data_returns_route_records():
+    """Тест на то, что get_parsed_data отдает компактные записи маршрутов"""
+    routes = get_parsed_data(RESPONSE, "Сидячий")
+    assert routes == [
+        TrainRoute(
+            route_id="752А",
+            station_from="МОСКВА ОКТЯБРЬСКАЯ",
+            station_to="САНКТ-ПЕТЕРБУРГ-ГЛАВН.",
+            station_code_from=2006004,
+            station_code_to=2004001,
+            route_global="МОСКВА-С-ПЕТЕР-ГЛ",
+            datetime0=datetime(2026, 10, 28, 5, 40),
+            datetime1=datetime(2026, 10, 28, 9, 42),
+            city_from="МОСКВА",
+            city_from_code=2000000,
+            city_where="САНКТ-ПЕТЕРБУРГ",
+            city_where_code=2004000,
+            best_price=4500,
+            class_name="Сидячий",
+            frseats=90,
+        )
+    ]
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from src.core.ratelimit import Priority, RateLimiter
+
+
+def test_interactive_goes_before_background():
+    """Тест на то, что пользовательские поиски обгоняют фоновые в очереди"""
+    order = []
+
+    async def request(limiter, name, priority):
+        async with limiter.limit(priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        limiter = RateLimiter(rate=1000, burst=1000, max_in_flight=1)
+        busy = asyncio.ensure_future(request(limiter, "first", Priority.background))
+        await asyncio.sleep(0)
+        await asyncio.gather(
+            busy,
+            request(limiter, "refresh", Priority.background),
+            request(limiter, "user", Priority.interactive),
+        )
+        return limiter
+
+    limiter = asyncio.run(run())
+    assert order == ["first", "user", "refresh"]
+    assert limiter.in_flight == 0
+    assert limiter.stats()["wait"]["background"]["count"] == 2
+
+
+def test_token_bucket_limits_rate():
+    """Тест на то, что сверх burst запросы идут со скоростью rate"""
+
+    async def run():
+        limiter = RateLimiter(rate=50, burst=2, max_in_flight=10)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(5):
+            async with limiter.limit(Priority.interactive):
+                pass
+        return loop.time() - started
+
+    # 2 запроса сразу, еще 3 - по одному раз в 20 мс
+    assert asyncio.run(run()) >= 0.05
+
+
+def test_zero_rate_rejected():
+    """Тест: нулевая скорость - ошибка сразу, а не деление на ноль при ожидании"""
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0, burst=1, max_in_flight=1)
+
+
+def test_limiter_survives_new_event_loop():
+    """Тест: лимитер работает в следующем asyncio.run после брошенного ожидания"""
+    limiter = RateLimiter(rate=50, burst=1, max_in_flight=10)
+
+    async def first_run():
+        async with limiter.limit():
+            pass
+        # токенов нет, ждущего бросаем - таймер остается в старом loop
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire(), 0.001)
+
+    async def second_run():
+        await asyncio.wait_for(limiter.acquire(), 1)
+        limiter.release()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+    assert limiter.in_flight == 0
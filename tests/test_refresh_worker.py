@@ -0,0 +1,168 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import delete, select, update
+
+from src.core import refresh_worker
+from src.db.async_queries import (add_user, claim_refresh_jobs,
+                                  delete_subscription, finish_refresh_job,
+                                  get_current_price, subscribe_many,
+                                  sync_refresh_jobs)
+from src.db.database import async_engine, async_session
+from src.db.models import RefreshJob
+from tests.test_update_db import TRAINS, FakeBot, subscription
+
+
+class TestRefreshJobs(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = async_session()
+        await self.session.execute(delete(RefreshJob))
+        await self.session.commit()
+        await add_user(self.session, user_id=19970)
+        # два маршрута одного поиска и один на другой день - две задачи
+        later = TRAINS[0]._replace(
+            datetime0=TRAINS[0].datetime0 + timedelta(days=1),
+            datetime1=TRAINS[0].datetime1 + timedelta(days=1),
+        )
+        self.route_ids = await subscribe_many(
+            self.session,
+            [
+                (19970, subscription(TRAINS[0], "купе", 5000)),
+                (19970, subscription(TRAINS[2], "купе", 7000)),
+                (19970, subscription(later, "купе", 5000)),
+            ],
+        )
+        self.stats = await sync_refresh_jobs(self.session)
+        # задачи чужих подписок из других тестов не должны попадать в выборку
+        await self.session.execute(
+            update(RefreshJob)
+            .filter(RefreshJob.travel_date < TRAINS[0].datetime0.date())
+            .values(due_at=datetime(2100, 1, 1))
+        )
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        for route_id in self.route_ids:
+            await delete_subscription(self.session, user_id=19970, route_id=route_id)
+        await self.session.execute(delete(RefreshJob))
+        await self.session.commit()
+        await self.session.close()
+        await async_engine.dispose()
+
+    async def get_trains(self, code_from, code_to, date, **kwargs):
+        shift = date.date() - TRAINS[0].datetime0.date()
+        return [
+            train._replace(
+                datetime0=train.datetime0 + shift, datetime1=train.datetime1 + shift
+            )
+            for train in TRAINS
+        ]
+
+    async def test_sync_one_job_per_search(self):
+        self.assertGreaterEqual(self.stats["added"], 2)
+        self.assertEqual((await sync_refresh_jobs(self.session))["added"], 0)
+
+        await delete_subscription(
+            self.session, user_id=19970, route_id=self.route_ids[2]
+        )
+        self.assertEqual((await sync_refresh_jobs(self.session))["removed"], 1)
+
+    async def test_concurrent_claims_do_not_overlap(self):
+        other = async_session()
+        try:
+            first, second = await asyncio.gather(
+                claim_refresh_jobs(self.session, "w1", limit=1, lease=60),
+                claim_refresh_jobs(other, "w2", limit=1, lease=60),
+            )
+            self.assertEqual(len(first) + len(second), 2)
+            claimed = {job["job_id"] for job in first + second}
+            self.assertEqual(len(claimed), 2)
+            # все задачи в аренде
+            self.assertEqual(await claim_refresh_jobs(other, "w3", 10, 60), [])
+        finally:
+            await other.close()
+
+    async def test_expired_lease_is_reclaimed(self):
+        jobs = await claim_refresh_jobs(self.session, "w1", limit=10, lease=60)
+        job_id = jobs[0]["job_id"]
+        # воркер w1 упал, аренда истекла
+        await self.session.execute(
+            update(RefreshJob)
+            .filter_by(job_id=job_id)
+            .values(locked_until=datetime(2000, 1, 1))
+        )
+        await self.session.commit()
+
+        reclaimed = await claim_refresh_jobs(self.session, "w2", limit=10, lease=60)
+        self.assertEqual([job["job_id"] for job in reclaimed], [job_id])
+        self.assertEqual(reclaimed[0]["attempts"], 2)
+        # w1 уже не может отпустить чужую задачу
+        self.assertFalse(await finish_refresh_job(self.session, job_id, "w1", 60))
+        self.assertTrue(await finish_refresh_job(self.session, job_id, "w2", 60))
+
+    async def test_work_once(self):
+        bot = FakeBot()
+        with patch.object(refresh_worker, "get_trains", self.get_trains):
+            done = await refresh_worker.work_once(self.session, bot, "w1")
+        self.assertEqual(done, 2)
+
+        self.assertEqual(
+            (await get_current_price(self.session, self.route_ids[0])).best_price, 5210
+        )
+        self.assertEqual(
+            (await get_current_price(self.session, self.route_ids[2])).best_price, 5210
+        )
+        jobs = (await self.session.scalars(select(RefreshJob))).all()
+        for job in jobs:
+            self.assertIsNone(job.locked_by)
+            self.assertEqual(job.attempts, 0)
+            self.assertGreater(job.due_at, datetime.utcnow())
+        self.assertEqual(
+            await refresh_worker.work_once(self.session, FakeBot(), "w1"), 0
+        )
+
+    async def test_failed_search_backs_off(self):
+        async def no_answer(*args, **kwargs):
+            return None
+
+        with patch.object(refresh_worker, "get_trains", no_answer):
+            await refresh_worker.work_once(self.session, FakeBot(), "w1")
+        jobs = (
+            await self.session.scalars(
+                select(RefreshJob).filter(
+                    RefreshJob.travel_date >= TRAINS[0].datetime0.date()
+                )
+            )
+        ).all()
+        self.assertEqual(len(jobs), 2)
+        for job in jobs:
+            self.assertIsNone(job.locked_by)
+            # попытка не засчитана как успешная
+            self.assertEqual(job.attempts, 1)
+
+
+def test_retry_delay_doubles():
+    """Тест: отсрочка после неудач растет вдвое и упирается в потолок"""
+    assert refresh_worker.retry_delay(1) == 300
+    assert refresh_worker.retry_delay(3) == 1200
+    assert refresh_worker.retry_delay(20) == 86400
+
+
+def test_worker_limits_split():
+    """Тест: воркеры одного запуска делят лимиты ржд поровну"""
+    with patch.multiple(
+        refresh_worker.rzd_settings,
+        RATE_LIMIT=5,
+        RATE_BURST=10,
+        MAX_IN_FLIGHT=0,
+        POOL_SIZE=10,
+    ):
+        assert refresh_worker.worker_limits(4) == {
+            "RZD_RATE_LIMIT": "1.25",
+            "RZD_RATE_BURST": "2",
+            "RZD_MAX_IN_FLIGHT": "2",
+        }
+        # больше воркеров, чем запросов в полете: каждому хотя бы один
+        assert refresh_worker.worker_limits(20)["RZD_MAX_IN_FLIGHT"] == "1"
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from src.core import rzd
+from src.core.config import rzd_settings
+from src.core.rzd import RzdClient
+from tests.fake_rzd import FakeRzd
+
+DATE = datetime.now() + timedelta(days=10)
+CLASSES = ["Плацкартный", "Купе", "СВ", "Сидячий"]
+
+
+def run_with_fake(scenario, **fake_options):
+    """поднимает фейковый ржд и гоняет сценарий с клиентом, направленным на него"""
+
+    async def run():
+        async with FakeRzd(**fake_options) as fake:
+            async with RzdClient(base_url=fake.url, rid_first_delay=0.01) as client:
+                return fake, client, await scenario(client)
+
+    return asyncio.run(run())
+
+
+def test_search_goes_through_rid_polling():
+    """Тест на поиск с ожиданием RID"""
+
+    async def scenario(client):
+        return await client.get_train_routes(2000000, 2004000, DATE, "Купе")
+
+    fake, client, routes = run_with_fake(scenario, rid_delay=0.05)
+    assert [r.route_id for r in routes] == ["020У", "054Ч", "016А"]
+    assert routes[0].best_price == 5210
+    assert fake.stats()["searches"] == 1
+    assert fake.stats()["rid_polls"] >= 2
+    assert client.rid_stats()["count"] == 1
+
+
+def test_repeated_and_concurrent_searches_hit_rzd_once():
+    """Тест на кэш и склейку одинаковых поисков"""
+
+    async def scenario(client):
+        await asyncio.gather(
+            *[client.get_train_routes(2000000, 2004000, DATE, c) for c in CLASSES]
+        )
+        return await client.get_train_routes(2000000, 2004000, DATE, "СВ")
+
+    fake, client, routes = run_with_fake(scenario, rid_delay=0.02)
+    assert [r.best_price for r in routes] == [11340, 14260]
+    assert fake.stats()["searches"] == 1
+    assert client.cache.stats()["hits"] == 1
+    assert client.inflight.stats()["shared"] == len(CLASSES) - 1
+
+
+def test_upstream_errors_and_no_tickets():
+    """Тест на ошибки ржд и ответ без билетов"""
+
+    async def scenario(client):
+        return await client.get_train_routes(2000000, 2004000, DATE)
+
+    _, _, result = run_with_fake(scenario, error_rate=1.0)
+    assert result is None
+
+    _, _, result = run_with_fake(scenario, no_tickets_rate=1.0)
+    assert result == "NO TICKETS"
+
+
+def test_sync_wrapper_uses_configured_url(monkeypatch):
+    """Тест на то, что синхронную обертку можно направить на фейк через настройки"""
+    # обертка запускает свой event loop, поэтому фейк крутится в отдельном потоке
+    loop = asyncio.new_event_loop()
+    fake = loop.run_until_complete(FakeRzd(rid_delay=0).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        monkeypatch.setattr(rzd_settings, "BASE_URL", fake.url)
+        monkeypatch.setattr(rzd_settings, "RID_FIRST_DELAY", 0.01)
+        monkeypatch.setattr(rzd, "_cache", None)
+        monkeypatch.setattr(rzd, "_limiter", None)
+        result = rzd.get_train_routes_with_session(2000000, 2004000, DATE, "Сидячий")
+        # второй вызов - свой asyncio.run, но кэш и лимит те же
+        again = rzd.get_train_routes_with_session(2000000, 2004000, DATE, "Купе")
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(fake.stop())
+        loop.close()
+
+    assert [r.route_id for r in result] == ["752А"]
+    assert [r.route_id for r in again] == ["020У", "054Ч", "016А"]
+    assert fake.stats()["searches"] == 1
+    assert rzd._cache.stats()["hits"] == 1
+    # через общий лимит прошли все запросы первого вызова: поиск и опросы RID
+    requests = fake.stats()["searches"] + fake.stats()["rid_polls"]
+    assert rzd._limiter.stats()["wait"]["interactive"]["count"] == requests
+
+
+def test_explicit_zero_is_not_replaced_by_default():
+    """Тест: явно переданный 0 не подменяется значением из настроек"""
+    client = RzdClient(rid_first_delay=0, rid_max_delay=0, keepalive_timeout=0)
+    assert client.rid_first_delay == 0
+    assert client.rid_max_delay == 0
+    assert client.keepalive_timeout == 0
+    assert client.rid_timeout == rzd_settings.RID_TIMEOUT
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+from src.core.scheduler import RefreshScheduler, refresh_interval
+
+NOW = datetime(2099, 1, 1, 12, 0)
+
+
+def route(route_id: int, days: float, city_to: int = 2004000, **kwargs) -> dict:
+    return {
+        "route_id": route_id,
+        "from_station_city": 2000000,
+        "to_station_city": city_to,
+        "from_date": NOW + timedelta(days=days),
+        "subscribers": 1,
+        "changes": 0,
+        **kwargs,
+    }
+
+
+def test_interval_shrinks_near_departure():
+    """Тест: чем ближе отправление, тем чаще проверяем"""
+    assert refresh_interval(1, 1, 0) < refresh_interval(10, 1, 0)
+    assert refresh_interval(0, 1, 0) == 300
+    assert refresh_interval(365, 1, 0) == 86400
+
+
+def test_interval_shrinks_with_changes_and_subscribers():
+    """Тест: частые изменения цены и много подписчиков ускоряют проверку"""
+    assert refresh_interval(10, 1, 3) < refresh_interval(10, 1, 0)
+    assert refresh_interval(10, 8, 0) < refresh_interval(10, 1, 0)
+    assert refresh_interval(10, 0, 0) == refresh_interval(10, 1, 0)
+
+
+def test_new_routes_due_immediately():
+    """Тест: новые маршруты обновляем в первый же заход"""
+    scheduler = RefreshScheduler()
+    scheduler.sync([route(1, 5), route(2, 1, city_to=2010000)], NOW)
+    due = scheduler.pop_due(NOW, max_fetches=10)
+    assert sorted(r["route_id"] for r in due) == [1, 2]
+    assert scheduler.pop_due(NOW, max_fetches=10) == []
+
+
+def test_reschedule_orders_by_due_time():
+    """Тест: после обновления ближний рейс снова подходит раньше дальнего"""
+    scheduler = RefreshScheduler()
+    near, far = route(1, 1), route(2, 20, city_to=2010000)
+    scheduler.sync([near, far], NOW)
+    for r in scheduler.pop_due(NOW, max_fetches=10):
+        scheduler.reschedule(r, NOW)
+
+    later = NOW + timedelta(seconds=refresh_interval(1, 1, 0))
+    assert scheduler.next_due() == later
+    assert [r["route_id"] for r in scheduler.pop_due(later, max_fetches=10)] == [1]
+
+
+def test_budget_counts_fetches_and_takes_group_mates():
+    """Тест: лимит считается в поисках, маршруты того же поиска идут вместе"""
+    scheduler = RefreshScheduler()
+    routes = [route(1, 1), route(2, 1), route(3, 1, city_to=2010000)]
+    scheduler.sync(routes, NOW)
+    due = scheduler.pop_due(NOW, max_fetches=1)
+    assert [r["route_id"] for r in due] == [1, 2]
+    assert [r["route_id"] for r in scheduler.pop_due(NOW, max_fetches=1)] == [3]
+
+
+def test_sync_drops_unsubscribed_routes():
+    """Тест: маршруты без подписок пропадают из очереди"""
+    scheduler = RefreshScheduler()
+    scheduler.sync([route(1, 1), route(2, 1, city_to=2010000)], NOW)
+    scheduler.sync([route(2, 1, city_to=2010000)], NOW)
+    assert len(scheduler) == 1
+    assert [r["route_id"] for r in scheduler.pop_due(NOW, max_fetches=10)] == [2]
+
+
+def test_failed_tick_routes_come_back():
+    """Тест: маршруты упавшего захода снова в очереди после sync"""
+    scheduler = RefreshScheduler()
+    scheduler.sync([route(1, 1)], NOW)
+    assert len(scheduler.pop_due(NOW, max_fetches=10)) == 1
+    scheduler.sync([route(1, 1)], NOW)
+    assert [r["route_id"] for r in scheduler.pop_due(NOW, max_fetches=10)] == [1]
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from src.core.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_fetch():
+    """Тест на то, что одинаковые одновременные запросы выполняются один раз"""
+    calls = []
+
+    async def fetch(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return [key]
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(
+            *[flight.do("мск-спб", fetch, "мск-спб") for _ in range(5)],
+            flight.do("мск-казань", fetch, "мск-казань"),
+        )
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert sorted(calls) == ["мск-казань", "мск-спб"]
+    assert results[:5] == [["мск-спб"]] * 5
+    assert flight.stats() == {"inflight": 0, "executed": 2, "shared": 4}
+
+
+def test_failure_is_shared():
+    """Тест на то, что ошибка общего запроса достается всем ждущим"""
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("ржд лежит")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(
+            *[flight.do("мск-спб", fetch) for _ in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert results[0] is results[1] is results[2]
+
+
+def test_cancelled_waiter_does_not_cancel_fetch():
+    """Тест на то, что отмена одного ждущего не отменяет запрос для остальных"""
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do("k", fetch))
+        second = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "ok"
@@ -0,0 +1,40 @@
+from src.core.stations import StationIndex, get_station_index
+
+CODES = {
+    "краснодар": "2064001",
+    "красноярск": "2038001",
+    "краснодар-1": "2064788",
+    "москва": "2000000",
+    "санкт-петербург": "2004000",
+}
+
+
+def test_exact_lookup_ignores_case():
+    """Тест на точный поиск без учета регистра"""
+    index = StationIndex(CODES)
+    assert index.get("Москва") == "2000000"
+    assert index.get("моск") is None
+
+
+def test_prefix_lookup_is_alphabetical():
+    """Тест на поиск по началу названия, как get_city_code в базе"""
+    index = StationIndex(CODES)
+    assert index.prefix("красно") == ["краснодар", "краснодар-1", "красноярск"]
+    assert index.lookup("красно") == "2064001"
+    assert index.lookup("краснодар") == "2064001"
+    assert index.lookup("тверь") is None
+
+
+def test_suggestions_for_typos():
+    """Тест на подсказки при опечатке"""
+    index = StationIndex(CODES)
+    assert index.suggest("масква")[0] == "москва"
+    assert index.suggest("санкт-питербург")[0] == "санкт-петербург"
+    assert index.suggest("zzz") == []
+
+
+def test_index_is_built_once():
+    """Тест на то, что city_codes.json читается один раз на процесс"""
+    index = get_station_index()
+    assert index is get_station_index()
+    assert index.get("яя") == "2028022"
@@ -0,0 +1,195 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text, update
+
+from src.core.config import ticket_history_settings
+from src.core.ticket_retention import _add_months, run_retention
+from src.db.async_queries import (add_user, delete_subscription,
+                                  get_current_price, get_price_history,
+                                  get_price_series, record_price,
+                                  subscribe_to_route)
+from src.db.database import async_engine, async_session
+from src.db.models import RouteCurrentPrice, Ticket, TicketDaily, TicketHourly
+
+ROUTE = {
+    "from_city_id": 2010359,
+    "from_station_id": 58870,
+    "from_station_name": "пупупу-история",
+    "to_city_id": 2060533,
+    "to_station_id": 3940,
+    "to_station_name": "у черта на куличиках-история",
+    "from_date": datetime(2024, 6, 20, 9, 14, 10),
+    "to_date": datetime(2024, 6, 21, 7, 34, 11),
+    "train_no": "ЪЫЪ",
+    "class_name": "купе",
+    "best_price": 5000,
+}
+
+
+class TestTicketRetention(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = async_session()
+        await add_user(self.session, user_id=19990)
+        self.route_id = await subscribe_to_route(self.session, 19990, ROUTE)
+
+    async def asyncTearDown(self):
+        await delete_subscription(self.session, user_id=19990, route_id=self.route_id)
+        # маршрут переживает подписку, его цены и агрегаты чистим руками
+        for table in (Ticket, TicketHourly, TicketDaily, RouteCurrentPrice):
+            await self.session.execute(
+                table.__table__.delete().where(table.route_id == self.route_id)
+            )
+        await self.session.commit()
+        await self.session.close()
+        await async_engine.dispose()
+
+    async def add_tickets(self, points: list):
+        """points - (начало, цена) или (начало, конец, цена) отрезка цены"""
+        rows = []
+        for point in points:
+            at, *seen, price = point
+            rows.append(
+                {
+                    "route_id": self.route_id,
+                    "best_price": price,
+                    "update_time": at,
+                    "last_seen": seen[0] if seen else at,
+                }
+            )
+        await self.session.execute(Ticket.__table__.insert(), rows)
+        await self.session.commit()
+
+    async def test_rollup_and_drop(self):
+        # январская секция, которую должна снести чистка
+        await self.session.execute(
+            text("SELECT t_ticket_ensure_partitions('2020-01-01', '2020-01-01')")
+        )
+        await self.add_tickets(
+            [
+                (datetime(2020, 1, 10, 12, 5), 100),
+                (datetime(2020, 1, 10, 12, 35), 300),
+                (datetime(2020, 1, 10, 13, 5), 200),
+                (datetime(2020, 1, 11, 8, 0), 400),
+                # цена держалась через полночь: 22 и 23 часа 12-го, 0 и 1 час 13-го
+                (datetime(2020, 1, 12, 22, 10), datetime(2020, 1, 13, 1, 30), 500),
+            ]
+        )
+
+        stats = await run_retention(self.session)
+
+        self.assertIn("t_ticket_p202001", stats["dropped_partitions"])
+        # три часа 10 и 11 января и четыре часа отрезка через полночь, затем четыре дня
+        self.assertEqual(stats["hourly_rows"], 7)
+        self.assertEqual(stats["daily_rows"], 4)
+        raw = await self.session.scalars(
+            select(Ticket.best_price).filter(
+                Ticket.route_id == self.route_id,
+                Ticket.update_time < datetime(2021, 1, 1),
+            )
+        )
+        self.assertEqual(list(raw), [])
+        # январь давно старше почасового срока, так что лежит уже по дням
+        hourly = await self.session.scalars(
+            select(TicketHourly).filter_by(route_id=self.route_id)
+        )
+        self.assertEqual(list(hourly), [])
+        daily = await self.session.scalars(
+            select(TicketDaily)
+            .filter_by(route_id=self.route_id)
+            .order_by(TicketDaily.bucket)
+        )
+        daily = list(daily)
+        self.assertEqual(
+            [day.bucket for day in daily],
+            [
+                datetime(2020, 1, 10),
+                datetime(2020, 1, 11),
+                datetime(2020, 1, 12),
+                datetime(2020, 1, 13),
+            ],
+        )
+        self.assertEqual([day.samples for day in daily[2:]], [2, 2])
+        self.assertEqual(daily[0].min_price, 100)
+        self.assertEqual(daily[0].max_price, 300)
+        self.assertEqual(daily[0].samples, 3)
+        self.assertAlmostEqual(daily[0].avg_price, 200)
+
+        history = await get_price_history(self.session, self.route_id, bucket="day")
+        self.assertEqual(history[0]["bucket"], datetime(2020, 1, 10))
+        self.assertEqual(history[0]["samples"], 3)
+        self.assertAlmostEqual(history[0]["avg_price"], 200)
+        # свежий билет с подписки остается сырым и тоже попадает в историю
+        self.assertEqual(history[-1]["max_price"], 5000)
+
+        # текущая цена не зависит от удаления истории
+        current = await get_current_price(self.session, self.route_id)
+        self.assertEqual(current.best_price, 5000)
+
+    async def test_current_run_kept(self):
+        # цена не менялась 150 дней: билет с подписки тянется до сих пор
+        now = datetime.utcnow()
+        start = (now - timedelta(days=150)).replace(day=1).date()
+        await self.session.execute(
+            text("SELECT t_ticket_ensure_partitions(:start, :start)"),
+            {"start": start},
+        )
+        await self.session.execute(
+            update(Ticket)
+            .filter_by(route_id=self.route_id)
+            .values(update_time=now - timedelta(days=150), last_seen=now)
+        )
+        await self.session.commit()
+
+        stats = await run_retention(self.session, now)
+
+        # секция старше границы, но в ней еще текущий отрезок цены
+        self.assertNotIn(f"t_ticket_p{start:%Y%m}", stats["dropped_partitions"])
+        tickets = await self.session.scalars(
+            select(Ticket.ticket_id).filter_by(route_id=self.route_id)
+        )
+        self.assertEqual(len(tickets.all()), 1)
+        hourly = await self.session.scalars(
+            select(TicketHourly).filter_by(route_id=self.route_id)
+        )
+        self.assertEqual(list(hourly), [])
+        series = await get_price_series(self.session, self.route_id, timedelta(days=1))
+        self.assertEqual(len(series), 151)
+        # отрезок не потерян, так что та же цена новую строку не пишет
+        self.assertFalse(await record_price(self.session, self.route_id, 5000))
+
+    async def test_rows_in_default_partition(self):
+        # месяц сразу за окном секций: билет попадает в t_ticket_default
+        now = datetime.utcnow()
+        month = datetime(now.year, now.month, 1)
+        ahead = _add_months(month, ticket_history_settings.PARTITIONS_AHEAD + 1)
+        partition = f"t_ticket_p{ahead:%Y%m}"
+        self.addAsyncCleanup(self.drop_if_empty, partition)
+        exists = await self.session.scalar(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": partition}
+        )
+        if exists:
+            self.skipTest(f"секция {partition} уже есть")
+        await self.add_tickets([(ahead + timedelta(days=3), 4000)])
+
+        # следующая чистка доходит до этого месяца и не падает на строках в default
+        await run_retention(self.session, _add_months(month, 1))
+
+        tables = await self.session.scalars(
+            text(
+                "SELECT tableoid::regclass::text FROM t_ticket "
+                "WHERE route_id = :route_id AND update_time >= :ahead"
+            ),
+            {"route_id": self.route_id, "ahead": ahead},
+        )
+        self.assertEqual(list(tables), [partition])
+
+    async def drop_if_empty(self, partition: str):
+        async with async_session() as session:
+            empty = await session.scalar(
+                text(f'SELECT NOT EXISTS (SELECT FROM "{partition}")')
+            )
+            if empty:
+                await session.execute(text(f'DROP TABLE "{partition}"'))
+                await session.commit()
+        await async_engine.dispose()
@@ -0,0 +1,201 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from src.core import update_db
+from src.core.rzd import parse_trains
+from src.core.scheduler import RefreshScheduler
+from src.db.async_queries import (add_user, delete_subscription,
+                                  get_current_price, get_routes_for_refresh,
+                                  subscribe_many)
+from src.db.database import async_engine, async_session
+from tests.fake_rzd import load_fixture
+
+# поезда из фикстуры, но в далеком будущем, чтобы чистка ушедших их не трогала
+TRAINS = [
+    train._replace(
+        datetime0=train.datetime0.replace(year=2099),
+        datetime1=train.datetime1.replace(year=2099),
+    )
+    for train in parse_trains(load_fixture("rzd_timetable.json"))
+]
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text):
+        self.messages.append((chat_id, text))
+
+
+def subscription(train, class_name: str, best_price: int) -> dict:
+    return {
+        "from_city_id": train.city_from_code,
+        "from_station_id": train.station_code_from,
+        "from_station_name": train.station_from,
+        "to_city_id": train.city_where_code,
+        "to_station_id": train.station_code_to,
+        "to_station_name": train.station_to,
+        "from_date": train.datetime0,
+        "to_date": train.datetime1,
+        "train_no": train.route_id,
+        "class_name": class_name,
+        "best_price": best_price,
+    }
+
+
+class TestRefresh(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = async_session()
+        await add_user(self.session, user_id=19980)
+        # 020У купе и плацкарт, 054Ч купе - все на одну пару городов и дату
+        self.route_ids = await subscribe_many(
+            self.session,
+            [
+                (19980, subscription(TRAINS[0], "купе", 5000)),
+                (19980, subscription(TRAINS[0], "плацкартный", 2950)),
+                (19980, subscription(TRAINS[2], "купе", 7000)),
+            ],
+        )
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def asyncTearDown(self):
+        for route_id in self.route_ids:
+            await delete_subscription(self.session, user_id=19980, route_id=route_id)
+        await self.session.close()
+        await async_engine.dispose()
+
+    async def get_trains(self, code_from, code_to, date, **kwargs):
+        self.calls.append((code_from, code_to, date.date()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            self.in_flight -= 1
+        # поезда из фикстуры, перенесенные на запрошенную дату
+        shift = date.date() - TRAINS[0].datetime0.date()
+        return [
+            train._replace(
+                datetime0=train.datetime0 + shift, datetime1=train.datetime1 + shift
+            )
+            for train in TRAINS
+        ]
+
+    async def test_one_fetch_per_group(self):
+        bot = FakeBot()
+        with patch.object(update_db, "get_trains", self.get_trains):
+            stats = await update_db.refresh_routes(self.session, bot)
+
+        # три маршрута - один поиск
+        ours = [call for call in self.calls if call[2] == TRAINS[0].datetime0.date()]
+        self.assertEqual(len(ours), 1)
+        self.assertGreaterEqual(stats["routes"], 3)
+        self.assertEqual(stats["fetches"], len(self.calls))
+        self.assertAlmostEqual(stats["compression"], stats["routes"] / stats["fetches"])
+
+        # цена поменялась у двух купе, плацкарт прежний
+        self.assertEqual(
+            (await get_current_price(self.session, self.route_ids[0])).best_price, 5210
+        )
+        self.assertEqual(
+            (await get_current_price(self.session, self.route_ids[2])).best_price, 7340
+        )
+        self.assertEqual(
+            (await get_current_price(self.session, self.route_ids[1])).best_price, 2950
+        )
+        self.assertEqual(len([m for m in bot.messages if m[0] == 19980]), 2)
+
+    async def test_concurrent_fetches(self):
+        # еще четыре даты - четыре группы
+        extra = [
+            train._replace(
+                datetime0=train.datetime0 + timedelta(days=day),
+                datetime1=train.datetime1 + timedelta(days=day),
+            )
+            for day in range(1, 5)
+            for train in TRAINS[:1]
+        ]
+        self.route_ids += await subscribe_many(
+            self.session,
+            [(19980, subscription(train, "купе", 5210)) for train in extra],
+        )
+
+        with patch.object(update_db, "get_trains", self.get_trains):
+            stats = await update_db.refresh_routes(
+                self.session, FakeBot(), concurrency=3
+            )
+
+        self.assertEqual(self.max_in_flight, 3)
+        self.assertEqual(stats["concurrency"], 3)
+        self.assertGreaterEqual(stats["fetches"], 5)
+        self.assertEqual(stats["stages"]["fetch"]["count"], stats["fetches"])
+        for stage in ["purge", "load", "fetch", "match", "write"]:
+            self.assertIn(stage, stats["stages"])
+        self.assertLess(stats["stages"]["fetch"]["max"], stats["cycle_seconds"])
+
+    async def test_scheduler_tick(self):
+        routes = {
+            route["route_id"]: route
+            for route in await get_routes_for_refresh(self.session)
+        }
+        self.assertEqual(routes[self.route_ids[0]]["subscribers"], 1)
+        # маршрут остается с прошлых запусков, так что записей цены не меньше одной
+        self.assertGreaterEqual(routes[self.route_ids[0]]["changes"], 1)
+
+        scheduler = RefreshScheduler()
+        with patch.object(update_db, "get_trains", self.get_trains):
+            stats = await update_db.update_due(FakeBot(), scheduler)
+            # сразу после обновления ни у кого срок еще не подошел
+            self.assertIsNone(await update_db.update_due(FakeBot(), scheduler))
+
+        self.assertGreaterEqual(stats["routes"], 3)
+        self.assertNotIn("purge", stats["stages"])
+        self.assertEqual(
+            (await get_current_price(self.session, self.route_ids[0])).best_price, 5210
+        )
+        self.assertGreater(scheduler.next_due(), datetime.now())
+
+
+def refresh_row(route_id: int, train, class_name: str) -> dict:
+    """маршрут в виде строки get_routes_for_refresh"""
+    return {
+        "route_id": route_id,
+        "from_station": train.station_code_from,
+        "to_station": train.station_code_to,
+        "from_date": train.datetime0,
+        "to_date": train.datetime1,
+        "train_no": train.route_id,
+        "class_name": class_name,
+        "best_price": None,
+    }
+
+
+def test_match_routes_reports_missing():
+    """Тест: сопоставление по ключу и маршруты, которых нет в выдаче"""
+    # поезд перенесли или отменили, у 016А нет св
+    cancelled = TRAINS[0]._replace(datetime0=TRAINS[0].datetime0 + timedelta(hours=1))
+    group = [
+        refresh_row(1, TRAINS[0], "купе"),
+        refresh_row(2, TRAINS[2], "купе"),
+        refresh_row(3, cancelled, "купе"),
+        refresh_row(4, TRAINS[3], "св"),
+    ]
+    matched, missing = update_db.match_routes(group, TRAINS)
+
+    assert [(obj["route_id"], route.route_id) for obj, route in matched] == [
+        (1, TRAINS[0].route_id),
+        (2, TRAINS[2].route_id),
+    ]
+    assert all(route.class_name == "купе" for _, route in matched)
+    assert [obj["route_id"] for obj in missing] == [3, 4]
+
+
+def test_match_routes_no_tickets():
+    """Тест: пустая выдача - все маршруты группы пропали"""
+    group = [refresh_row(1, TRAINS[0], "купе")]
+    assert update_db.match_routes(group, []) == ([], group)